@@ -1,11 +1,13 @@
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.views.generic import TemplateView
-from django.db.models import Count, Case, When, IntegerField
+from django.db.models import Count
 from django.utils import timezone
 from datetime import timedelta
 from django.http import JsonResponse
 from .models import SystemEvent
 from booking.models import ComputerBookingAttendance, SessionAttendance, ComputerBooking, LabSession
+from booking.timeranges import within_dates
+from reports.rollups import attendance_summary, usage_between, usage_totals
 import json
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required, user_passes_test
@@ -187,30 +189,13 @@ class AttendanceAnalyticsView(LoginRequiredMixin, PermissionRequiredMixin, Templ
         context = super().get_context_data(**kwargs)
         
         # Calculate date ranges
-        end_date = timezone.now().date()
+        end_date = timezone.localdate()
         start_date = end_date - timedelta(days=30)
         
-        # Get computer booking attendance stats
-        booking_attendance = ComputerBookingAttendance.objects.filter(
-            booking__start_time__date__range=[start_date, end_date]
-        ).aggregate(
-            total=Count('id'),
-            present=Count(Case(When(status='present', then=1), output_field=IntegerField())),
-            late=Count(Case(When(status='late', then=1), output_field=IntegerField())),
-            absent=Count(Case(When(status='absent', then=1), output_field=IntegerField())),
-            excused=Count(Case(When(status='excused', then=1), output_field=IntegerField())),
-        )
-        
-        # Get session attendance stats
-        session_attendance = SessionAttendance.objects.filter(
-            session__start_time__date__range=[start_date, end_date]
-        ).aggregate(
-            total=Count('id'),
-            present=Count(Case(When(status='present', then=1), output_field=IntegerField())),
-            late=Count(Case(When(status='late', then=1), output_field=IntegerField())),
-            absent=Count(Case(When(status='absent', then=1), output_field=IntegerField())),
-            excused=Count(Case(When(status='excused', then=1), output_field=IntegerField())),
-        )
+        # Attendance of bookings and sessions, summed from the daily usage rollups
+        totals = usage_between(start_date, end_date).aggregate(**usage_totals())
+        booking_attendance = attendance_summary(totals, 'booking')
+        session_attendance = attendance_summary(totals, 'session')
         
         context['booking_attendance'] = booking_attendance
         context['session_attendance'] = session_attendance
@@ -237,18 +222,18 @@ def is_admin(user):
 def admin_check_in_dashboard(request):
     """Dashboard for admins to view and manage check-ins"""
     # Get today's date
-    today = timezone.now().date()
+    today = timezone.localdate()
     
     # Get today's computer bookings
     today_bookings = ComputerBooking.objects.filter(
-        start_time__date=today,
+        **within_dates('start_time', today),
         is_approved=True,
         is_cancelled=False
     ).select_related('computer', 'student', 'attendance').order_by('start_time')
     
     # Get today's lab sessions
     today_sessions = LabSession.objects.filter(
-        start_time__date=today,
+        **within_dates('start_time', today),
         is_approved=True
     ).select_related('lab', 'lecturer').prefetch_related('attending_students').order_by('start_time')
     
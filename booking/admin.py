@@ -3,7 +3,7 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import User, Lab, Computer, ComputerBooking, LabSession, Notification, RecurringSession, StudentRating, LabAdministrator, Announcement
+from .models import User, Lab, Computer, ComputerBooking, LabSession, Notification, OutboxEmail, RecurringSession, StudentRating, LabAdministrator, Announcement
 
 @admin.register(User)
 class CustomUserAdmin(BaseUserAdmin):
@@ -58,6 +58,12 @@ class NotificationAdmin(admin.ModelAdmin):
     list_filter = ('notification_type', 'is_read')
     search_fields = ('user__username', 'message')
 
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('idempotency_key', 'recipient', 'created_at', 'sent_at', 'attempts', 'claimed_until')
+    list_filter = ('sent_at',)
+    search_fields = ('idempotency_key', 'recipient', 'subject')
+
 @admin.register(RecurringSession)
 class RecurringSessionAdmin(admin.ModelAdmin):
     list_display = ('lab', 'lecturer', 'title', 'recurrence_type', 'start_time', 'end_time')
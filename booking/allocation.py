@@ -0,0 +1,157 @@
+"""
+Automatic computer allocation.
+
+Given a lab, a start time and a duration, pick the computer for the student
+instead of having them guess one and learn at clean() time that it is taken.
+Every non-cancelled booking of the lab around the requested time is read
+with a single interval scan, then:
+
+* among the available computers free for the whole interval the best fit is
+  the one whose surrounding free gap is smallest, which keeps long free
+  stretches intact for longer bookings and limits fragmentation;
+* if no computer is free, the nearest start time (earlier or later, in
+  ALLOCATION_STEP steps within the search window and opening hours) at which
+  one is free is offered instead.
+
+Pending bookings count as taken, like in ComputerBookingForm, so an
+allocated computer does not clash with a request awaiting approval. That is
+also why the bookings are scanned here rather than read from the occupancy
+grids (booking.occupancy), which only hold approved bookings.
+"""
+from datetime import time, timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Computer, ComputerBooking, Lab
+from .occupancy import session_intervals
+
+ALLOCATION_STEP = timedelta(minutes=15)
+SEARCH_WINDOW = timedelta(days=1)
+
+# Alternative windows are only offered within these hours
+OPENING_TIME = time(hour=8)
+CLOSING_TIME = time(hour=20)
+
+
+def _overlaps(intervals, start, end):
+    return any(other_start < end and other_end > start for other_start, other_end in intervals)
+
+
+def _free_gap(intervals, start, end, floor, ceiling):
+    """Length of the free stretch around start..end on one computer."""
+    previous_end = max((other_end for _, other_end in intervals if other_end <= start), default=floor)
+    next_start = min((other_start for other_start, _ in intervals if other_start >= end), default=ceiling)
+    return next_start - previous_end
+
+
+def _within_opening_hours(start, end):
+    local_start = timezone.localtime(start)
+    local_end = timezone.localtime(end)
+    return (
+        local_start.date() == local_end.date()
+        and local_start.time() >= OPENING_TIME
+        and local_end.time() <= CLOSING_TIME
+    )
+
+
+class Allocator:
+    """
+    Computer availability of one lab around a requested time, loaded with
+    one query for the computers, one interval scan for the bookings and one
+    for the lab sessions.
+    """
+
+    def __init__(self, lab, window_start, window_end):
+        self.window_start = window_start
+        self.window_end = window_end
+        self.computers = list(
+            Computer.objects.filter(lab=lab, status='available').order_by('computer_number')
+        )
+        self.busy = {computer.id: [] for computer in self.computers}
+        for computer_id, start, end in ComputerBooking.objects.filter(
+            computer__lab=lab,
+            is_cancelled=False,
+            start_time__lt=window_end,
+            end_time__gt=window_start
+        ).values_list('computer_id', 'start_time', 'end_time'):
+            if computer_id in self.busy:
+                self.busy[computer_id].append((start, end))
+        self.sessions = session_intervals(lab.id, window_start, window_end)
+
+    def best_fit(self, start, end):
+        """The free computer with the tightest gap around start..end, or None."""
+        if _overlaps(self.sessions, start, end):
+            return None
+        candidates = [
+            (_free_gap(self.busy[computer.id], start, end, self.window_start, self.window_end), index)
+            for index, computer in enumerate(self.computers)
+            if not _overlaps(self.busy[computer.id], start, end)
+        ]
+        if not candidates:
+            return None
+        return self.computers[min(candidates)[1]]
+
+    def nearest_window(self, start, duration, search, not_before):
+        """
+        The (start, computer) closest to start within search, trying later
+        before earlier at equal distance, where a computer is free for duration.
+        """
+        for step in range(1, search // ALLOCATION_STEP + 1):
+            for candidate in (start + step * ALLOCATION_STEP, start - step * ALLOCATION_STEP):
+                candidate_end = candidate + duration
+                if candidate < not_before or not _within_opening_hours(candidate, candidate_end):
+                    continue
+                computer = self.best_fit(candidate, candidate_end)
+                if computer is not None:
+                    return candidate, computer
+        return None
+
+
+def allocate_computer(lab, start_time, duration, search=SEARCH_WINDOW):
+    """
+    Suggest a computer of lab for start_time..start_time + duration.
+
+    Returns a dict with the computer, start_time, end_time and exact (False
+    when the requested time was full and the nearest free window within
+    search is offered instead), or None when nothing is free.
+    """
+    end_time = start_time + duration
+    allocator = Allocator(lab, start_time - search, end_time + search)
+
+    computer = allocator.best_fit(start_time, end_time)
+    if computer is not None:
+        return {'computer': computer, 'start_time': start_time, 'end_time': end_time, 'exact': True}
+
+    nearest = allocator.nearest_window(start_time, duration, search, not_before=timezone.now())
+    if nearest is None:
+        return None
+    start_time, computer = nearest
+    return {'computer': computer, 'start_time': start_time, 'end_time': start_time + duration, 'exact': False}
+
+
+def book_computer(lab, student, start_time, duration, accept_alternative=False, search=SEARCH_WINDOW):
+    """
+    Allocate a computer and create the booking request in one step.
+
+    Allocations in a lab are serialised by a lock on the lab row, so two
+    students cannot be given the same computer. Returns (booking, allocation);
+    booking is None when nothing is free, or when only an alternative window
+    is available and accept_alternative is False.
+    """
+    with transaction.atomic():
+        # A no-op UPDATE locks the lab row (the database on SQLite), as in
+        # booking.overlap
+        Lab.objects.filter(pk=lab.pk).update(id=F('id'))
+        allocation = allocate_computer(lab, start_time, duration, search=search)
+        if allocation is None or not (allocation['exact'] or accept_alternative):
+            return None, allocation
+        booking = ComputerBooking(
+            computer=allocation['computer'],
+            student=student,
+            start_time=allocation['start_time'],
+            end_time=allocation['end_time']
+        )
+        booking.save()
+    return booking, allocation
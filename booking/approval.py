@@ -0,0 +1,501 @@
+"""
+Set-based approval of pending computer bookings.
+
+approve_bookings() decides a whole batch of requests in memory instead of
+saving them one by one. The approved bookings and lab sessions around the
+batch are read with one interval scan each. Requests are accepted first
+come, first served unless they overlap an approved booking, a lab session
+or a request accepted before them. The accepted requests are approved with
+a single UPDATE and their students notified with a single INSERT.
+Approval emails are queued in the email outbox in the same transaction.
+
+plan_approvals() is the approval planner for one lab and date range. It
+picks the compatible set of pending sessions and bookings with the most
+requests or the most booked hours. A session blocks the whole lab, as in
+ComputerBooking.clean(), so it is weighed against the bookings it would
+shut out: the requests are split into clusters of overlapping ones, and
+within a cluster a session is chosen only if its weight and the best
+booking schedules of the gaps around it beat leaving its time to bookings.
+The booking schedules are weighted interval scheduling per computer,
+O(n log n) for each session end in a cluster, so thousands of requests
+plan in well under a second (see benchmark_approval_plan). apply_plan()
+re-plans and applies the result in one transaction.
+"""
+import hashlib
+from bisect import bisect_right
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .email_utils import send_booking_approval_emails, send_session_approval_emails
+from .models import ComputerBooking, Lab, LabSession, Notification
+from .notifications import bulk_notify
+from .occupancy import days_touched, refresh_computer_rows, refresh_session_rows, session_intervals
+from .signals import schedule_changed
+from .timeranges import date_range
+
+
+def _overlaps(intervals, start, end):
+    return any(other_start < end and other_end > start for other_start, other_end in intervals)
+
+
+class ApprovalBatch:
+    """
+    Pending bookings and what they can conflict with: the approved bookings
+    of their computers and the approved sessions of their labs.
+    """
+
+    def __init__(self, pending):
+        self.pending = list(pending)
+        self.taken = {}
+        self.sessions = {}
+        if not self.pending:
+            return
+        window_start = min(booking.start_time for booking in self.pending)
+        window_end = max(booking.end_time for booking in self.pending)
+        for computer_id, start, end in ComputerBooking.objects.filter(
+            computer_id__in={booking.computer_id for booking in self.pending},
+            is_approved=True,
+            is_cancelled=False,
+            start_time__lt=window_end,
+            end_time__gt=window_start
+        ).values_list('computer_id', 'start_time', 'end_time'):
+            self.taken.setdefault(computer_id, []).append((start, end))
+        for lab_id in {booking.computer.lab_id for booking in self.pending}:
+            self.sessions[lab_id] = session_intervals(lab_id, window_start, window_end)
+
+    def conflict(self, booking):
+        """Why booking cannot be approved alongside what is approved already, or None."""
+        if booking.end_time <= booking.start_time:
+            return 'End time must be after start time'
+        if _overlaps(self.taken.get(booking.computer_id, ()), booking.start_time, booking.end_time):
+            return 'Computer is already booked for this time slot'
+        if _overlaps(self.sessions.get(booking.computer.lab_id, ()), booking.start_time, booking.end_time):
+            return 'Lab is reserved for a session during this time slot'
+        return None
+
+    def first_come(self):
+        """
+        Accept requests in the order they were made. Returns (accepted,
+        skipped) where skipped holds (booking, reason) pairs.
+        """
+        accepted, skipped = [], []
+        accepted_intervals = {}
+        for booking in sorted(self.pending, key=lambda booking: (booking.created_at, booking.id)):
+            reason = self.conflict(booking)
+            if reason is None and _overlaps(
+                accepted_intervals.get(booking.computer_id, ()), booking.start_time, booking.end_time
+            ):
+                reason = 'Overlaps an earlier request approved in this batch'
+            if reason is None:
+                accepted.append(booking)
+                accepted_intervals.setdefault(booking.computer_id, []).append(
+                    (booking.start_time, booking.end_time)
+                )
+            else:
+                skipped.append((booking, reason))
+        return accepted, skipped
+
+
+def apply_approvals(bookings):
+    """
+    Approve bookings already checked against each other and everything
+    approved: one UPDATE, one notification INSERT and one outbox INSERT,
+    then the occupancy refresh once the transaction commits.
+    """
+    if not bookings:
+        return
+    now = timezone.now()
+    booking_ids = [booking.id for booking in bookings]
+    ComputerBooking.objects.filter(id__in=booking_ids).update(is_approved=True, approved_at=now)
+    for booking in bookings:
+        booking.is_approved = True
+        booking.approved_at = now
+
+    bulk_notify(
+        Notification(
+            user_id=booking.student_id,
+            message=f"Your booking for {booking.computer} has been approved.",
+            notification_type='booking_approved',
+            booking=booking
+        )
+        for booking in bookings
+    )
+
+    # update() sends no signals, so refresh the occupancy grids here
+    changed_days = {}
+    for booking in bookings:
+        changed_days.setdefault(booking.computer_id, set()).update(
+            days_touched(booking.start_time, booking.end_time)
+        )
+    for computer_id, days in changed_days.items():
+        transaction.on_commit(lambda computer_id=computer_id, days=days: refresh_computer_rows(computer_id, days))
+    schedule_changed.send(
+        sender=ComputerBooking,
+        changes={(booking.computer_id, timezone.localdate(booking.start_time)) for booking in bookings}
+    )
+    send_booking_approval_emails(bookings)
+
+
+def approve_bookings(queryset):
+    """
+    Approve the pending bookings of queryset that conflict neither with
+    approved bookings and sessions nor with each other.
+
+    Returns (approved, skipped), skipped being (booking, reason) pairs of
+    requests left pending.
+    """
+    with transaction.atomic():
+        pending = queryset.filter(is_approved=False, is_cancelled=False)
+        computer_ids = set(pending.values_list('computer_id', flat=True))
+        # Lock the labs, as save_with_overlap_rule does for one booking, so
+        # nothing is approved in them between the check and the UPDATE
+        Lab.objects.filter(computers__in=computer_ids).update(id=F('id'))
+
+        batch = ApprovalBatch(pending.select_related('computer__lab', 'student'))
+        approved, skipped = batch.first_come()
+        apply_approvals(approved)
+    return approved, skipped
+
+
+def apply_session_approvals(sessions):
+    """
+    Approve lab sessions already checked against each other and the
+    approved sessions, as apply_approvals() does for bookings.
+    """
+    if not sessions:
+        return
+    session_ids = [session.id for session in sessions]
+    LabSession.objects.filter(id__in=session_ids).update(is_approved=True)
+    for session in sessions:
+        session.is_approved = True
+
+    bulk_notify(
+        Notification(
+            user_id=session.lecturer_id,
+            message=f"Your session for {session.lab.name} has been approved.",
+            notification_type='booking_approved',
+            lab_session=session
+        )
+        for session in sessions
+    )
+
+    changed_days = {}
+    for session in sessions:
+        changed_days.setdefault(session.lab_id, set()).update(
+            days_touched(session.start_time, session.end_time)
+        )
+    for lab_id, days in changed_days.items():
+        transaction.on_commit(lambda lab_id=lab_id, days=days: refresh_session_rows(lab_id, days))
+    schedule_changed.send(
+        sender=LabSession,
+        changes={(session.lab_id, timezone.localdate(session.start_time)) for session in sessions}
+    )
+    send_session_approval_emails(sessions)
+
+
+# Planner objectives: the weight of a request
+PLAN_OBJECTIVES = {
+    'count': lambda item: 1,
+    'hours': lambda item: int((item.end_time - item.start_time).total_seconds()),
+}
+
+
+class IntervalSet:
+    """Sorted, merged intervals answering overlap tests by bisection."""
+
+    def __init__(self, intervals):
+        self.starts, self.ends = [], []
+        for start, end in sorted(intervals):
+            if self.ends and start < self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def overlaps(self, start, end):
+        index = bisect_right(self.ends, start)
+        return index < len(self.starts) and self.starts[index] < end
+
+
+def weighted_interval_schedule(items, weight):
+    """
+    The non-overlapping subset of items (with start_time and end_time)
+    of greatest total weight.
+    """
+    items = sorted(items, key=lambda item: (item.end_time, item.start_time))
+    ends = [item.end_time for item in items]
+    best = [0] * (len(items) + 1)
+    previous = [0] * len(items)
+    taken = [False] * len(items)
+    for index, item in enumerate(items):
+        # Items before previous[index] all end by the time this one starts
+        previous[index] = bisect_right(ends, item.start_time, 0, index)
+        with_item = best[previous[index]] + weight(item)
+        taken[index] = with_item > best[index]
+        best[index + 1] = with_item if taken[index] else best[index]
+
+    chosen = []
+    index = len(items)
+    while index:
+        if taken[index - 1]:
+            chosen.append(items[index - 1])
+            index = previous[index - 1]
+        else:
+            index -= 1
+    chosen.reverse()
+    return chosen
+
+
+class ApprovalPlan:
+    """
+    The pending sessions and bookings of a lab to approve together, and
+    the (request, reason) pairs of those to leave pending.
+    """
+
+    def __init__(self, lab, start_date, end_date, objective):
+        self.lab = lab
+        self.start_date = start_date
+        self.end_date = end_date
+        self.objective = objective
+        self.sessions = []
+        self.bookings = []
+        self.rejected = []
+
+    @property
+    def hours(self):
+        return sum(
+            (item.end_time - item.start_time).total_seconds() for item in self.sessions + self.bookings
+        ) / 3600
+
+    @property
+    def signature(self):
+        """Identifies the plan, so an apply can tell whether it changed since the preview."""
+        ids = [f's{item.id}' for item in self.sessions] + [f'b{item.id}' for item in self.bookings]
+        return hashlib.sha1(','.join(sorted(ids)).encode()).hexdigest()
+
+
+def plan_approvals(lab, start_date, end_date=None, objective='count'):
+    """
+    Plan the approval of the pending requests of lab starting on the local
+    dates start_date to end_date. objective is a key of PLAN_OBJECTIVES:
+    'count' approves as many requests as possible, 'hours' books as many
+    hours as possible.
+    """
+    weight = PLAN_OBJECTIVES[objective]
+    plan = ApprovalPlan(lab, start_date, end_date, objective)
+    range_start, range_end = date_range(start_date, end_date)
+    now = timezone.now()
+
+    pending_sessions = list(LabSession.objects.filter(
+        lab=lab,
+        is_approved=False,
+        is_cancelled=False,
+        start_time__gte=range_start,
+        start_time__lt=range_end,
+        end_time__gt=now
+    ).select_related('lab', 'lecturer'))
+    pending_bookings = list(ComputerBooking.objects.filter(
+        computer__lab=lab,
+        is_approved=False,
+        is_cancelled=False,
+        start_time__gte=range_start,
+        start_time__lt=range_end,
+        end_time__gt=now
+    ).select_related('computer__lab', 'student'))
+    pending = pending_sessions + pending_bookings
+    if not pending:
+        return plan
+
+    window_start = min(item.start_time for item in pending)
+    window_end = max(item.end_time for item in pending)
+    approved_sessions = IntervalSet(session_intervals(lab.id, window_start, window_end))
+    booking_times = {}
+    for computer_id, start, end in ComputerBooking.objects.filter(
+        computer__lab=lab,
+        is_approved=True,
+        is_cancelled=False,
+        start_time__lt=window_end,
+        end_time__gt=window_start
+    ).values_list('computer_id', 'start_time', 'end_time'):
+        booking_times.setdefault(computer_id, []).append((start, end))
+    approved_bookings = {computer_id: IntervalSet(times) for computer_id, times in booking_times.items()}
+
+    session_candidates = []
+    for session in pending_sessions:
+        if session.end_time <= session.start_time:
+            plan.rejected.append((session, 'End time must be after start time'))
+        elif approved_sessions.overlaps(session.start_time, session.end_time):
+            plan.rejected.append((session, 'Lab is already booked for this time slot'))
+        else:
+            session_candidates.append(session)
+
+    booking_candidates = []
+    for booking in pending_bookings:
+        if booking.end_time <= booking.start_time:
+            plan.rejected.append((booking, 'End time must be after start time'))
+            continue
+        taken = approved_bookings.get(booking.computer_id)
+        if taken is not None and taken.overlaps(booking.start_time, booking.end_time):
+            plan.rejected.append((booking, 'Computer is already booked for this time slot'))
+        elif approved_sessions.overlaps(booking.start_time, booking.end_time):
+            plan.rejected.append((booking, 'Lab is reserved for a session during this time slot'))
+        else:
+            booking_candidates.append(booking)
+
+    for sessions, bookings in _clusters(session_candidates, booking_candidates):
+        chosen_sessions, chosen_bookings = _plan_cluster(sessions, bookings, weight)
+        plan.sessions += chosen_sessions
+        plan.bookings += chosen_bookings
+        blocked = IntervalSet([(session.start_time, session.end_time) for session in chosen_sessions])
+        chosen = set(chosen_sessions) | set(chosen_bookings)
+        for item in sessions + bookings:
+            if item in chosen:
+                continue
+            if isinstance(item, ComputerBooking) and blocked.overlaps(item.start_time, item.end_time):
+                plan.rejected.append((item, 'Lab is reserved for a session chosen for the plan'))
+            else:
+                plan.rejected.append((item, 'Overlaps a request chosen for the plan'))
+    plan.sessions.sort(key=lambda session: session.start_time)
+    plan.bookings.sort(key=lambda booking: booking.start_time)
+    return plan
+
+
+def _clusters(sessions, bookings):
+    """
+    Split requests into (sessions, bookings) groups whose time spans do not
+    overlap, so no request conflicts with one of another group.
+    """
+    items = sorted(sessions + bookings, key=lambda item: item.start_time)
+    group, group_end = [], None
+    for item in items:
+        if group and item.start_time >= group_end:
+            yield _split(group)
+            group = []
+        group_end = item.end_time if not group else max(group_end, item.end_time)
+        group.append(item)
+    if group:
+        yield _split(group)
+
+
+def _split(items):
+    return (
+        [item for item in items if isinstance(item, LabSession)],
+        [item for item in items if isinstance(item, ComputerBooking)],
+    )
+
+
+class BookingSchedules:
+    """
+    Total weight of the best per-computer booking schedules of the bookings
+    starting at or after a time, for any end time, built in one pass over
+    the bookings in end order.
+    """
+
+    def __init__(self, bookings, weight):
+        self.ends, self.totals = [], []
+        computers = {}
+        total = 0
+        for booking in sorted(bookings, key=lambda booking: booking.end_time):
+            # Per computer: end times so far and the best weight using the
+            # first i of its bookings
+            ends, best = computers.setdefault(booking.computer_id, ([], [0]))
+            value = max(best[-1], best[bisect_right(ends, booking.start_time)] + weight(booking))
+            total += value - best[-1]
+            ends.append(booking.end_time)
+            best.append(value)
+            self.ends.append(booking.end_time)
+            self.totals.append(total)
+
+    def until(self, end):
+        """Weight of the best schedules of the bookings ending by end."""
+        index = bisect_right(self.ends, end)
+        return self.totals[index - 1] if index else 0
+
+
+def _plan_cluster(sessions, bookings, weight):
+    """
+    The sessions and bookings of one cluster to approve: the non-overlapping
+    sessions whose weights, plus the best booking schedules of the gaps
+    between them, add up to the most.
+    """
+    if not sessions:
+        return [], _schedule_bookings(bookings, weight)
+    cluster_end = max(item.end_time for item in sessions + bookings)
+
+    # Booking schedules starting at the beginning or after each session end
+    cuts = [None] + sorted({session.end_time for session in sessions})
+    schedules = {
+        cut: BookingSchedules(
+            [booking for booking in bookings if cut is None or booking.start_time >= cut], weight
+        )
+        for cut in cuts
+    }
+
+    # best[index]: the most a plan can weigh up to the end of sessions[index]
+    # when that session is its last
+    sessions = sorted(sessions, key=lambda session: (session.end_time, session.start_time))
+    best, previous = [], []
+    for session in sessions:
+        value, before = schedules[None].until(session.start_time), None
+        for index in range(len(best)):
+            if sessions[index].end_time <= session.start_time:
+                candidate = best[index] + schedules[sessions[index].end_time].until(session.start_time)
+                if candidate > value:
+                    value, before = candidate, index
+        best.append(value + weight(session))
+        previous.append(before)
+
+    value, last = schedules[None].until(cluster_end), None
+    for index, session in enumerate(sessions):
+        candidate = best[index] + schedules[session.end_time].until(cluster_end)
+        if candidate > value:
+            value, last = candidate, index
+
+    chosen = []
+    while last is not None:
+        chosen.append(sessions[last])
+        last = previous[last]
+    chosen.reverse()
+
+    # The bookings of the gaps between the chosen sessions
+    gaps = [session.start_time for session in chosen] + [cluster_end]
+    gap_start = None
+    chosen_bookings = []
+    for index, gap_end in enumerate(gaps):
+        chosen_bookings += _schedule_bookings([
+            booking for booking in bookings
+            if (gap_start is None or booking.start_time >= gap_start) and booking.end_time <= gap_end
+        ], weight)
+        if index < len(chosen):
+            gap_start = chosen[index].end_time
+    return chosen, chosen_bookings
+
+
+def _schedule_bookings(bookings, weight):
+    by_computer = {}
+    for booking in bookings:
+        by_computer.setdefault(booking.computer_id, []).append(booking)
+    return [
+        booking for candidates in by_computer.values()
+        for booking in weighted_interval_schedule(candidates, weight)
+    ]
+
+
+def apply_plan(lab, start_date, end_date=None, objective='count', expected_signature=None):
+    """
+    Plan and approve in one transaction, with the lab locked so nothing is
+    approved there meanwhile. When expected_signature
+    (of a previewed plan) no longer matches, nothing is approved.
+
+    Returns (plan, applied).
+    """
+    with transaction.atomic():
+        Lab.objects.filter(pk=lab.pk).update(id=F('id'))
+        plan = plan_approvals(lab, start_date, end_date, objective)
+        if expected_signature is not None and plan.signature != expected_signature:
+            return plan, False
+        apply_session_approvals(plan.sessions)
+        apply_approvals(plan.bookings)
+    return plan, True
@@ -0,0 +1,172 @@
+"""
+In-memory availability engine for labs and computers.
+
+Availability used to be answered one slot at a time with overlap queries.
+Here the approved bookings and lab sessions for a whole window are loaded
+once (one query each) and swept in start-time order against the requested
+slots, so the number of queries stays constant however many slots or
+computers are involved.
+
+booking.occupancy.week_view answers from the stored occupancy grids when
+a window has them and from this engine otherwise, so a read never has to
+build and store grids. overlap_flags() also intersects the occurrences of
+a recurring series with the sessions already booked in its lab.
+"""
+import heapq
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import Computer, ComputerBooking, LabSession
+from .recurrence import lazy_expansion_enabled, recurring_occurrences
+
+
+def hourly_slots(start_date, end_date, first_hour=8, last_hour=20):
+    """
+    Return aware (start, end) hourly slots for every day from start_date
+    to end_date inclusive, between first_hour and last_hour.
+    """
+    slots = []
+    current_date = start_date
+    while current_date <= end_date:
+        for hour in range(first_hour, last_hour):
+            slot_start = timezone.make_aware(datetime.combine(current_date, time(hour=hour)))
+            slots.append((slot_start, slot_start + timedelta(hours=1)))
+        current_date += timedelta(days=1)
+    return slots
+
+
+def overlap_flags(intervals, blockers):
+    """
+    For each (start, end) in intervals, report whether it overlaps any
+    (start, end) in blockers. Both sequences are swept once in start order;
+    the intervals may have any lengths and overlap each other.
+
+    Returns a list of booleans aligned with intervals.
+    """
+    order = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+    blockers = sorted(blockers, key=lambda b: b[0])
+    flags = [False] * len(intervals)
+
+    active = []  # heap of the (start, end) of blockers starting before an interval's end
+    next_blocker = 0
+    for i in order:
+        start, end = intervals[i][0], intervals[i][1]
+        while next_blocker < len(blockers) and blockers[next_blocker][0] < end:
+            heapq.heappush(active, (blockers[next_blocker][0], blockers[next_blocker][1]))
+            next_blocker += 1
+        # Intervals are visited in start order, so a blocker ending before
+        # this start can never overlap a later interval either.
+        while active and active[0][1] <= start:
+            heapq.heappop(active)
+        # A blocker pushed for an earlier, longer interval may start after
+        # this one ends; the earliest starting live blocker decides
+        flags[i] = bool(active) and active[0][0] < end
+    return flags
+
+
+class LabAvailability:
+    """
+    Availability of a lab (or a single computer in it) over a time window.
+
+    All data is fetched by load(): the lab's computers, approved bookings
+    and approved lab sessions overlapping the window (plus the occurrences
+    of lazily expanded recurring series). Slot questions are then answered
+    in memory.
+    """
+
+    def __init__(self, lab, window_start, window_end, computer=None):
+        self.lab = lab
+        self.computer = computer
+        self.window_start = window_start
+        self.window_end = window_end
+        self.computer_ids = []
+        self.bookings = []
+        self.sessions = []
+        self._loaded = False
+
+    def load(self):
+        if self._loaded:
+            return self
+
+        if self.computer is not None:
+            self.computer_ids = [self.computer.id]
+            bookings = ComputerBooking.objects.filter(computer=self.computer)
+        else:
+            self.computer_ids = list(
+                Computer.objects.filter(lab=self.lab).values_list('id', flat=True)
+            )
+            bookings = ComputerBooking.objects.filter(computer__lab=self.lab)
+
+        self.bookings = sorted(bookings.filter(
+            is_approved=True,
+            is_cancelled=False,
+            start_time__lt=self.window_end,
+            end_time__gt=self.window_start
+        ).values_list('start_time', 'end_time', 'computer_id'))
+
+        self.sessions = sorted(LabSession.objects.filter(
+            lab=self.lab,
+            is_approved=True,
+            is_cancelled=False,
+            start_time__lt=self.window_end,
+            end_time__gt=self.window_start
+        ).values_list('start_time', 'end_time'))
+        if lazy_expansion_enabled():
+            self.sessions = sorted(self.sessions + [
+                (session.start_time, session.end_time)
+                for session in recurring_occurrences(self.window_start, self.window_end, labs=[self.lab])
+            ])
+
+        self._loaded = True
+        return self
+
+    def slot_availability(self, slots):
+        """
+        Sweep the loaded intervals against slots.
+
+        slots must be (start, end) pairs sorted by start and not overlapping
+        each other. Returns one dict per slot with the number of free
+        computers, whether a lab session blocks it and the overall is_free.
+        """
+        self.load()
+
+        session_blocked = overlap_flags(slots, self.sessions)
+        total_computers = len(self.computer_ids)
+
+        results = []
+        active = []  # heap of (end_time, computer_id)
+        active_per_computer = {}
+        next_booking = 0
+        for index, (slot_start, slot_end) in enumerate(slots):
+            while next_booking < len(self.bookings) and self.bookings[next_booking][0] < slot_end:
+                start, end, computer_id = self.bookings[next_booking]
+                heapq.heappush(active, (end, computer_id))
+                active_per_computer[computer_id] = active_per_computer.get(computer_id, 0) + 1
+                next_booking += 1
+            while active and active[0][0] <= slot_start:
+                _, computer_id = heapq.heappop(active)
+                active_per_computer[computer_id] -= 1
+                if not active_per_computer[computer_id]:
+                    del active_per_computer[computer_id]
+
+            free_computers = total_computers - len(active_per_computer)
+            blocked = session_blocked[index]
+            results.append({
+                'start_time': slot_start,
+                'end_time': slot_end,
+                'free_computers': free_computers,
+                'booked_computers': len(active_per_computer),
+                'session_blocked': blocked,
+                'is_free': free_computers > 0 and not blocked,
+            })
+        return results
+
+
+def lab_slot_availability(lab, slots, computer=None):
+    """Convenience wrapper: availability for slots of a lab or a single computer."""
+    if not slots:
+        return []
+    window_start = min(start for start, _ in slots)
+    window_end = max(end for _, end in slots)
+    return LabAvailability(lab, window_start, window_end, computer=computer).slot_availability(slots)
@@ -1,150 +1,145 @@
 """
 Email utilities for booking and session notifications.
 Handles sending automated emails for booking/session approvals and rejections.
+
+Booking and session emails go through an outbox: the send_* functions write
+an OutboxEmail row in the caller's transaction and set the instance's
+*_email_sent flag, which together with the row's idempotency key makes sure
+each transition is emailed at most once. drain_outbox() renders and sends
+the queued emails in batches over a single SMTP connection.
+
+A batch is claimed in a short transaction of its own, which counts the
+attempt and leases the rows for OUTBOX_LEASE, and is sent after it commits,
+so no row lock or transaction is held while SMTP is slow. A drain that dies
+mid-batch leaves its rows to be retried once the lease runs out; an email it
+had already sent is then sent again.
 """
 
-from django.core.mail import send_mail, EmailMultiAlternatives
+from django.core.mail import send_mail, EmailMultiAlternatives, get_connection
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
 from django.utils import timezone
 from django.urls import reverse
+from datetime import timedelta
 import logging
 
+from .models import OutboxEmail
+
 logger = logging.getLogger(__name__)
 
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 5
+# How long a drain may take to send a claimed batch before others retry it
+OUTBOX_LEASE = timedelta(minutes=10)
 
-def send_booking_approval_email(booking):
+
+def _kick_outbox():
+    """Ask a worker to drain the outbox now; the periodic drain catches up otherwise."""
+    from .tasks import drain_email_outbox
+    try:
+        drain_email_outbox.delay()
+    except Exception as e:
+        logger.warning(f"Could not queue the email outbox drain: {str(e)}")
+
+
+def _queue_emails(instances, flag, build):
     """
-    Send email to student when their booking is approved.
-    Prevents duplicate emails by checking the approval_email_sent flag.
+    Queue the email of every instance whose flag is not set yet, and set
+    the flag, within the caller's transaction.
     
     Args:
-        booking: ComputerBooking instance
+        instances: bookings or sessions of one model
+        flag: name of the *_email_sent field guarding the email
+        build: callable returning the unsaved OutboxEmail of an instance
     """
-    # Prevent duplicate emails
-    if booking.approval_email_sent:
-        logger.info(f"Approval email already sent for booking {booking.id}, skipping")
-        return True
+    pending = [instance for instance in instances if not getattr(instance, flag)]
+    if not pending:
+        return 0
     
-    try:
-        subject = f"Your Computer Booking Has Been Approved - {booking.computer}"
-        
-        # Generate booking history URL
-        booking_url = f"{settings.BASE_URL}/profile/booking-history/" if settings.BASE_URL else "#"
-        
-        # Prepare context for the email template
-        context = {
+    with transaction.atomic():
+        # The unique key absorbs a concurrent request queuing the same email
+        OutboxEmail.objects.bulk_create([build(instance) for instance in pending], ignore_conflicts=True)
+        type(pending[0]).objects.filter(pk__in=[instance.pk for instance in pending]).update(**{flag: True})
+        transaction.on_commit(_kick_outbox)
+    
+    for instance in pending:
+        setattr(instance, flag, True)
+    return len(pending)
+
+
+def _booking_approval(booking):
+    # Generate booking history URL
+    booking_url = f"{settings.BASE_URL}/profile/booking-history/" if settings.BASE_URL else "#"
+    return OutboxEmail(
+        idempotency_key=f"booking:{booking.id}:approval",
+        template='emails/booking_approved',
+        subject=f"Your Computer Booking Has Been Approved - {booking.computer}",
+        recipient=booking.student.email,
+        context={
             'student_name': booking.student.get_full_name(),
-            'computer': booking.computer,
+            'computer': str(booking.computer),
             'lab': booking.computer.lab.name,
             'start_time': booking.start_time.strftime('%B %d, %Y at %I:%M %p'),
             'end_time': booking.end_time.strftime('%I:%M %p'),
-            'booking_code': booking.booking_code,
+            'booking_code': str(booking.booking_code),
             'purpose': booking.purpose or 'Not specified',
             'booking_url': booking_url,
         }
-        
-        # Render HTML and text versions
-        html_message = render_to_string('emails/booking_approved.html', context)
-        text_message = render_to_string('emails/booking_approved.txt', context)
-        
-        # Create email
-        email = EmailMultiAlternatives(
-            subject=subject,
-            body=text_message,
-            from_email=settings.EMAIL_HOST_USER,
-            to=[booking.student.email]
-        )
-        email.attach_alternative(html_message, "text/html")
-        email.send(fail_silently=False)
-        
-        # Mark email as sent
-        booking.approval_email_sent = True
-        booking.save(update_fields=['approval_email_sent'])
-        
-        logger.info(f"Booking approval email sent to {booking.student.email} for booking {booking.id}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to send booking approval email: {str(e)}")
-        return False
+    )
 
 
-def send_booking_rejection_email(booking, rejection_reason=""):
-    """
-    Send email to student when their booking is rejected.
-    Prevents duplicate emails by checking the rejection_email_sent flag.
-    
-    Args:
-        booking: ComputerBooking instance
-        rejection_reason: Optional reason for rejection
-    """
-    # Prevent duplicate emails
-    if booking.rejection_email_sent:
-        logger.info(f"Rejection email already sent for booking {booking.id}, skipping")
-        return True
-    
-    try:
-        subject = f"Your Computer Booking Has Been Rejected - {booking.computer}"
-        
-        # Generate support URL
-        support_url = f"{settings.BASE_URL}/support/" if settings.BASE_URL else "#"
-        
-        context = {
+def _booking_rejection(booking, rejection_reason=""):
+    # Generate support URL
+    support_url = f"{settings.BASE_URL}/support/" if settings.BASE_URL else "#"
+    return OutboxEmail(
+        idempotency_key=f"booking:{booking.id}:rejection",
+        template='emails/booking_rejected',
+        subject=f"Your Computer Booking Has Been Rejected - {booking.computer}",
+        recipient=booking.student.email,
+        context={
             'student_name': booking.student.get_full_name(),
-            'computer': booking.computer,
+            'computer': str(booking.computer),
             'lab': booking.computer.lab.name,
             'start_time': booking.start_time.strftime('%B %d, %Y at %I:%M %p'),
             'end_time': booking.end_time.strftime('%I:%M %p'),
             'rejection_reason': rejection_reason or 'Booking request could not be accommodated.',
             'support_url': support_url,
         }
-        
-        html_message = render_to_string('emails/booking_rejected.html', context)
-        text_message = render_to_string('emails/booking_rejected.txt', context)
-        
-        email = EmailMultiAlternatives(
-            subject=subject,
-            body=text_message,
-            from_email=settings.EMAIL_HOST_USER,
-            to=[booking.student.email]
-        )
-        email.attach_alternative(html_message, "text/html")
-        email.send(fail_silently=False)
-        
-        # Mark email as sent
-        booking.rejection_email_sent = True
-        booking.save(update_fields=['rejection_email_sent'])
-        
-        logger.info(f"Booking rejection email sent to {booking.student.email} for booking {booking.id}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to send booking rejection email: {str(e)}")
-        return False
+    )
 
 
-def send_session_approval_email(session):
-    """
-    Send email to lecturer when their lab session is approved.
-    Prevents duplicate emails by checking the approval_email_sent flag.
-    
-    Args:
-        session: LabSession instance
-    """
-    # Prevent duplicate emails
-    if session.approval_email_sent:
-        logger.info(f"Approval email already sent for session {session.id}, skipping")
-        return True
-    
-    try:
-        subject = f"Your Lab Session Has Been Approved - {session.title}"
-        
-        # Generate recurring sessions list URL
-        sessions_url = f"{settings.BASE_URL}/recurring/sessions/" if settings.BASE_URL else "#"
-        
-        context = {
+def _booking_cancellation(booking, cancelled_by=None, reason=""):
+    support_url = f"{settings.BASE_URL}/support/" if settings.BASE_URL else "#"
+    return OutboxEmail(
+        idempotency_key=f"booking:{booking.id}:cancellation",
+        template='emails/booking_cancelled',
+        subject=f"Your Computer Booking Has Been Cancelled - {booking.computer}",
+        recipient=booking.student.email,
+        context={
+            'student_name': booking.student.get_full_name(),
+            'computer': str(booking.computer),
+            'lab': booking.computer.lab.name,
+            'start_time': booking.start_time.strftime('%B %d, %Y at %I:%M %p'),
+            'end_time': booking.end_time.strftime('%I:%M %p'),
+            'cancelled_by': cancelled_by or 'Administrator',
+            'cancellation_reason': reason or 'No reason provided.',
+            'support_url': support_url,
+        }
+    )
+
+
+def _session_approval(session):
+    # Generate recurring sessions list URL
+    sessions_url = f"{settings.BASE_URL}/recurring/sessions/" if settings.BASE_URL else "#"
+    return OutboxEmail(
+        idempotency_key=f"session:{session.id}:approval",
+        template='emails/session_approved',
+        subject=f"Your Lab Session Has Been Approved - {session.title}",
+        recipient=session.lecturer.email,
+        context={
             'lecturer_name': session.lecturer.get_full_name(),
             'session_title': session.title,
             'lab': session.lab.name,
@@ -153,52 +148,17 @@ def send_session_approval_email(session):
             'student_count': session.attending_students.count(),
             'session_url': sessions_url,
         }
-        
-        html_message = render_to_string('emails/session_approved.html', context)
-        text_message = render_to_string('emails/session_approved.txt', context)
-        
-        email = EmailMultiAlternatives(
-            subject=subject,
-            body=text_message,
-            from_email=settings.EMAIL_HOST_USER,
-            to=[session.lecturer.email]
-        )
-        email.attach_alternative(html_message, "text/html")
-        email.send(fail_silently=False)
-        
-        # Mark email as sent
-        session.approval_email_sent = True
-        session.save(update_fields=['approval_email_sent'])
-        
-        logger.info(f"Session approval email sent to {session.lecturer.email} for session {session.id}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to send session approval email: {str(e)}")
-        return False
+    )
 
 
-def send_session_rejection_email(session, rejection_reason=""):
-    """
-    Send email to lecturer when their lab session is rejected.
-    Prevents duplicate emails by checking the rejection_email_sent flag.
-    
-    Args:
-        session: LabSession instance
-        rejection_reason: Optional reason for rejection
-    """
-    # Prevent duplicate emails
-    if session.rejection_email_sent:
-        logger.info(f"Rejection email already sent for session {session.id}, skipping")
-        return True
-    
-    try:
-        subject = f"Your Lab Session Has Been Rejected - {session.title}"
-        
-        # Generate support URL
-        support_url = f"{settings.BASE_URL}/support/" if settings.BASE_URL else "#"
-        
-        context = {
+def _session_rejection(session, rejection_reason=""):
+    support_url = f"{settings.BASE_URL}/support/" if settings.BASE_URL else "#"
+    return OutboxEmail(
+        idempotency_key=f"session:{session.id}:rejection",
+        template='emails/session_rejected',
+        subject=f"Your Lab Session Has Been Rejected - {session.title}",
+        recipient=session.lecturer.email,
+        context={
             'lecturer_name': session.lecturer.get_full_name(),
             'session_title': session.title,
             'lab': session.lab.name,
@@ -207,34 +167,92 @@ def send_session_rejection_email(session, rejection_reason=""):
             'rejection_reason': rejection_reason or 'Session request could not be accommodated.',
             'support_url': support_url,
         }
-        
-        html_message = render_to_string('emails/session_rejected.html', context)
-        text_message = render_to_string('emails/session_rejected.txt', context)
-        
-        email = EmailMultiAlternatives(
-            subject=subject,
-            body=text_message,
-            from_email=settings.EMAIL_HOST_USER,
-            to=[session.lecturer.email]
-        )
-        email.attach_alternative(html_message, "text/html")
-        email.send(fail_silently=False)
-        
-        # Mark email as sent
-        session.rejection_email_sent = True
-        session.save(update_fields=['rejection_email_sent'])
-        
-        logger.info(f"Session rejection email sent to {session.lecturer.email} for session {session.id}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to send session rejection email: {str(e)}")
-        return False
+    )
+
+
+def _session_cancellation(session, cancelled_by=None, reason=""):
+    support_url = f"{settings.BASE_URL}/support/" if settings.BASE_URL else "#"
+    return OutboxEmail(
+        idempotency_key=f"session:{session.id}:cancellation",
+        template='emails/session_cancelled',
+        subject=f"Your Lab Session Has Been Cancelled - {session.title}",
+        recipient=session.lecturer.email,
+        context={
+            'lecturer_name': session.lecturer.get_full_name(),
+            'session_title': session.title,
+            'lab': session.lab.name,
+            'start_time': session.start_time.strftime('%B %d, %Y at %I:%M %p'),
+            'end_time': session.end_time.strftime('%I:%M %p'),
+            'cancelled_by': cancelled_by or 'Administrator',
+            'cancellation_reason': reason or 'No reason provided.',
+            'support_url': support_url,
+        }
+    )
+
+
+def send_booking_approval_email(booking):
+    """
+    Queue the email to the student whose booking is approved.
+    Prevents duplicate emails by checking the approval_email_sent flag.
+    
+    Args:
+        booking: ComputerBooking instance
+    """
+    _queue_emails([booking], 'approval_email_sent', _booking_approval)
+    return True
+
+
+def send_booking_approval_emails(bookings):
+    """Queue the approval emails of many bookings with one insert; returns how many were queued"""
+    return _queue_emails(bookings, 'approval_email_sent', _booking_approval)
+
+
+def send_booking_rejection_email(booking, rejection_reason=""):
+    """
+    Queue the email to the student whose booking is rejected.
+    Prevents duplicate emails by checking the rejection_email_sent flag.
+    
+    Args:
+        booking: ComputerBooking instance
+        rejection_reason: Optional reason for rejection
+    """
+    _queue_emails([booking], 'rejection_email_sent', lambda booking: _booking_rejection(booking, rejection_reason))
+    return True
+
+
+def send_session_approval_email(session):
+    """
+    Queue the email to the lecturer whose lab session is approved.
+    Prevents duplicate emails by checking the approval_email_sent flag.
+    
+    Args:
+        session: LabSession instance
+    """
+    _queue_emails([session], 'approval_email_sent', _session_approval)
+    return True
+
+
+def send_session_approval_emails(sessions):
+    """Queue the approval emails of many sessions with one insert; returns how many were queued"""
+    return _queue_emails(sessions, 'approval_email_sent', _session_approval)
+
+
+def send_session_rejection_email(session, rejection_reason=""):
+    """
+    Queue the email to the lecturer whose lab session is rejected.
+    Prevents duplicate emails by checking the rejection_email_sent flag.
+    
+    Args:
+        session: LabSession instance
+        rejection_reason: Optional reason for rejection
+    """
+    _queue_emails([session], 'rejection_email_sent', lambda session: _session_rejection(session, rejection_reason))
+    return True
 
 
 def send_booking_cancellation_email(booking, cancelled_by=None, reason=""):
     """
-    Send email to student when their booking is cancelled.
+    Queue the email to the student whose booking is cancelled.
     Prevents duplicate emails by checking the cancellation_email_sent flag.
     
     Args:
@@ -242,55 +260,16 @@ def send_booking_cancellation_email(booking, cancelled_by=None, reason=""):
         cancelled_by: String indicating who cancelled (admin or user)
         reason: Optional cancellation reason
     """
-    # Prevent duplicate emails
-    if booking.cancellation_email_sent:
-        logger.info(f"Cancellation email already sent for booking {booking.id}, skipping")
-        return True
-    
-    try:
-        subject = f"Your Computer Booking Has Been Cancelled - {booking.computer}"
-        
-        # Generate support URL
-        support_url = f"{settings.BASE_URL}/support/" if settings.BASE_URL else "#"
-        
-        context = {
-            'student_name': booking.student.get_full_name(),
-            'computer': booking.computer,
-            'lab': booking.computer.lab.name,
-            'start_time': booking.start_time.strftime('%B %d, %Y at %I:%M %p'),
-            'end_time': booking.end_time.strftime('%I:%M %p'),
-            'cancelled_by': cancelled_by or 'Administrator',
-            'cancellation_reason': reason or 'No reason provided.',
-            'support_url': support_url,
-        }
-        
-        html_message = render_to_string('emails/booking_cancelled.html', context)
-        text_message = render_to_string('emails/booking_cancelled.txt', context)
-        
-        email = EmailMultiAlternatives(
-            subject=subject,
-            body=text_message,
-            from_email=settings.EMAIL_HOST_USER,
-            to=[booking.student.email]
-        )
-        email.attach_alternative(html_message, "text/html")
-        email.send(fail_silently=False)
-        
-        # Mark email as sent
-        booking.cancellation_email_sent = True
-        booking.save(update_fields=['cancellation_email_sent'])
-        
-        logger.info(f"Booking cancellation email sent to {booking.student.email} for booking {booking.id}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to send booking cancellation email: {str(e)}")
-        return False
+    _queue_emails(
+        [booking], 'cancellation_email_sent',
+        lambda booking: _booking_cancellation(booking, cancelled_by, reason)
+    )
+    return True
 
 
 def send_session_cancellation_email(session, cancelled_by=None, reason=""):
     """
-    Send email to lecturer when their session is cancelled.
+    Queue the email to the lecturer whose session is cancelled.
     Prevents duplicate emails by checking the cancellation_email_sent flag.
     
     Args:
@@ -298,50 +277,87 @@ def send_session_cancellation_email(session, cancelled_by=None, reason=""):
         cancelled_by: String indicating who cancelled
         reason: Optional cancellation reason
     """
-    # Prevent duplicate emails
-    if session.cancellation_email_sent:
-        logger.info(f"Cancellation email already sent for session {session.id}, skipping")
-        return True
+    _queue_emails(
+        [session], 'cancellation_email_sent',
+        lambda session: _session_cancellation(session, cancelled_by, reason)
+    )
+    return True
+
+
+def _sendable(max_attempts):
+    """Unsent emails with attempts left that no drain holds a lease on."""
+    return OutboxEmail.objects.filter(
+        Q(claimed_until__isnull=True) | Q(claimed_until__lt=timezone.now()),
+        sent_at__isnull=True,
+        attempts__lt=max_attempts
+    )
+
+
+def _claim_batch(last_id, batch_size, max_attempts):
+    """
+    Claim the next batch_size sendable emails after last_id: count the
+    attempt and lease them, in a transaction that commits before sending.
+    """
+    with transaction.atomic():
+        batch = list(_sendable(max_attempts).filter(
+            id__gt=last_id
+        ).order_by('id').select_for_update(skip_locked=True)[:batch_size])
+        if batch:
+            OutboxEmail.objects.filter(pk__in=[outbox_email.pk for outbox_email in batch]).update(
+                attempts=F('attempts') + 1,
+                claimed_until=timezone.now() + OUTBOX_LEASE
+            )
+    for outbox_email in batch:
+        outbox_email.attempts += 1
+    return batch
+
+
+def drain_outbox(batch_size=OUTBOX_BATCH_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS):
+    """
+    Send the queued emails, batch_size rows at a time, over one SMTP
+    connection, opened only when there is something to send. Rows claimed
+    by a concurrent drain are skipped; failed sends are retried on later
+    runs until max_attempts.
     
-    try:
-        subject = f"Your Lab Session Has Been Cancelled - {session.title}"
-        
-        # Generate support URL
-        support_url = f"{settings.BASE_URL}/support/" if settings.BASE_URL else "#"
-        
-        context = {
-            'lecturer_name': session.lecturer.get_full_name(),
-            'session_title': session.title,
-            'lab': session.lab.name,
-            'start_time': session.start_time.strftime('%B %d, %Y at %I:%M %p'),
-            'end_time': session.end_time.strftime('%I:%M %p'),
-            'cancelled_by': cancelled_by or 'Administrator',
-            'cancellation_reason': reason or 'No reason provided.',
-            'support_url': support_url,
-        }
-        
-        html_message = render_to_string('emails/session_cancelled.html', context)
-        text_message = render_to_string('emails/session_cancelled.txt', context)
-        
-        email = EmailMultiAlternatives(
-            subject=subject,
-            body=text_message,
-            from_email=settings.EMAIL_HOST_USER,
-            to=[session.lecturer.email]
-        )
-        email.attach_alternative(html_message, "text/html")
-        email.send(fail_silently=False)
-        
-        # Mark email as sent
-        session.cancellation_email_sent = True
-        session.save(update_fields=['cancellation_email_sent'])
-        
-        logger.info(f"Session cancellation email sent to {session.lecturer.email} for session {session.id}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to send session cancellation email: {str(e)}")
-        return False
+    Returns (sent, failed).
+    """
+    if not _sendable(max_attempts).exists():
+        return 0, 0
+    
+    sent = failed = 0
+    last_id = 0
+    with get_connection() as connection:
+        while True:
+            batch = _claim_batch(last_id, batch_size, max_attempts)
+            if not batch:
+                break
+            
+            for outbox_email in batch:
+                try:
+                    email = EmailMultiAlternatives(
+                        subject=outbox_email.subject,
+                        body=render_to_string(f'{outbox_email.template}.txt', outbox_email.context),
+                        from_email=settings.EMAIL_HOST_USER,
+                        to=[outbox_email.recipient],
+                        connection=connection
+                    )
+                    email.attach_alternative(
+                        render_to_string(f'{outbox_email.template}.html', outbox_email.context), "text/html"
+                    )
+                    email.send(fail_silently=False)
+                    outbox_email.sent_at = timezone.now()
+                    outbox_email.last_error = ''
+                    sent += 1
+                except Exception as e:
+                    outbox_email.last_error = str(e)
+                    failed += 1
+                    logger.error(f"Failed to send outbox email {outbox_email.idempotency_key}: {str(e)}")
+                outbox_email.claimed_until = None
+            
+            OutboxEmail.objects.bulk_update(batch, ['sent_at', 'last_error', 'claimed_until'])
+            last_id = batch[-1].id
+    
+    return sent, failed
 
 
 def send_system_maintenance_notification():
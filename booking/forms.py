@@ -196,7 +196,7 @@ class RecurringSessionForm(forms.ModelForm):
             self.add_error('end_time', 'End time must be after start time')
         
         # Check if start date is in the past
-        if start_date and start_date < timezone.now().date():
+        if start_date and start_date < timezone.localdate():
             self.add_error('start_date', 'Start date cannot be in the past')
             
         # Check for reasonable date range (e.g., not scheduling too far in advance)
@@ -371,7 +371,8 @@ class UserProfileForm(forms.ModelForm):
             'last_name', 
             'email',
             'school', 
-            'course'
+            'course',
+            'notification_digest'
         ]
         widgets = {
             'salutation': forms.Select(attrs={'class': 'form-control'}),
@@ -380,6 +381,7 @@ class UserProfileForm(forms.ModelForm):
             'email': forms.EmailInput(attrs={'class': 'form-control'}),
             'school': forms.Select(attrs={'class': 'form-control'}),
             'course': forms.TextInput(attrs={'class': 'form-control'}),
+            'notification_digest': forms.Select(attrs={'class': 'form-control'}),
         }
         
     def __init__(self, *args, **kwargs):
@@ -410,4 +412,28 @@ class AttendanceForm(forms.ModelForm):
 class BulkAttendanceForm(forms.Form):
     """Form for bulk attendance submission"""
     # This is just a placeholder - the actual form will be built dynamically
-    pass
\ No newline at end of file
+    pass
+class ApprovalPlanForm(forms.Form):
+    """Lab, date range and objective for the approval planner"""
+    OBJECTIVE_CHOICES = [
+        ('count', 'Most requests'),
+        ('hours', 'Most booked hours'),
+    ]
+    
+    lab = forms.ModelChoiceField(queryset=Lab.objects.none(), widget=forms.Select(attrs={'class': 'form-control'}))
+    start_date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    end_date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}))
+    objective = forms.ChoiceField(choices=OBJECTIVE_CHOICES, initial='count', widget=forms.Select(attrs={'class': 'form-control'}))
+    
+    def __init__(self, *args, **kwargs):
+        labs = kwargs.pop('labs')
+        super().__init__(*args, **kwargs)
+        self.fields['lab'].queryset = labs
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get('start_date')
+        end_date = cleaned_data.get('end_date')
+        if start_date and end_date and end_date < start_date:
+            self.add_error('end_date', 'End date must not be before start date')
+        return cleaned_data
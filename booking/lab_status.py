@@ -0,0 +1,53 @@
+"""
+Lab status snapshot.
+
+Counts of computers by status, per lab and for the whole system, as shown
+on the home page, the lab detail page, the admin dashboard and the reports.
+They come from one grouped query and are cached until booking.signals drops
+the snapshot after any Computer is saved or deleted.
+"""
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import Computer
+
+SNAPSHOT_KEY = 'lab_status:snapshot'
+SNAPSHOT_TIMEOUT = 60 * 60
+
+COMPUTER_STATUSES = [status for status, _ in Computer._meta.get_field('status').choices]
+
+
+def _empty_counts():
+    return {**dict.fromkeys(COMPUTER_STATUSES, 0), 'total': 0}
+
+
+def lab_status_snapshot():
+    """
+    {'labs': {lab id: counts}, 'totals': counts}, where counts maps each
+    computer status ('available', 'maintenance', 'reserved') and 'total' to
+    a number of computers. Labs without computers are not listed.
+    """
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is None:
+        labs = {}
+        totals = _empty_counts()
+        for lab_id, status, count in Computer.objects.values_list('lab_id', 'status').annotate(
+            count=Count('id')
+        ).order_by():
+            counts = labs.setdefault(lab_id, _empty_counts())
+            for bucket in (counts, totals):
+                bucket[status] = bucket.get(status, 0) + count
+                bucket['total'] += count
+        snapshot = {'labs': labs, 'totals': totals}
+        cache.set(SNAPSHOT_KEY, snapshot, SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def lab_status(lab_id):
+    """Computer counts by status of one lab."""
+    return lab_status_snapshot()['labs'].get(lab_id) or _empty_counts()
+
+
+def invalidate_lab_status():
+    """Forget the cached snapshot."""
+    cache.delete(SNAPSHOT_KEY)
@@ -0,0 +1,80 @@
+import random
+import time as timer
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from booking.approval import PLAN_OBJECTIVES, plan_approvals
+from booking.models import Computer, ComputerBooking, Lab, LabSession, User
+from booking.occupancy import SLOT
+from booking.timeranges import day_start
+
+from .benchmark_recurring_conflicts import BenchmarkRollback
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the approval planner over a week of pending sessions and bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--computers', type=int, default=40, help='Computers in the lab')
+        parser.add_argument('--bookings', type=int, default=3000, help='Pending bookings to seed over the week')
+        parser.add_argument('--sessions', type=int, default=60, help='Pending lab sessions to seed over the week')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per objective')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            pass
+
+    def _run(self, options):
+        lab = Lab.objects.create(name='Benchmark Lab', location='Benchmark', capacity=options['computers'])
+        computers = Computer.objects.bulk_create([
+            Computer(lab=lab, computer_number=number)
+            for number in range(1, options['computers'] + 1)
+        ])
+        student = User.objects.create(username='benchmark_student', is_student=True)
+        lecturer = User.objects.create(username='benchmark_lecturer', is_lecturer=True)
+
+        rng = random.Random(0)
+        start_date = timezone.localdate() + timedelta(days=1)
+        end_date = start_date + timedelta(days=6)
+        week_start = day_start(start_date)
+
+        def opening_slot():
+            # 8:00 to 18:00 on one of the seven days
+            return week_start + timedelta(days=rng.randrange(7)) + rng.randrange(32, 72) * SLOT
+
+        bookings = []
+        for _ in range(options['bookings']):
+            start = opening_slot()
+            bookings.append(ComputerBooking(
+                computer=rng.choice(computers), student=student,
+                start_time=start, end_time=start + rng.choice((2, 4, 6, 8)) * SLOT
+            ))
+        ComputerBooking.objects.bulk_create(bookings)
+        sessions = []
+        for number in range(options['sessions']):
+            start = opening_slot()
+            sessions.append(LabSession(
+                lab=lab, lecturer=lecturer, title=f'Benchmark {number}',
+                start_time=start, end_time=start + rng.choice((4, 8)) * SLOT
+            ))
+        LabSession.objects.bulk_create(sessions)
+
+        self.stdout.write(f"{'objective':<12}{'queries':>10}{'sessions':>10}{'bookings':>10}{'ms per plan':>14}")
+        for objective in PLAN_OBJECTIVES:
+            with CaptureQueriesContext(connection) as queries:
+                plan = plan_approvals(lab, start_date, end_date, objective)
+            started = timer.perf_counter()
+            for _ in range(options['repeat']):
+                plan_approvals(lab, start_date, end_date, objective)
+            elapsed_ms = (timer.perf_counter() - started) * 1e3 / options['repeat']
+            self.stdout.write(
+                f'{objective:<12}{len(queries):>10}{len(plan.sessions):>10}{len(plan.bookings):>10}{elapsed_ms:>14.1f}'
+            )
@@ -0,0 +1,177 @@
+import random
+import re
+import time as timer
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from booking.models import Computer, ComputerBooking, Lab, LabSession, User
+from booking.timeranges import touching_dates, within_dates
+
+from .benchmark_recurring_conflicts import BenchmarkRollback
+
+INDEX_NAMES = [
+    index.name
+    for model in (ComputerBooking, LabSession)
+    for index in model._meta.indexes
+]
+
+INDEX_USE = re.compile(
+    r'(?:USING (?:COVERING )?INDEX|Index (?:Only )?Scan using|Bitmap Index Scan on)\s+(\w+)'
+)
+
+
+def plan_summary(plan):
+    """Name the index a query plan uses, or report a sequential scan"""
+    match = INDEX_USE.search(plan)
+    return f'index {match.group(1)}' if match else 'sequential scan'
+
+
+class Command(BaseCommand):
+    help = 'Show the booking hot-path query plans with and without the composite/partial indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=50000, help='Bookings to seed')
+        parser.add_argument('--sessions', type=int, default=5000, help='Lab sessions to seed')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print the full query plans')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            pass
+
+    def _run(self, options):
+        computers, lab = self._seed(options)
+        computer = computers[len(computers) // 2]
+        now = timezone.now()
+        today = timezone.localdate()
+        month_ago = today - timedelta(days=30)
+
+        shapes = {
+            'overlap check': ComputerBooking.objects.filter(
+                computer=computer,
+                is_approved=True,
+                is_cancelled=False,
+                start_time__lt=now + timedelta(hours=2),
+                end_time__gt=now
+            ),
+            'session overlap': LabSession.objects.filter(
+                lab=lab,
+                is_approved=True,
+                is_cancelled=False,
+                start_time__lt=now + timedelta(hours=2),
+                end_time__gt=now
+            ),
+            'report range': ComputerBooking.objects.filter(
+                **within_dates('start_time', month_ago, today),
+                is_approved=True,
+                is_cancelled=False
+            ),
+            'report __date': ComputerBooking.objects.filter(
+                start_time__date__gte=month_ago,
+                start_time__date__lte=today,
+                is_approved=True,
+                is_cancelled=False
+            ),
+            'check-in day': ComputerBooking.objects.filter(
+                **touching_dates('start_time', 'end_time', today),
+                is_approved=True,
+                is_cancelled=False
+            ),
+            'ending soon': ComputerBooking.objects.filter(
+                end_time__gt=now + timedelta(minutes=5),
+                end_time__lte=now + timedelta(minutes=6),
+                is_approved=True,
+                is_cancelled=False,
+                reminder_sent=False
+            ),
+        }
+
+        self._analyze()
+        with_indexes = {name: self._measure(qs, options) for name, qs in shapes.items()}
+
+        with connection.cursor() as cursor:
+            for index_name in INDEX_NAMES:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(index_name)}')
+        self._analyze()
+        without_indexes = {name: self._measure(qs, options) for name, qs in shapes.items()}
+
+        self.stdout.write(f"{'query':<16}{'without indexes':<52}{'ms':>8}   {'with indexes':<48}{'ms':>8}")
+        for name in shapes:
+            old_plan, old_ms = without_indexes[name]
+            new_plan, new_ms = with_indexes[name]
+            self.stdout.write(
+                f'{name:<16}{plan_summary(old_plan):<52}{old_ms:>8.2f}   {plan_summary(new_plan):<48}{new_ms:>8.2f}'
+            )
+            if options['verbose_plans']:
+                self.stdout.write(f'  without:\n{old_plan}\n  with:\n{new_plan}')
+
+    def _seed(self, options):
+        labs = [Lab.objects.create(name=f'Benchmark Lab {i}', location='Benchmark', capacity=20) for i in range(5)]
+        computers = Computer.objects.bulk_create([
+            Computer(lab=lab, computer_number=number)
+            for lab in labs
+            for number in range(1, 21)
+        ])
+        student = User.objects.create(username='benchmark_student', is_student=True)
+        lecturer = User.objects.create(username='benchmark_lecturer', is_lecturer=True)
+
+        rng = random.Random(0)
+        now = timezone.now()
+        first_start = now - timedelta(days=365)
+
+        def random_start():
+            hours = rng.randrange(0, 400 * 24)
+            return (first_start + timedelta(hours=hours)).replace(minute=0, second=0, microsecond=0)
+
+        bookings = []
+        for _ in range(options['bookings']):
+            start = random_start()
+            roll = rng.random()
+            bookings.append(ComputerBooking(
+                computer=rng.choice(computers),
+                student=student,
+                start_time=start,
+                end_time=start + timedelta(hours=rng.choice((1, 2))),
+                is_approved=roll < 0.85,
+                is_cancelled=roll > 0.95,
+                reminder_sent=start < now
+            ))
+        ComputerBooking.objects.bulk_create(bookings, batch_size=2000)
+
+        sessions = []
+        for i in range(options['sessions']):
+            start = random_start()
+            sessions.append(LabSession(
+                lab=rng.choice(labs),
+                lecturer=lecturer,
+                title=f'Benchmark {i}',
+                start_time=start,
+                end_time=start + timedelta(hours=2),
+                is_approved=rng.random() < 0.9
+            ))
+        LabSession.objects.bulk_create(sessions, batch_size=2000)
+
+        return computers, labs[0]
+
+    def _analyze(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('ANALYZE booking_computerbooking')
+                cursor.execute('ANALYZE booking_labsession')
+            else:
+                cursor.execute('ANALYZE')
+
+    def _measure(self, queryset, options):
+        plan = queryset.explain()
+        started = timer.perf_counter()
+        for _ in range(options['repeat']):
+            list(queryset.values_list('id', flat=True))
+        elapsed_ms = (timer.perf_counter() - started) * 1000 / options['repeat']
+        return plan, elapsed_ms
@@ -0,0 +1,88 @@
+import random
+import time as timer
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from booking.availability import hourly_slots, lab_slot_availability
+from booking.models import Computer, ComputerBooking, Lab, LabSession, User
+from booking.occupancy import SLOT, build_grids, lab_grids, slot_mask, store_grids, week_view
+from booking.timeranges import day_start
+
+from .benchmark_recurring_conflicts import BenchmarkRollback
+
+
+class Command(BaseCommand):
+    help = 'Benchmark week views answered from stored occupancy grids against the in-memory sweep and building grids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--computers', type=int, default=80, help='Computers in the lab')
+        parser.add_argument('--bookings', type=int, default=4000, help='Bookings to seed over the week')
+        parser.add_argument('--repeat', type=int, default=50, help='Timed runs per method')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            pass
+
+    def _run(self, options):
+        lab = Lab.objects.create(name='Benchmark Lab', location='Benchmark', capacity=options['computers'])
+        computers = Computer.objects.bulk_create([
+            Computer(lab=lab, computer_number=number)
+            for number in range(1, options['computers'] + 1)
+        ])
+        student = User.objects.create(username='benchmark_student', is_student=True)
+        lecturer = User.objects.create(username='benchmark_lecturer', is_lecturer=True)
+
+        rng = random.Random(0)
+        today = timezone.localdate()
+        week_start = day_start(today)
+        bookings = []
+        for _ in range(options['bookings']):
+            start = week_start + rng.randrange(0, 7 * 96) * SLOT
+            bookings.append(ComputerBooking(
+                computer=rng.choice(computers), student=student,
+                start_time=start, end_time=start + rng.choice((2, 4, 6)) * SLOT,
+                is_approved=True
+            ))
+        ComputerBooking.objects.bulk_create(bookings)
+        LabSession.objects.bulk_create([
+            LabSession(
+                lab=lab, lecturer=lecturer, title=f'Benchmark {day}',
+                start_time=week_start + timedelta(days=day, hours=10),
+                end_time=week_start + timedelta(days=day, hours=12),
+                is_approved=True
+            )
+            for day in range(0, 7, 2)
+        ])
+
+        dates = [today + timedelta(days=offset) for offset in range(7)]
+        store_grids(lab, today, 7)
+        grids = lab_grids(lab, today, 7)
+        hour_masks = [slot_mask(hour * 4, 4) for hour in range(8, 20)]
+
+        def in_memory():
+            return [grid.busy_count(mask) for grid in grids for mask in hour_masks]
+
+        slots = hourly_slots(today, dates[-1])
+        rows = [
+            ('in-memory sweep', lambda: lab_slot_availability(lab, slots)),
+            ('built grids', lambda: build_grids(lab.id, dates)),
+            ('stored grids', lambda: week_view(lab, today, days=7)),
+            ('loaded grids', in_memory),
+        ]
+        self.stdout.write(f"{'method':<16}{'queries':>10}{'us per week view':>20}")
+        for name, method in rows:
+            with CaptureQueriesContext(connection) as queries:
+                method()
+            started = timer.perf_counter()
+            for _ in range(options['repeat']):
+                method()
+            elapsed_us = (timer.perf_counter() - started) * 1e6 / options['repeat']
+            self.stdout.write(f'{name:<16}{len(queries):>10}{elapsed_us:>20.1f}')
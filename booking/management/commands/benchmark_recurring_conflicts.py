@@ -0,0 +1,102 @@
+import time as timer
+from datetime import time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from booking.models import Lab, LabSession, RecurringSession, User
+
+
+class BenchmarkRollback(Exception):
+    """Raised to roll back the benchmark fixtures"""
+
+
+def per_occurrence_conflicts(series):
+    """The previous implementation: two queries for every occurrence"""
+    conflicts = []
+    for start, end in series.get_occurrences():
+        sessions = LabSession.objects.filter(
+            lab=series.lab,
+            is_approved=True,
+            start_time__lt=end,
+            end_time__gt=start
+        )
+        recurring = RecurringSession.objects.filter(
+            lab=series.lab,
+            is_approved=True,
+            start_date__lte=start.date(),
+            end_date__gte=start.date()
+        ).exclude(pk=series.pk if series.pk else None)
+        if sessions.exists() or recurring.exists():
+            conflicts.append(timezone.localtime(start).strftime('%Y-%m-%d %H:%M'))
+    return conflicts
+
+
+class Command(BaseCommand):
+    help = 'Benchmark RecurringSession conflict checking for daily, weekly and monthly series'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=120, help='Length of each series in days')
+        parser.add_argument('--sessions', type=int, default=300, help='Existing lab sessions to seed')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per series')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            pass
+
+    def _run(self, options):
+        lab = Lab.objects.create(name='Benchmark Lab', location='Benchmark', capacity=40)
+        lecturer = User.objects.create(username='benchmark_lecturer', is_lecturer=True)
+
+        start_date = timezone.localdate() + timedelta(days=1)
+        end_date = start_date + timedelta(days=options['days'])
+
+        # Seed approved sessions spread over the span; every seventh one
+        # overlaps the series' hours so some occurrences conflict
+        sessions = []
+        for i in range(options['sessions']):
+            day = start_date + timedelta(days=i % options['days'])
+            hour = 10 if i % 7 == 0 else 14 + (i % 4)
+            start = timezone.make_aware(timezone.datetime.combine(day, time(hour=hour)))
+            sessions.append(LabSession(
+                lab=lab, lecturer=lecturer, title=f'Seed {i}',
+                start_time=start, end_time=start + timedelta(minutes=50),
+                is_approved=True
+            ))
+        LabSession.objects.bulk_create(sessions)
+
+        self.stdout.write(f"{'series':<10}{'occurrences':>13}{'conflicts':>11}{'queries':>10}{'old queries':>13}{'ms':>10}{'old ms':>10}")
+        for recurrence_type in ('daily', 'weekly', 'monthly'):
+            series = RecurringSession(
+                lab=lab, lecturer=lecturer, title=f'{recurrence_type} series',
+                start_time=time(hour=9), end_time=time(hour=11),
+                start_date=start_date, end_date=end_date,
+                recurrence_type=recurrence_type
+            )
+            occurrences = len(series.get_occurrences())
+
+            new_queries, new_ms, new_result = self._measure(series.check_session_conflicts, options['repeat'])
+            old_queries, old_ms, old_result = self._measure(lambda: per_occurrence_conflicts(series), options['repeat'])
+
+            if new_result != old_result:
+                self.stdout.write(self.style.WARNING(f'{recurrence_type}: conflict lists differ'))
+
+            self.stdout.write(
+                f'{recurrence_type:<10}{occurrences:>13}{len(new_result):>11}{new_queries:>10}{old_queries:>13}'
+                f'{new_ms:>10.2f}{old_ms:>10.2f}'
+            )
+
+    def _measure(self, check, repeat):
+        with CaptureQueriesContext(connection) as queries:
+            result = check()
+        started = timer.perf_counter()
+        for _ in range(repeat):
+            check()
+        elapsed_ms = (timer.perf_counter() - started) * 1000 / repeat
+        return len(queries), elapsed_ms, result
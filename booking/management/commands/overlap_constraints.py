@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from booking.overlap import INSTALL_SQL, DROP_SQL, supports_exclusion_constraints
+
+class Command(BaseCommand):
+    help = 'Install (or drop) the PostgreSQL overlap constraints used when BOOKING_OVERLAP_ENFORCEMENT=database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            help='Remove the constraints and trigger instead of installing them',
+        )
+
+    def handle(self, *args, **options):
+        if not supports_exclusion_constraints():
+            raise CommandError(
+                f'Exclusion constraints require PostgreSQL (current backend: {connection.vendor}). '
+                'Other backends use the locked pre-check fallback and need no installation.'
+            )
+
+        statements = DROP_SQL if options['drop'] else DROP_SQL + INSTALL_SQL
+
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+        except DatabaseError as e:
+            raise CommandError(
+                f'Could not apply overlap constraints: {e}. '
+                'Existing overlapping approved bookings or sessions must be resolved first.'
+            )
+
+        if options['drop']:
+            self.stdout.write(self.style.SUCCESS('Overlap constraints dropped'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Overlap constraints installed'))
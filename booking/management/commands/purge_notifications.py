@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from booking.retention import ARCHIVE_BATCH_SIZE, purge_notifications
+
+
+class Command(BaseCommand):
+    help = 'Archive read notifications past the retention period to NOTIFICATION_ARCHIVE_DIR and delete them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.NOTIFICATION_RETENTION_DAYS,
+            help='Keep read notifications this many days (default: NOTIFICATION_RETENTION_DAYS)'
+        )
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be purged')
+
+    def handle(self, *args, **options):
+        purged = purge_notifications(
+            retention_days=options['days'],
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            dry_run=options['dry_run']
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f'{purged} notifications would be archived and purged')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Archived and purged {purged} notifications'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from booking.models import Notification, User
+
+
+class Command(BaseCommand):
+    help = 'Recompute every user\'s unread notification counter from the notifications table'
+
+    def handle(self, *args, **options):
+        unread = Notification.objects.filter(
+            user=OuterRef('pk'), is_read=False
+        ).values('user').annotate(count=Count('id')).values('count')
+        actual = Coalesce(Subquery(unread), 0)
+
+        drifted = User.objects.annotate(actual=actual).exclude(unread_notifications=actual)
+        repaired = drifted.update(unread_notifications=actual)
+
+        self.stdout.write(self.style.SUCCESS(f'Repaired {repaired} unread notification counters'))
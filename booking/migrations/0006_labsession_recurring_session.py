@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def link_existing_occurrences(apps, schema_editor):
+    """
+    Link sessions created from approved series before the foreign key
+    existed. They were matched by lab, lecturer and title ever since.
+    """
+    RecurringSession = apps.get_model('booking', 'RecurringSession')
+    LabSession = apps.get_model('booking', 'LabSession')
+
+    for series in RecurringSession.objects.filter(is_approved=True):
+        LabSession.objects.filter(
+            recurring_session__isnull=True,
+            lab_id=series.lab_id,
+            lecturer_id=series.lecturer_id,
+            title=series.title,
+            start_time__date__gte=series.start_date,
+            start_time__date__lte=series.end_date,
+        ).update(recurring_session=series)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0005_alter_user_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='labsession',
+            name='recurring_session',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='occurrences', to='booking.recurringsession'),
+        ),
+        migrations.RunPython(link_existing_occurrences, migrations.RunPython.noop),
+    ]
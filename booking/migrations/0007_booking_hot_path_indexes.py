@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0006_labsession_recurring_session'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='computerbooking',
+            index=models.Index(condition=models.Q(('is_approved', True), ('is_cancelled', False)), fields=['computer', 'start_time'], name='booking_active_comp_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='computerbooking',
+            index=models.Index(condition=models.Q(('is_approved', True), ('is_cancelled', False)), fields=['start_time'], name='booking_active_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='computerbooking',
+            index=models.Index(condition=models.Q(('is_approved', True), ('is_cancelled', False)), fields=['end_time'], name='booking_active_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='computerbooking',
+            index=models.Index(condition=models.Q(('reminder_sent', False)), fields=['end_time'], name='booking_reminder_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labsession',
+            index=models.Index(condition=models.Q(('is_approved', True), ('is_cancelled', False)), fields=['lab', 'start_time'], name='session_active_lab_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labsession',
+            index=models.Index(fields=['start_time'], name='session_start_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0007_booking_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('computer_ids', models.JSONField(default=list)),
+                ('grid', models.BinaryField(default=bytes)),
+                ('sessions', models.BinaryField(default=bytes)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('lab', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='booking.lab')),
+            ],
+            options={
+                'verbose_name_plural': 'Lab occupancy',
+                'unique_together': {('lab', 'date')},
+            },
+        ),
+    ]
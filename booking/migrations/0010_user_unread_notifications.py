@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:22
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_unread_notifications(apps, schema_editor):
+    User = apps.get_model('booking', 'User')
+    Notification = apps.get_model('booking', 'Notification')
+    unread = Notification.objects.filter(
+        user=OuterRef('pk'), is_read=False
+    ).values('user').annotate(count=Count('id')).values('count')
+    User.objects.update(unread_notifications=Coalesce(Subquery(unread), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0009_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_unread_notifications, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0011_notification_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='coalesce_key',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='notification_digest',
+            field=models.CharField(blank=True, choices=[('', 'As they happen'), ('hourly', 'Hourly digest'), ('daily', 'Daily digest')], default='', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('new_booking', 'New Booking'), ('booking_cancelled', 'Booking Cancelled'), ('session_booked', 'Session Booked'), ('booking_approved', 'Booking Approved'), ('booking_rejected', 'Booking Rejected'), ('recurring_session_created', 'Recurring Session Created'), ('recurring_session_approved', 'Recurring Session Approved'), ('recurring_session_rejected', 'Recurring Session Rejected'), ('booking_ending', 'Booking Ending Soon'), ('booking_extended', 'Booking Extended'), ('extension_unavailable', 'Extension Unavailable'), ('checkin_reminder', 'Check-in Reminder'), ('attendance_marked', 'Attendance Marked'), ('attendance_updated', 'Attendance Updated'), ('session_cancelled', 'Session Cancelled'), ('digest', 'Digest')], max_length=50),
+        ),
+        migrations.CreateModel(
+            name='NotificationDigestEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('coalesce_key', models.CharField(max_length=100)),
+                ('notification_type', models.CharField(max_length=50)),
+                ('message', models.TextField()),
+                ('summary', models.TextField()),
+                ('count', models.PositiveIntegerField(default=1)),
+                ('first_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='digest_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'coalesce_key'), name='digest_entry_user_key_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:52
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_occurrences(apps, schema_editor):
+    # Concurrent materializations could write an occurrence twice; keep the
+    # first row and move over attendance only the duplicates recorded
+    LabSession = apps.get_model('booking', 'LabSession')
+    SessionAttendance = apps.get_model('booking', 'SessionAttendance')
+    duplicated = LabSession.objects.filter(recurring_session__isnull=False).values(
+        'recurring_session', 'start_time'
+    ).annotate(rows=Count('id'), first_id=Min('id')).filter(rows__gt=1)
+    for occurrence in duplicated:
+        duplicate_ids = list(LabSession.objects.filter(
+            recurring_session=occurrence['recurring_session'], start_time=occurrence['start_time']
+        ).exclude(id=occurrence['first_id']).values_list('id', flat=True))
+        for attendance in SessionAttendance.objects.filter(session_id__in=duplicate_ids).order_by('id'):
+            if not SessionAttendance.objects.filter(
+                session_id=occurrence['first_id'], student_id=attendance.student_id
+            ).exists():
+                attendance.session_id = occurrence['first_id']
+                attendance.save(update_fields=['session'])
+        LabSession.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0012_notification_coalescing'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_occurrences, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='labsession',
+            constraint=models.UniqueConstraint(condition=models.Q(('recurring_session__isnull', False)), fields=('recurring_session', 'start_time'), name='session_recurring_occurrence_unique'),
+        ),
+    ]
@@ -1,12 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 import uuid
 from dateutil.rrule import rrule, DAILY, WEEKLY, MONTHLY
-from dateutil.parser import parse
 from django.db.models import Q
-from datetime import timedelta
+from datetime import datetime, timedelta
+from .overlap import save_with_overlap_rule
 
 class User(AbstractUser):
     SCHOOL_CHOICES = [
@@ -28,6 +28,12 @@ class User(AbstractUser):
         ('', 'None')
     ]
     
+    NOTIFICATION_DIGEST_CHOICES = [
+        ('', 'As they happen'),
+        ('hourly', 'Hourly digest'),
+        ('daily', 'Daily digest'),
+    ]
+    
     is_student = models.BooleanField(default=False)
     is_lecturer = models.BooleanField(default=False)
     is_admin = models.BooleanField(default=False)
@@ -43,6 +49,24 @@ class User(AbstractUser):
     average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=5.00)
     total_ratings = models.PositiveIntegerField(default=0)
     
+    # Unread notifications, maintained by booking.notifications so the
+    # navigation badge needs no query (repair_unread_counters rebuilds it)
+    unread_notifications = models.PositiveIntegerField(default=0)
+    
+    # Repeated alerts (new bookings, sessions and cancellations in a lab) are
+    # collected into a periodic digest instead of arriving one by one
+    notification_digest = models.CharField(max_length=10, choices=NOTIFICATION_DIGEST_CHOICES, blank=True, default='')
+    
+    def save(self, *args, **kwargs):
+        # The unread counter is only changed with F() updates; writing back
+        # the value loaded at the start of a request would undo them
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'unread_notifications'
+            ]
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         full_name = ""
         if self.salutation:
@@ -87,6 +111,16 @@ class Lab(models.Model):
     
     def __str__(self):
         return self.name
+    
+    def allocate_computer(self, start_time, duration):
+        """Suggest the best-fitting free computer for a booking (see booking.allocation)"""
+        from .allocation import allocate_computer
+        return allocate_computer(self, start_time, duration)
+    
+    def book_next_free_computer(self, student, start_time, duration, accept_alternative=False):
+        """Allocate a computer and create the booking request; returns (booking, allocation)"""
+        from .allocation import book_computer
+        return book_computer(self, student, start_time, duration, accept_alternative=accept_alternative)
 
 class Computer(models.Model):
     lab = models.ForeignKey(Lab, on_delete=models.CASCADE, related_name='computers')
@@ -101,6 +135,13 @@ class Computer(models.Model):
     class Meta:
         unique_together = ('lab', 'computer_number')
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Values as loaded, so signal handlers can tell what a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
     def __str__(self):
         return f"{self.lab.name} - Computer #{self.computer_number}"
 
@@ -125,20 +166,68 @@ class LabSession(models.Model):
     rejection_email_sent = models.BooleanField(default=False)
     cancellation_email_sent = models.BooleanField(default=False)
     
-    def clean(self):
+    # Series this session was generated from, if any
+    recurring_session = models.ForeignKey(
+        'RecurringSession',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='occurrences'
+    )
+    
+    class Meta:
+        indexes = [
+            # Overlap checks and availability: live sessions of a lab in a window
+            models.Index(
+                fields=['lab', 'start_time'],
+                condition=Q(is_approved=True, is_cancelled=False),
+                name='session_active_lab_start_idx'
+            ),
+            # Dashboards and reports over a date range
+            models.Index(fields=['start_time'], name='session_start_idx'),
+        ]
+        constraints = [
+            # One row per occurrence of a recurring series, however many
+            # requests materialize it at the same time
+            models.UniqueConstraint(
+                fields=['recurring_session', 'start_time'],
+                condition=Q(recurring_session__isnull=False),
+                name='session_recurring_occurrence_unique'
+            ),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Values as loaded, so signal handlers can tell what a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def clean(self, check_overlaps=True):
         # Check if end time is after start time
         if self.end_time <= self.start_time:
             raise ValidationError('End time must be after start time')
             
         # Check if lab is available for the requested time slot
-        conflicting_sessions = LabSession.objects.filter(
-            lab=self.lab,
-            is_approved=True,
-            start_time__lt=self.end_time,
-            end_time__gt=self.start_time
-        ).exclude(id=self.id)
+        # (enforced by the database when BOOKING_OVERLAP_ENFORCEMENT='database')
+        if check_overlaps:
+            conflicting_sessions = LabSession.objects.filter(
+                lab=self.lab,
+                is_approved=True,
+                is_cancelled=False,
+                start_time__lt=self.end_time,
+                end_time__gt=self.start_time
+            ).exclude(id=self.id)
+            
+            if conflicting_sessions.exists():
+                raise ValidationError('Lab is already booked for this time slot')
         
-        if conflicting_sessions.exists():
+        # Lazily expanded recurring occurrences have no rows for the query
+        # above (or the database constraints) to see
+        from .recurrence import has_recurring_conflict, lazy_expansion_enabled
+        if lazy_expansion_enabled() and not self.is_cancelled and has_recurring_conflict(
+            self.lab, self.start_time, self.end_time, exclude_series=self.recurring_session_id
+        ):
             raise ValidationError('Lab is already booked for this time slot')
         
         # Check if there are less than 10 computer bookings during this time
@@ -154,22 +243,23 @@ class LabSession(models.Model):
     
     def save(self, *args, **kwargs):
         is_new = self.pk is None
-        self.clean()
-        super(LabSession, self).save(*args, **kwargs)
+        save_with_overlap_rule(
+            self,
+            lambda: super(LabSession, self).save(*args, **kwargs),
+            Lab.objects.filter(pk=self.lab_id)
+        )
         
         # If new lab session is created, notify relevant admins (no duplicates)
         if is_new:
-            # Get all unique admins (lab-specific and super admins)
-            lab_admins = User.objects.filter(is_admin=True, managed_labs=self.lab)
-            super_admins = User.objects.filter(is_super_admin=True)
-            all_admins = set(list(lab_admins) + list(super_admins))
-            for admin in all_admins:
-                Notification.objects.create(
-                    user=admin,
-                    message=f"New lab session: {self.title} in {self.lab.name} by {self.lecturer.username}",
-                    notification_type='session_booked',
-                    lab_session=self
-                )
+            from .notifications import notify_lab_admins
+            notify_lab_admins(
+                self.lab_id,
+                f"New lab session: {self.title} in {self.lab.name} by {self.lecturer.username}",
+                'session_booked',
+                coalesce_key=f'session_booked:lab:{self.lab_id}',
+                summary=f"{{count}} new lab sessions in {self.lab.name}",
+                lab_session=self
+            )
     
     def __str__(self):
         return f"{self.title} - {self.lab.name} ({self.start_time.strftime('%Y-%m-%d %H:%M')})"
@@ -187,29 +277,23 @@ class LabSession(models.Model):
         self.cancellation_reason = reason
         self.save(update_fields=['is_cancelled', 'cancellation_reason'])
         
+        from .notifications import notify, notify_lab_admins
+        
         # Notify admins about cancellation
-        lab_admins = User.objects.filter(
-            is_admin=True, 
-            managed_labs=self.lab
+        notify_lab_admins(
+            self.lab_id,
+            f"Lab session '{self.title}' in {self.lab.name} has been cancelled by {self.lecturer.username}. Reason: {reason or 'No reason provided'}",
+            'session_cancelled',
+            lab_session=self
         )
-        
-        # Create notifications for lab-specific admins
-        for admin in lab_admins:
-            Notification.objects.create(
-                user=admin,
-                message=f"Lab session '{self.title}' in {self.lab.name} has been cancelled by {self.lecturer.username}. Reason: {reason or 'No reason provided'}",
-                notification_type='session_cancelled',
-                lab_session=self
-            )
             
         # Notify attending students
-        for student in self.attending_students.all():
-            Notification.objects.create(
-                user=student,
-                message=f"Lab session '{self.title}' scheduled for {self.start_time.strftime('%Y-%m-%d %H:%M')} has been cancelled.",
-                notification_type='session_cancelled',
-                lab_session=self
-            )
+        notify(
+            self.attending_students.values_list('id', flat=True),
+            f"Lab session '{self.title}' scheduled for {self.start_time.strftime('%Y-%m-%d %H:%M')} has been cancelled.",
+            'session_cancelled',
+            lab_session=self
+        )
             
         return True
 
@@ -298,14 +382,72 @@ class ComputerBooking(models.Model):
     rejection_email_sent = models.BooleanField(default=False)
     cancellation_email_sent = models.BooleanField(default=False)
     
-    def clean(self):
+    class Meta:
+        indexes = [
+            # Overlap checks and availability: live bookings of a computer in a window
+            models.Index(
+                fields=['computer', 'start_time'],
+                condition=Q(is_approved=True, is_cancelled=False),
+                name='booking_active_comp_start_idx'
+            ),
+            # Dashboards and reports over a date range
+            models.Index(
+                fields=['start_time'],
+                condition=Q(is_approved=True, is_cancelled=False),
+                name='booking_active_start_idx'
+            ),
+            # Check-in dashboard: live bookings still running on or after a day
+            models.Index(
+                fields=['end_time'],
+                condition=Q(is_approved=True, is_cancelled=False),
+                name='booking_active_end_idx'
+            ),
+            # check_ending_bookings: bookings still owed an ending reminder
+            models.Index(
+                fields=['end_time'],
+                condition=Q(reminder_sent=False),
+                name='booking_reminder_due_idx'
+            ),
+        ]
+    
+    # Fields an overlap depends on; saves leaving them unchanged skip clean()
+    VALIDATED_FIELDS = ('computer_id', 'start_time', 'end_time', 'is_approved', 'is_cancelled')
+    
+    # Flags whose False -> True transition sets the paired timestamp
+    TRANSITION_TIMESTAMPS = {
+        'is_approved': 'approved_at',
+        'is_cancelled': 'cancelled_at',
+        'extension_requested': 'extension_requested_at',
+        'extension_approved': 'extension_approved_at',
+    }
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Values as loaded, so save() and signal handlers can tell what a save changed
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def _stored_values(self, fields):
+        """
+        Stored values of fields (attnames), from the snapshot taken when the
+        row was loaded; fields missing from it are read with one query.
+        """
+        loaded = getattr(self, '_loaded_values', {})
+        missing = [field for field in fields if field not in loaded]
+        if missing:
+            loaded = {**loaded, **ComputerBooking.objects.filter(pk=self.pk).values(*missing).get()}
+        return {field: loaded[field] for field in fields}
+    
+    def clean(self, check_overlaps=True):
         # Check if end time is after start time
         if self.end_time <= self.start_time:
             raise ValidationError('End time must be after start time')
         
         # Check if computer is available for the requested time slot
         # Only check for conflicts if the booking is not cancelled
-        if not self.is_cancelled:
+        # (enforced by the database when BOOKING_OVERLAP_ENFORCEMENT='database')
+        if check_overlaps and not self.is_cancelled:
             # Only check conflicts with approved bookings when this booking is being approved
             # OR when creating a new booking
             conflicting_bookings = ComputerBooking.objects.filter(
@@ -330,37 +472,67 @@ class ComputerBooking(models.Model):
             
             if conflicting_sessions.exists():
                 raise ValidationError('Lab is reserved for a session during this time slot')
+        
+        # Lazily expanded recurring occurrences have no rows for the query
+        # above (or the database constraints) to see
+        from .recurrence import has_recurring_conflict, lazy_expansion_enabled
+        if lazy_expansion_enabled() and not self.is_cancelled and has_recurring_conflict(
+            self.computer.lab, self.start_time, self.end_time
+        ):
+            raise ValidationError('Lab is reserved for a session during this time slot')
     
     def save(self, *args, **kwargs):
         is_new = self.pk is None
-        self.clean()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            written = [field.attname for field in self._meta.concrete_fields]
+        else:
+            written = [self._meta.get_field(name).attname for name in update_fields]
         
-        # Set timestamps if status changed
+        validate = is_new
         if not is_new:
-            old_booking = ComputerBooking.objects.get(pk=self.pk)
-            if not old_booking.is_approved and self.is_approved:
-                self.approved_at = timezone.now()
-            if not old_booking.is_cancelled and self.is_cancelled:
-                self.cancelled_at = timezone.now()
-            if not old_booking.extension_requested and self.extension_requested:
-                self.extension_requested_at = timezone.now()
-            if not old_booking.extension_approved and self.extension_approved:
-                self.extension_approved_at = timezone.now()
-                
-        super(ComputerBooking, self).save(*args, **kwargs)
+            flags = [flag for flag in self.TRANSITION_TIMESTAMPS if flag in written]
+            checked = [field for field in self.VALIDATED_FIELDS if field in written]
+            stored = self._stored_values(list(dict.fromkeys(flags + checked)))
+            
+            # Set timestamps if status changed
+            stamped = []
+            for flag in flags:
+                if not stored[flag] and getattr(self, flag):
+                    setattr(self, self.TRANSITION_TIMESTAMPS[flag], timezone.now())
+                    stamped.append(self.TRANSITION_TIMESTAMPS[flag])
+            if update_fields is not None and stamped:
+                kwargs['update_fields'] = list(dict.fromkeys([*update_fields, *stamped]))
+                written += stamped
+            
+            validate = any(stored[field] != getattr(self, field) for field in checked)
+        
+        if validate:
+            save_with_overlap_rule(
+                self,
+                lambda: super(ComputerBooking, self).save(*args, **kwargs),
+                Lab.objects.filter(computers=self.computer_id)
+            )
+        else:
+            # Nothing an overlap depends on changed (reminders, email flags,
+            # extension requests), so the save is a single UPDATE
+            super().save(*args, **kwargs)
+        self._loaded_values = {
+            **getattr(self, '_loaded_values', {}),
+            **{field: getattr(self, field) for field in written},
+        }
         
         # Notify relevant admins about new booking (no duplicates)
         if is_new:
-            lab_admins = User.objects.filter(is_admin=True, managed_labs=self.computer.lab)
-            super_admins = User.objects.filter(is_super_admin=True)
-            all_admins = set(list(lab_admins) + list(super_admins))
-            for admin in all_admins:
-                Notification.objects.create(
-                    user=admin,
-                    message=f"New computer booking: {self.computer} by {self.student.username}",
-                    notification_type='new_booking',
-                    booking=self
-                )
+            from .notifications import notify_lab_admins
+            notify_lab_admins(
+                self.computer.lab_id,
+                f"New computer booking: {self.computer} by {self.student.username}",
+                'new_booking',
+                coalesce_key=f'new_booking:lab:{self.computer.lab_id}',
+                summary=f"{{count}} new computer bookings in {self.computer.lab.name}",
+                booking=self
+            )
     
     def __str__(self):
         return f"Booking {self.booking_code}: {self.computer} - {self.start_time.strftime('%Y-%m-%d %H:%M')} to {self.end_time.strftime('%H:%M')}"
@@ -369,28 +541,60 @@ class ComputerBooking(models.Model):
         """Check if booking can be extended by 30 minutes"""
         if self.is_cancelled or not self.is_approved:
             return False
-            
-        # Calculate potential extended end time
-        extended_end_time = self.end_time + timedelta(minutes=30)
+        return ComputerBooking.extension_eligibility([self])[self.id]
+    
+    @staticmethod
+    def extension_eligibility(bookings):
+        """
+        Check a batch of approved bookings for a 30 minute extension.
+        
+        Returns {booking id: bool}, using one query for the bookings that
+        follow them and one for the lab sessions, however many bookings
+        are checked. The bookings' computers should be loaded.
+        """
+        bookings = list(bookings)
+        if not bookings:
+            return {}
         
-        # Check if there's another booking for this computer right after
-        next_bookings = ComputerBooking.objects.filter(
-            computer=self.computer,
+        extension = timedelta(minutes=30)
+        window_start = min(booking.end_time for booking in bookings)
+        window_end = max(booking.end_time for booking in bookings) + extension
+        
+        # Other bookings starting on these computers within the extension
+        following = {}
+        for computer_id, start_time in ComputerBooking.objects.filter(
+            computer_id__in={booking.computer_id for booking in bookings},
             is_approved=True,
             is_cancelled=False,
-            start_time__gt=self.end_time,
-            start_time__lt=extended_end_time
-        )
+            start_time__gt=window_start,
+            start_time__lt=window_end
+        ).values_list('computer_id', 'start_time'):
+            following.setdefault(computer_id, []).append(start_time)
         
-        # Check if there's a lab session during the extended time
-        lab_sessions = LabSession.objects.filter(
-            lab=self.computer.lab,
+        # Lab sessions during the extended time
+        sessions = {}
+        for lab_id, start_time, end_time in LabSession.objects.filter(
+            lab_id__in={booking.computer.lab_id for booking in bookings},
             is_approved=True,
-            start_time__lt=extended_end_time,
-            end_time__gt=self.end_time
-        )
+            is_cancelled=False,
+            start_time__lt=window_end,
+            end_time__gt=window_start
+        ).values_list('lab_id', 'start_time', 'end_time'):
+            sessions.setdefault(lab_id, []).append((start_time, end_time))
         
-        return not (next_bookings.exists() or lab_sessions.exists())
+        eligibility = {}
+        for booking in bookings:
+            extended_end_time = booking.end_time + extension
+            next_booking = any(
+                booking.end_time < start_time < extended_end_time
+                for start_time in following.get(booking.computer_id, [])
+            )
+            lab_session = any(
+                start_time < extended_end_time and end_time > booking.end_time
+                for start_time, end_time in sessions.get(booking.computer.lab_id, [])
+            )
+            eligibility[booking.id] = not (next_booking or lab_session)
+        return eligibility
     
     def extend_booking(self):
         """Extend the booking by 30 minutes if possible"""
@@ -455,19 +659,15 @@ class ComputerBooking(models.Model):
         self.save(update_fields=['is_cancelled', 'cancelled_at', 'cancellation_reason'])
         
         # Notify admins about cancellation
-        lab_admins = User.objects.filter(
-            is_admin=True, 
-            managed_labs=self.computer.lab
+        from .notifications import notify_lab_admins
+        notify_lab_admins(
+            self.computer.lab_id,
+            f"Booking {self.booking_code} for {self.computer} has been cancelled by {self.student.username}. Reason: {reason or 'No reason provided'}",
+            'booking_cancelled',
+            coalesce_key=f'booking_cancelled:lab:{self.computer.lab_id}',
+            summary=f"{{count}} bookings cancelled in {self.computer.lab.name}",
+            booking=self
         )
-        
-        # Create notifications for lab-specific admins
-        for admin in lab_admins:
-            Notification.objects.create(
-                user=admin,
-                message=f"Booking {self.booking_code} for {self.computer} has been cancelled by {self.student.username}. Reason: {reason or 'No reason provided'}",
-                notification_type='booking_cancelled',
-                booking=self
-            )
             
         # Create notification for the student
         Notification.objects.create(
@@ -518,69 +718,214 @@ class RecurringSession(models.Model):
         if conflicts:
             raise ValidationError(f'Conflicts exist with existing sessions: {conflicts}')
     
+    def get_occurrences(self, window_start=None, window_end=None):
+        """
+        Return aware (start, end) datetimes for every occurrence of the series,
+        or only those overlapping window_start..window_end when both are given
+        """
+        occurrence_starts = rrule(
+            freq={'daily': DAILY, 'weekly': WEEKLY, 'monthly': MONTHLY}[self.recurrence_type],
+            dtstart=datetime.combine(self.start_date, self.start_time),
+            until=datetime.combine(self.end_date, self.end_time)
+        )
+        if window_start is not None and window_end is not None:
+            # rrule works on naive local times; an occurrence overlaps the
+            # window when it starts before the window ends and less than one
+            # occurrence length before the window starts
+            duration = (
+                datetime.combine(self.start_date, self.end_time)
+                - datetime.combine(self.start_date, self.start_time)
+            )
+            occurrence_starts = occurrence_starts.between(
+                timezone.localtime(window_start).replace(tzinfo=None) - duration,
+                timezone.localtime(window_end).replace(tzinfo=None),
+                inc=False
+            )
+        return [
+            (
+                timezone.make_aware(occurrence),
+                timezone.make_aware(datetime.combine(occurrence.date(), self.end_time))
+            )
+            for occurrence in occurrence_starts
+        ]
+    
     def check_session_conflicts(self):
-        conflicts = []
+        """
+        Return the start of every occurrence that clashes with an approved lab
+        session, or falls within another approved recurring series in the lab.
         
-        # Get all occurrence dates
-        occurrence_dates = list(rrule(
-            freq={'daily': DAILY, 'weekly': WEEKLY, 'monthly': MONTHLY}[self.recurrence_type],
-            dtstart=parse(f"{self.start_date} {self.start_time}"),
-            until=parse(f"{self.end_date} {self.end_time}")
-        ))
+        Candidates for the whole series are fetched with one query per model
+        and intersected with the occurrences in memory.
+        """
+        from .availability import overlap_flags
         
-        for occurrence in occurrence_dates:
-            # Check conflicts with existing lab sessions
-            conflicting_sessions = LabSession.objects.filter(
-                Q(lab=self.lab) &
-                Q(start_time__lt=occurrence + timezone.timedelta(hours=self.end_time.hour, minutes=self.end_time.minute)) &
-                Q(end_time__gt=occurrence + timezone.timedelta(hours=self.start_time.hour, minutes=self.start_time.minute)) &
-                Q(is_approved=True)
-            )
-            
-            # Check conflicts with other recurring sessions
-            conflicting_recurring_sessions = RecurringSession.objects.filter(
-                Q(lab=self.lab) &
-                Q(start_date__lte=occurrence.date()) &
-                Q(end_date__gte=occurrence.date()) &
-                Q(is_approved=True)
-            ).exclude(pk=self.pk if self.pk else None)
-            
-            if conflicting_sessions.exists() or conflicting_recurring_sessions.exists():
-                conflicts.append(occurrence.strftime('%Y-%m-%d %H:%M'))
+        occurrences = self.get_occurrences()
+        if not occurrences:
+            return []
+        
+        series_start = occurrences[0][0]
+        series_end = occurrences[-1][1]
+        
+        # Check conflicts with existing lab sessions
+        conflicting_sessions = LabSession.objects.filter(
+            lab=self.lab,
+            is_approved=True,
+            start_time__lt=series_end,
+            end_time__gt=series_start
+        )
+        if self.pk:
+            # The series' own materialized occurrences are not conflicts
+            conflicting_sessions = conflicting_sessions.exclude(recurring_session=self)
+        conflicting_sessions = conflicting_sessions.values_list('start_time', 'end_time')
         
-        return conflicts
+        # Check conflicts with other recurring sessions (any overlap in dates)
+        conflicting_recurring_sessions = RecurringSession.objects.filter(
+            lab=self.lab,
+            is_approved=True,
+            start_date__lte=self.end_date,
+            end_date__gte=self.start_date
+        ).exclude(pk=self.pk if self.pk else None).values_list('start_date', 'end_date')
+        
+        session_clashes = overlap_flags(occurrences, list(conflicting_sessions))
+        
+        one_day = timedelta(days=1)
+        occurrence_days = [(start.date(), start.date() + one_day) for start, _ in occurrences]
+        series_days = [(start_date, end_date + one_day) for start_date, end_date in conflicting_recurring_sessions]
+        recurring_clashes = overlap_flags(occurrence_days, series_days)
+        
+        return [
+            timezone.localtime(start).strftime('%Y-%m-%d %H:%M')
+            for (start, _), session_clash, recurring_clash
+            in zip(occurrences, session_clashes, recurring_clashes)
+            if session_clash or recurring_clash
+        ]
     
     def save(self, *args, **kwargs):
         self.clean()
         super().save(*args, **kwargs)
         
         # If the recurring session is approved, create individual lab sessions
-        if self.is_approved:
-            occurrence_dates = list(rrule(
-                freq={'daily': DAILY, 'weekly': WEEKLY, 'monthly': MONTHLY}[self.recurrence_type],
-                dtstart=parse(f"{self.start_date} {self.start_time}"),
-                until=parse(f"{self.end_date} {self.end_time}")
-            ))
+        # (lazily expanded series are read from the series itself instead)
+        from .recurrence import lazy_expansion_enabled
+        if self.is_approved and not lazy_expansion_enabled():
+            self.materialize()
+    
+    def materialize(self):
+        """
+        Sync the series' LabSession rows with its occurrences.
+        
+        Missing occurrences are inserted with a single bulk_create, future
+        occurrences that no longer belong to the series are removed and the
+        rest are left untouched, so re-saving an approved series only applies
+        the difference. Past occurrences are kept as history. Admins get one
+        summary notification instead of one per occurrence.
+        
+        Returns a (created, removed) tuple of counts.
+        """
+        now = timezone.now()
+        occurrences = dict(self.get_occurrences())
+        
+        from .occupancy import days_touched, refresh_session_rows
+        from .signals import schedule_changed
+        
+        with transaction.atomic():
+            upcoming = self.occurrences.filter(start_time__gte=now)
             
-            for occurrence in occurrence_dates:
-                start_datetime = timezone.make_aware(occurrence)
-                end_datetime = timezone.make_aware(occurrence + timezone.timedelta(
-                    hours=self.end_time.hour, 
-                    minutes=self.end_time.minute
-                ))
-                
-                LabSession.objects.create(
+            # Occurrences moving to the series' new lab, whose old and new
+            # labs both change
+            moved = list(upcoming.exclude(lab=self.lab).values_list('lab_id', 'start_time', 'end_time'))
+            
+            # Carry edits of the series details over to upcoming occurrences
+            upcoming.exclude(
+                lab=self.lab, lecturer=self.lecturer, title=self.title
+            ).update(lab=self.lab, lecturer=self.lecturer, title=self.title)
+            
+            existing = {
+                start_time: (pk, end_time)
+                for pk, start_time, end_time in self.occurrences.values_list('id', 'start_time', 'end_time')
+            }
+            
+            stale_ids = {
+                pk for start_time, (pk, end_time) in existing.items()
+                if start_time >= now and occurrences.get(start_time) != end_time
+            }
+            if stale_ids:
+                LabSession.objects.filter(id__in=stale_ids).delete()
+            
+            new_sessions = [
+                LabSession(
                     lab=self.lab,
                     lecturer=self.lecturer,
                     title=self.title,
-                    start_time=start_datetime,
-                    end_time=end_datetime,
-                    is_approved=True
+                    start_time=start_time,
+                    end_time=end_time,
+                    is_approved=True,
+                    recurring_session=self
                 )
+                for start_time, end_time in occurrences.items()
+                if start_time not in existing or existing[start_time][0] in stale_ids
+            ]
+            LabSession.objects.bulk_create(new_sessions, ignore_conflicts=True)
+            # ignore_conflicts skips occurrences a concurrent request wrote
+            # first and leaves the instances without pks, so count the rows
+            # that actually exist now
+            created = list(self.occurrences.filter(
+                start_time__in=[session.start_time for session in new_sessions]
+            ).values_list('start_time', 'end_time')) if new_sessions else []
+            
+            # update() and bulk_create() send no signals, so refresh the
+            # labs' occupancy and announce the moved and new sessions here
+            changed = moved + [(self.lab_id, start_time, end_time) for start_time, end_time in created]
+            changed_days = {}
+            changed_rows = set()
+            for lab_id, start_time, end_time in changed:
+                days = days_touched(start_time, end_time)
+                changed_days.setdefault(lab_id, set()).update(days)
+                changed_days.setdefault(self.lab_id, set()).update(days)
+                start_day = timezone.localdate(start_time)
+                changed_rows |= {(lab_id, start_day), (self.lab_id, start_day)}
+            for lab_id, days in changed_days.items():
+                transaction.on_commit(lambda lab_id=lab_id, days=days: refresh_session_rows(lab_id, days))
+            if changed_rows:
+                schedule_changed.send(sender=LabSession, changes=changed_rows)
+            
+            if created:
+                from .notifications import notify_lab_admins
+                notify_lab_admins(
+                    self.lab_id,
+                    f"Recurring session '{self.title}' in {self.lab.name} by {self.lecturer.username}: {len(created)} lab sessions scheduled",
+                    'session_booked',
+                    recurring_session=self
+                )
+        
+        return len(created), len(stale_ids)
     
     def __str__(self):
         return f"{self.title} - {self.recurrence_type.capitalize()} from {self.start_date} to {self.end_date}"
 
+class LabOccupancy(models.Model):
+    """
+    One day of a lab as a grid of 15-minute slots, derived from approved
+    bookings and lab sessions and maintained by booking.occupancy.
+    
+    grid packs one bitmask per computer (in computer_ids order) with a set
+    bit for every slot taken by a booking; sessions is the bitmask of slots
+    blocked for the whole lab by a lab session.
+    """
+    lab = models.ForeignKey(Lab, on_delete=models.CASCADE, related_name='occupancy')
+    date = models.DateField()
+    computer_ids = models.JSONField(default=list)
+    grid = models.BinaryField(default=bytes)
+    sessions = models.BinaryField(default=bytes)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('lab', 'date')
+        verbose_name_plural = 'Lab occupancy'
+    
+    def __str__(self):
+        return f"{self.lab.name} occupancy on {self.date}"
+
 class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
     message = models.TextField()
@@ -600,18 +945,82 @@ class Notification(models.Model):
         ('attendance_marked', 'Attendance Marked'),
         ('attendance_updated', 'Attendance Updated'),
         ('session_cancelled', 'Session Cancelled'),
+        ('digest', 'Digest'),
     ])
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Repeats of an event with the same key are folded into this row while
+    # it is unread and recent, counting them (see booking.notifications)
+    coalesce_key = models.CharField(max_length=100, blank=True, default='')
+    count = models.PositiveIntegerField(default=1)
+    
     # Optional references to different entities
     booking = models.ForeignKey(ComputerBooking, on_delete=models.SET_NULL, null=True, blank=True, related_name='notifications')
     lab_session = models.ForeignKey(LabSession, on_delete=models.SET_NULL, null=True, blank=True, related_name='notifications')
     recurring_session = models.ForeignKey(RecurringSession, on_delete=models.SET_NULL, null=True, blank=True, related_name='notifications')
     
+    class Meta:
+        indexes = [
+            # Unread lists and counts of a user, newest first
+            models.Index(fields=['user', 'is_read', 'created_at'], name='notification_user_read_idx'),
+            # notification_list_view: a user's notifications paged by id
+            models.Index(fields=['user', '-id'], name='notification_user_recent_idx'),
+        ]
+    
     def __str__(self):
         return f"Notification for {self.user.username}: {self.notification_type}"    
 
+class NotificationDigestEntry(models.Model):
+    """
+    Repeats of an event held back for a user on a notification digest,
+    counted under the event's coalescing key until send_notification_digests
+    turns them into the user's digest notification.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='digest_entries')
+    coalesce_key = models.CharField(max_length=100)
+    notification_type = models.CharField(max_length=50)
+    message = models.TextField()  # the latest event, shown when it happened once
+    summary = models.TextField()  # '{count} ...', shown when it repeated
+    count = models.PositiveIntegerField(default=1)
+    first_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'coalesce_key'], name='digest_entry_user_key_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.coalesce_key} x{self.count} for {self.user_id}"
+
+class OutboxEmail(models.Model):
+    """
+    An email written in the same transaction as the change it reports and
+    sent afterwards by the drain_email_outbox task, so a rolled back change
+    never sends one. The context is stored rendered-ready, since the
+    booking or session may be gone by the time the email goes out.
+    """
+    idempotency_key = models.CharField(max_length=100, unique=True)
+    template = models.CharField(max_length=100)  # without the .html/.txt extension
+    subject = models.CharField(max_length=255)
+    recipient = models.EmailField()
+    context = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Set while a drain is sending the email; other drains skip it until then
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # drain_email_outbox: unsent emails in the order they were queued
+            models.Index(fields=['id'], condition=Q(sent_at__isnull=True), name='outbox_unsent_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.idempotency_key} to {self.recipient}"
+
 class LabAdministrator(models.Model):
     admin = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lab_admin_roles')
     lab = models.ForeignKey(Lab, on_delete=models.CASCADE, related_name='admin_assignments')
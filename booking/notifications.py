@@ -0,0 +1,300 @@
+"""
+Notification fan-out.
+
+notify() writes every notification of an event with a single bulk_create,
+after removing duplicate recipients, so the cost of an event does not grow
+with the number of people told about it.
+
+Each user's unread count is kept in User.unread_notifications and adjusted
+with F() updates in the same transaction as the rows: by bulk_notify() and
+mark_read() here, and by booking.signals for notifications created or
+deleted one at a time. Together with the id of the user's latest
+notification and the sum of their counts, cached here, it versions the
+polled unread list. Both
+changes are also pushed to open notification streams (booking.streams).
+
+Events that repeat in bursts (new bookings in a lab during registration,
+say) are sent with a coalesce_key: while a recipient's notification with
+that key is unread and younger than COALESCE_WINDOW, a repeat updates its
+count and summary in place instead of adding a row, leaving the indexed
+columns alone. A folded notification no longer points to the booking or
+session of its first event. Recipients on a digest (User.notification_digest) get no
+row per event at all; the repeats are counted in NotificationDigestEntry
+and send_digests() turns them into one notification per digest.
+
+The admins told about events in a lab are its lab admins plus every super
+admin. They are resolved from one cached map of lab -> admin ids, which
+also lists the users on a digest, rebuilt with three queries after
+booking.signals drops it on managed_labs changes and on admin flag or
+digest changes.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Notification, NotificationDigestEntry, User
+from .streams import publish_count, publish_notifications
+
+ADMIN_MAP_KEY = 'notifications:lab_admins'
+ADMIN_MAP_TIMEOUT = 60 * 60
+STATE_TIMEOUT = 60 * 60 * 24
+
+# How long an unread notification keeps absorbing repeats of its event
+COALESCE_WINDOW = timedelta(hours=1)
+
+# A folded notification stands for several events, so it links to none
+FOLDED_REFERENCES = {'booking': None, 'lab_session': None, 'recurring_session': None}
+
+# Notifications per unread_notifications_json response
+NOTIFICATION_PAGE_SIZE = 20
+NOTIFICATION_MAX_PAGE_SIZE = 100
+
+# Notifications per notification_list_view page
+NOTIFICATION_LIST_PAGE_SIZE = 50
+
+
+def _admin_map():
+    """{'super_admins': [user ids], 'labs': {lab id: [user ids]}, 'digest_users': [user ids]}"""
+    admin_map = cache.get(ADMIN_MAP_KEY)
+    if admin_map is None:
+        labs = {}
+        for user_id, lab_id in User.objects.filter(
+            is_admin=True, managed_labs__isnull=False
+        ).values_list('id', 'managed_labs'):
+            labs.setdefault(lab_id, []).append(user_id)
+        admin_map = {
+            'super_admins': list(User.objects.filter(is_super_admin=True).values_list('id', flat=True)),
+            'labs': labs,
+            'digest_users': list(User.objects.exclude(notification_digest='').values_list('id', flat=True)),
+        }
+        cache.set(ADMIN_MAP_KEY, admin_map, ADMIN_MAP_TIMEOUT)
+    return admin_map
+
+
+def invalidate_admin_map():
+    """Forget the cached lab -> admin map."""
+    cache.delete(ADMIN_MAP_KEY)
+
+
+def lab_admin_ids(lab_id):
+    """Ids of the lab's admins and of all super admins."""
+    admin_map = _admin_map()
+    return admin_map['labs'].get(lab_id, []) + admin_map['super_admins']
+
+
+def digest_user_ids():
+    """Ids of the users on a notification digest."""
+    return _admin_map()['digest_users']
+
+
+def notify(recipients, message, notification_type, on_commit=False, coalesce_key=None, summary=None, **references):
+    """
+    Send one notification to each distinct recipient with a single INSERT.
+
+    recipients may be users or user ids; references are the booking,
+    lab_session or recurring_session the notification points to. With
+    on_commit the rows are written once the surrounding transaction commits,
+    and nothing is written if it rolls back. Returns the notifications
+    created or updated (none when deferred).
+
+    With a coalesce_key, repeats of the event are folded as described
+    above; summary is the message of a folded notification, formatted with
+    its count ('{count} new bookings in Lab 3').
+    """
+    user_ids = list(dict.fromkeys(getattr(recipient, 'pk', recipient) for recipient in recipients))
+    if coalesce_key is None:
+        return bulk_notify([
+            Notification(user_id=user_id, message=message, notification_type=notification_type, **references)
+            for user_id in user_ids
+        ], on_commit=on_commit)
+
+    def write():
+        return _coalesce(user_ids, message, notification_type, coalesce_key, summary, references)
+    if on_commit:
+        transaction.on_commit(write)
+        return []
+    return write()
+
+
+def bulk_notify(notifications, on_commit=False):
+    """
+    Write prepared Notification objects, each with its own recipient and
+    message, with a single INSERT; on_commit as for notify().
+    """
+    notifications = list(notifications)
+    if not notifications:
+        return []
+    if on_commit:
+        transaction.on_commit(lambda: _write(notifications))
+        return []
+    return _write(notifications)
+
+
+def _write(notifications):
+    with transaction.atomic():
+        created = Notification.objects.bulk_create(notifications)
+        added = Counter(notification.user_id for notification in created if not notification.is_read)
+        # One UPDATE per distinct increment, usually a single one
+        users_by_increment = {}
+        for user_id, increment in added.items():
+            users_by_increment.setdefault(increment, []).append(user_id)
+        for increment, user_ids in users_by_increment.items():
+            adjust_unread(user_ids, increment)
+        forget_latest_id({notification.user_id for notification in created})
+        publish_notifications(created)
+    return created
+
+
+def _coalesce(user_ids, message, notification_type, coalesce_key, summary, references):
+    with transaction.atomic():
+        digest_users = set(digest_user_ids())
+        held = [user_id for user_id in user_ids if user_id in digest_users]
+        if held:
+            _hold_for_digest(held, message, notification_type, coalesce_key, summary)
+
+        folded = {}
+        for notification in Notification.objects.filter(
+            user_id__in=[user_id for user_id in user_ids if user_id not in digest_users],
+            coalesce_key=coalesce_key,
+            is_read=False,
+            created_at__gte=timezone.now() - COALESCE_WINDOW
+        ).order_by('user_id', '-id').select_for_update():
+            folded.setdefault(notification.user_id, notification)
+        # One UPDATE per distinct count, usually a single one as the same
+        # admins see the same events
+        by_count = {}
+        for notification in folded.values():
+            by_count.setdefault(notification.count, []).append(notification)
+        for count, notifications in by_count.items():
+            folded_message = summary.format(count=count + 1)
+            Notification.objects.filter(id__in=[notification.id for notification in notifications]).update(
+                count=count + 1, message=folded_message, **FOLDED_REFERENCES
+            )
+            for notification in notifications:
+                notification.count = count + 1
+                notification.message = folded_message
+                for field, value in FOLDED_REFERENCES.items():
+                    setattr(notification, field, value)
+        # The folded rows keep their ids, so the polling ETag changes
+        # through the count sum of notification_state()
+        forget_latest_id(list(folded))
+        publish_notifications(folded.values())
+
+        created = bulk_notify([
+            Notification(
+                user_id=user_id, message=message, notification_type=notification_type,
+                coalesce_key=coalesce_key, **references
+            )
+            for user_id in user_ids
+            if user_id not in digest_users and user_id not in folded
+        ])
+    return list(folded.values()) + created
+
+
+def _hold_for_digest(user_ids, message, notification_type, coalesce_key, summary):
+    entries = NotificationDigestEntry.objects.filter(user_id__in=user_ids, coalesce_key=coalesce_key)
+    counted = set(entries.values_list('user_id', flat=True))
+    if counted:
+        entries.update(count=F('count') + 1, message=message, summary=summary)
+    NotificationDigestEntry.objects.bulk_create([
+        NotificationDigestEntry(
+            user_id=user_id, coalesce_key=coalesce_key, notification_type=notification_type,
+            message=message, summary=summary
+        )
+        for user_id in user_ids if user_id not in counted
+    ], ignore_conflicts=True)
+
+
+def send_digests(now=None):
+    """
+    Turn the held events of every user whose digest is due into one
+    notification each: hourly digests on every run, daily ones on the run
+    in NOTIFICATION_DIGEST_HOUR, and anything left for users who went back
+    to immediate notifications straight away. Returns the number of
+    digests sent.
+    """
+    now = now or timezone.now()
+    due = ['', 'hourly']
+    if timezone.localtime(now).hour == settings.NOTIFICATION_DIGEST_HOUR:
+        due.append('daily')
+
+    with transaction.atomic():
+        entries = list(NotificationDigestEntry.objects.filter(
+            user__notification_digest__in=due
+        ).order_by('user_id', 'first_at').select_for_update(skip_locked=True, of=('self',)))
+        lines = {}
+        for entry in entries:
+            lines.setdefault(entry.user_id, []).append(
+                entry.message if entry.count == 1 else entry.summary.format(count=entry.count)
+            )
+        bulk_notify([
+            Notification(user_id=user_id, message='\n'.join(user_lines), notification_type='digest')
+            for user_id, user_lines in lines.items()
+        ])
+        NotificationDigestEntry.objects.filter(id__in=[entry.id for entry in entries]).delete()
+    return len(lines)
+
+
+def _state_key(user_id):
+    return f'notifications:{user_id}:state'
+
+
+def notification_state(user_id):
+    """
+    (id of the user's most recent notification, sum of the counts of their
+    notifications), (0, 0) if none, cached. The sum also moves when an
+    event is folded into an existing notification.
+    """
+    state = cache.get(_state_key(user_id))
+    if state is None:
+        totals = Notification.objects.filter(user_id=user_id).aggregate(latest=Max('id'), counts=Sum('count'))
+        state = (totals['latest'] or 0, totals['counts'] or 0)
+        cache.set(_state_key(user_id), state, STATE_TIMEOUT)
+    return state
+
+
+def latest_notification_id(user_id):
+    """Id of the user's most recent notification (0 if none), cached."""
+    return notification_state(user_id)[0]
+
+
+def forget_latest_id(user_ids):
+    """Drop the cached notification_state() of user_ids once the transaction commits."""
+    keys = [_state_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def adjust_unread(user_ids, delta):
+    """Add delta to the unread counters of user_ids, never going below zero."""
+    User.objects.filter(id__in=user_ids).update(
+        unread_notifications=Greatest(F('unread_notifications') + delta, 0)
+    )
+
+
+def mark_read(user, notification_ids=None):
+    """
+    Mark the user's unread notifications (or those of notification_ids)
+    read and lower the counter by as many. Returns how many were marked.
+    """
+    with transaction.atomic():
+        unread = Notification.objects.filter(user=user, is_read=False)
+        if notification_ids is not None:
+            unread = unread.filter(id__in=notification_ids)
+        marked = unread.update(is_read=True)
+        if marked:
+            adjust_unread([user.pk], -marked)
+            publish_count([user.pk])
+    if marked and hasattr(user, 'unread_notifications'):
+        user.unread_notifications = max(user.unread_notifications - marked, 0)
+    return marked
+
+
+def notify_lab_admins(lab_id, message, notification_type, on_commit=False, **kwargs):
+    """notify() the admins of lab_id and all super admins."""
+    return notify(lab_admin_ids(lab_id), message, notification_type, on_commit=on_commit, **kwargs)
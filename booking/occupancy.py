@@ -0,0 +1,321 @@
+"""
+Per-lab, per-day occupancy grids.
+
+A LabOccupancy row holds one day of a lab as 96 slots of 15 minutes: one
+bitmask per computer with a bit set for every slot taken by an approved
+booking, plus one bitmask of slots blocked for the whole lab by approved lab
+sessions. The masks are plain Python ints, so testing a computer for a time
+range or counting the computers booked in it is a handful of bitwise
+operations over the whole day at once, and a week view of a large lab
+needs a single query once its grids exist.
+
+Grids are stored by store_grids(), which the build_occupancy_grids task
+runs for the coming OCCUPANCY_GRID_DAYS, and then kept current by the
+signal handlers in booking.signals: saving, cancelling, extending or
+deleting a booking recomputes that computer's row for the days involved,
+and lab session changes recompute the session row. Bulk writes that bypass
+signals call refresh_session_rows() or invalidate_occupancy() themselves.
+Reads never store grids: week_view() falls back to the in-memory engine of
+booking.availability for a window whose grids are not all stored yet.
+
+Building, refreshing and dropping grids all take a lock on the lab row. A
+change committed while a grid is being built is either read by the build
+or refreshed once the grid is stored, so a grid never keeps a snapshot
+older than the changes refreshed so far.
+
+Bookings are rounded out to whole slots, so the grid is conservative: a
+booking ending at 10:05 takes the 10:00-10:15 slot.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .availability import hourly_slots, lab_slot_availability
+from .models import Computer, ComputerBooking, Lab, LabOccupancy, LabSession
+from .recurrence import lazy_expansion_enabled, recurring_occurrences
+from .timeranges import date_range, day_start
+
+SLOT_MINUTES = 15
+SLOT = timedelta(minutes=SLOT_MINUTES)
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+ROW_BYTES = SLOTS_PER_DAY // 8
+
+
+def days_touched(start, end):
+    """Local dates covered by the half-open interval start..end."""
+    first = timezone.localtime(start).date()
+    last = timezone.localtime(end - timedelta(microseconds=1)).date()
+    return [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+
+def slot_mask(first_slot, slot_count):
+    """Bitmask of slot_count slots starting at first_slot, clipped to the day."""
+    first_slot = max(0, first_slot)
+    last_slot = min(SLOTS_PER_DAY, first_slot + slot_count)
+    if last_slot <= first_slot:
+        return 0
+    return ((1 << (last_slot - first_slot)) - 1) << first_slot
+
+
+def interval_mask(start, end, day):
+    """Bitmask of the slots of day overlapped by start..end."""
+    midnight = day_start(day)
+    first_slot = (start - midnight) // SLOT
+    last_slot = -((midnight - end) // SLOT)  # rounded up
+    return slot_mask(first_slot, last_slot - max(0, first_slot))
+
+
+def slot_time(day, slot):
+    """Aware start time of a slot of day."""
+    return day_start(day) + slot * SLOT
+
+
+class OccupancyGrid:
+    """In-memory form of a LabOccupancy row."""
+
+    def __init__(self, lab_id, date, computer_ids, rows, sessions=0):
+        self.lab_id = lab_id
+        self.date = date
+        self.computer_ids = list(computer_ids)
+        self.rows = list(rows)
+        self.sessions = sessions
+
+    @classmethod
+    def from_model(cls, occupancy):
+        data = bytes(occupancy.grid)
+        rows = [
+            int.from_bytes(data[index * ROW_BYTES:(index + 1) * ROW_BYTES], 'little')
+            for index in range(len(occupancy.computer_ids))
+        ]
+        return cls(
+            occupancy.lab_id, occupancy.date, occupancy.computer_ids, rows,
+            int.from_bytes(bytes(occupancy.sessions), 'little')
+        )
+
+    def apply_to(self, occupancy):
+        occupancy.computer_ids = self.computer_ids
+        occupancy.grid = b''.join(row.to_bytes(ROW_BYTES, 'little') for row in self.rows)
+        occupancy.sessions = self.sessions.to_bytes(ROW_BYTES, 'little')
+        return occupancy
+
+    def to_model(self):
+        return self.apply_to(LabOccupancy(lab_id=self.lab_id, date=self.date))
+
+    def busy_count(self, mask):
+        """Number of computers booked for any slot in mask."""
+        return sum(1 for row in self.rows if row & mask)
+
+
+def session_intervals(lab_id, window_start, window_end):
+    """(start, end) of the approved lab sessions of a lab overlapping the window."""
+    intervals = list(LabSession.objects.filter(
+        lab_id=lab_id,
+        is_approved=True,
+        is_cancelled=False,
+        start_time__lt=window_end,
+        end_time__gt=window_start
+    ).values_list('start_time', 'end_time'))
+    if lazy_expansion_enabled():
+        intervals += [
+            (session.start_time, session.end_time)
+            for session in recurring_occurrences(window_start, window_end, labs=[lab_id])
+        ]
+    return intervals
+
+
+def _session_masks(lab_id, dates):
+    window_start, window_end = date_range(min(dates), max(dates))
+    masks = dict.fromkeys(dates, 0)
+    for start, end in session_intervals(lab_id, window_start, window_end):
+        for day in days_touched(start, end):
+            if day in masks:
+                masks[day] |= interval_mask(start, end, day)
+    return masks
+
+
+def _booking_masks(bookings, dates):
+    """{(computer_id, day): mask} for (computer_id, start, end) bookings."""
+    masks = {}
+    for computer_id, start, end in bookings:
+        for day in days_touched(start, end):
+            if day in dates:
+                key = (computer_id, day)
+                masks[key] = masks.get(key, 0) | interval_mask(start, end, day)
+    return masks
+
+
+def build_grids(lab_id, dates):
+    """Compute grids for dates of a lab from bookings and sessions."""
+    dates = set(dates)
+    computer_ids = list(
+        Computer.objects.filter(lab_id=lab_id).order_by('id').values_list('id', flat=True)
+    )
+    window_start, window_end = date_range(min(dates), max(dates))
+    booking_masks = _booking_masks(ComputerBooking.objects.filter(
+        computer__lab_id=lab_id,
+        is_approved=True,
+        is_cancelled=False,
+        start_time__lt=window_end,
+        end_time__gt=window_start
+    ).values_list('computer_id', 'start_time', 'end_time'), dates)
+    session_masks = _session_masks(lab_id, dates)
+
+    return {
+        day: OccupancyGrid(
+            lab_id, day, computer_ids,
+            [booking_masks.get((computer_id, day), 0) for computer_id in computer_ids],
+            session_masks[day]
+        )
+        for day in dates
+    }
+
+
+def _lock_lab(lab_id):
+    # A no-op UPDATE locks the lab row (the database on SQLite), as in
+    # booking.overlap
+    Lab.objects.filter(pk=lab_id).update(id=F('id'))
+
+
+def _stored_grids(lab_id, dates):
+    return {
+        occupancy.date: OccupancyGrid.from_model(occupancy)
+        for occupancy in LabOccupancy.objects.filter(lab_id=lab_id, date__in=dates)
+    }
+
+
+def lab_grids(lab, start_date, days=1):
+    """
+    Grids for days consecutive dates of lab from start_date, in date order.
+
+    Stored grids are read with one query; missing ones are built from the
+    bookings and sessions in memory and not stored.
+    """
+    lab_id = getattr(lab, 'pk', lab)
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    grids = _stored_grids(lab_id, dates)
+    missing = [day for day in dates if day not in grids]
+    if missing:
+        grids.update(build_grids(lab_id, missing))
+    return [grids[day] for day in dates]
+
+
+def store_grids(lab, start_date, days=1):
+    """
+    Build and store the missing grids for days consecutive dates of lab
+    from start_date. Returns the number of grids stored.
+    """
+    lab_id = getattr(lab, 'pk', lab)
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    if len(_stored_grids(lab_id, dates)) == len(dates):
+        return 0
+    with transaction.atomic():
+        _lock_lab(lab_id)
+        # Another build may have stored some while this one waited
+        missing = [day for day in dates if day not in _stored_grids(lab_id, dates)]
+        if not missing:
+            return 0
+        built = build_grids(lab_id, missing)
+        LabOccupancy.objects.bulk_create([grid.to_model() for grid in built.values()])
+    return len(built)
+
+
+def refresh_computer_rows(computer_id, days):
+    """Recompute one computer's row in the stored grids for days."""
+    lab_id = Computer.objects.filter(pk=computer_id).values_list('lab_id', flat=True).first()
+    if lab_id is None:
+        # Deleted with its lab's grids
+        return
+    with transaction.atomic():
+        _lock_lab(lab_id)
+        stored = list(LabOccupancy.objects.filter(lab_id=lab_id, date__in=days))
+        if not stored:
+            return
+        dates = {occupancy.date for occupancy in stored}
+        window_start, window_end = date_range(min(dates), max(dates))
+        masks = _booking_masks(ComputerBooking.objects.filter(
+            computer_id=computer_id,
+            is_approved=True,
+            is_cancelled=False,
+            start_time__lt=window_end,
+            end_time__gt=window_start
+        ).values_list('computer_id', 'start_time', 'end_time'), dates)
+
+        for occupancy in stored:
+            if computer_id not in occupancy.computer_ids:
+                # Built before the computer joined the lab
+                occupancy.delete()
+                continue
+            grid = OccupancyGrid.from_model(occupancy)
+            grid.rows[grid.computer_ids.index(computer_id)] = masks.get((computer_id, occupancy.date), 0)
+            grid.apply_to(occupancy).save(update_fields=['grid', 'updated_at'])
+
+
+def refresh_session_rows(lab_id, days):
+    """Recompute the lab session row of the stored grids of a lab for days."""
+    with transaction.atomic():
+        _lock_lab(lab_id)
+        stored = list(LabOccupancy.objects.filter(lab_id=lab_id, date__in=days))
+        if not stored:
+            return
+        masks = _session_masks(lab_id, {occupancy.date for occupancy in stored})
+        for occupancy in stored:
+            grid = OccupancyGrid.from_model(occupancy)
+            grid.sessions = masks[occupancy.date]
+            grid.apply_to(occupancy).save(update_fields=['sessions', 'updated_at'])
+
+
+def invalidate_occupancy(lab_id, start_date=None, end_date=None):
+    """Drop stored grids of a lab (optionally only from start_date to end_date)."""
+    stored = LabOccupancy.objects.filter(lab_id=lab_id)
+    if start_date is not None:
+        stored = stored.filter(date__gte=start_date)
+    if end_date is not None:
+        stored = stored.filter(date__lte=end_date)
+    with transaction.atomic():
+        _lock_lab(lab_id)
+        stored.delete()
+
+
+def week_view(lab, start_date, days=7, first_hour=8, last_hour=20, computer=None):
+    """
+    Hourly availability of a lab (or one of its computers) for days dates
+    from start_date.
+
+    Returns one dict per hour slot with the start_time, end_time, the
+    free_computers and booked_computers counts, session_blocked and is_free,
+    from the stored grids (one query) when the whole window has them.
+    """
+    lab_id = getattr(lab, 'pk', lab)
+    dates = [start_date + timedelta(days=offset) for offset in range(days)]
+    grids = _stored_grids(lab_id, dates)
+    if len(grids) < days:
+        # Not stored yet: sweep the window in memory rather than build and
+        # store grids on a read
+        return lab_slot_availability(
+            lab, hourly_slots(start_date, dates[-1], first_hour, last_hour), computer=computer
+        )
+
+    slots_per_hour = 60 // SLOT_MINUTES
+    results = []
+    for grid in (grids[day] for day in dates):
+        rows = grid.rows
+        if computer is not None:
+            rows = [row for computer_id, row in zip(grid.computer_ids, grid.rows) if computer_id == computer.pk]
+        for hour in range(first_hour, last_hour):
+            mask = slot_mask(hour * slots_per_hour, slots_per_hour)
+            booked = sum(1 for row in rows if row & mask)
+            free = len(rows) - booked
+            blocked = bool(grid.sessions & mask)
+            start = slot_time(grid.date, hour * slots_per_hour)
+            results.append({
+                'start_time': start,
+                'end_time': start + timedelta(hours=1),
+                'free_computers': free,
+                'booked_computers': booked,
+                'session_blocked': blocked,
+                'is_free': free > 0 and not blocked,
+            })
+    return results
+
@@ -0,0 +1,142 @@
+"""
+Overlap enforcement for computer bookings and lab sessions.
+
+By default the overlap rule is checked in Python by ComputerBooking.clean()
+and LabSession.clean() before saving. Setting BOOKING_OVERLAP_ENFORCEMENT to
+'database' switches to enforcing it inside the database:
+
+* On PostgreSQL, GiST exclusion constraints (installed with
+  ``manage.py overlap_constraints``) reject overlapping approved rows, so a
+  write is a single statement and constraint violations are translated back
+  into the usual ValidationError messages.
+* On other backends (SQLite in development) the pre-checks still run, but
+  inside a transaction that first takes a write lock on the lab row so
+  two concurrent writers cannot both pass the check. Bookings and sessions
+  lock the same row, since a session blocks every computer of its lab.
+"""
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+BOOKING_OVERLAP_CONSTRAINT = 'booking_computerbooking_no_overlap'
+BOOKING_SESSION_CONSTRAINT = 'booking_computerbooking_session_block'
+SESSION_OVERLAP_CONSTRAINT = 'booking_labsession_no_overlap'
+
+CONSTRAINT_MESSAGES = {
+    BOOKING_OVERLAP_CONSTRAINT: 'Computer is already booked for this time slot',
+    BOOKING_SESSION_CONSTRAINT: 'Lab is reserved for a session during this time slot',
+    SESSION_OVERLAP_CONSTRAINT: 'Lab is already booked for this time slot',
+}
+
+INSTALL_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+    f"""
+    ALTER TABLE booking_computerbooking
+    ADD CONSTRAINT {BOOKING_OVERLAP_CONSTRAINT}
+    EXCLUDE USING gist (
+        computer_id WITH =,
+        tstzrange(start_time, end_time, '[)') WITH &&
+    ) WHERE (is_approved AND NOT is_cancelled)
+    """,
+    f"""
+    ALTER TABLE booking_labsession
+    ADD CONSTRAINT {SESSION_OVERLAP_CONSTRAINT}
+    EXCLUDE USING gist (
+        lab_id WITH =,
+        tstzrange(start_time, end_time, '[)') WITH &&
+    ) WHERE (is_approved AND NOT is_cancelled)
+    """,
+    # A booking overlapping an approved session spans two tables, which an
+    # exclusion constraint cannot express, so it is checked by a trigger
+    # raising the same SQLSTATE as an exclusion violation.
+    f"""
+    CREATE OR REPLACE FUNCTION {BOOKING_SESSION_CONSTRAINT}() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.is_approved AND NOT NEW.is_cancelled AND EXISTS (
+            SELECT 1
+            FROM booking_labsession s
+            JOIN booking_computer c ON c.lab_id = s.lab_id
+            WHERE c.id = NEW.computer_id
+              AND s.is_approved AND NOT s.is_cancelled
+              AND s.start_time < NEW.end_time
+              AND s.end_time > NEW.start_time
+        ) THEN
+            RAISE EXCEPTION USING
+                ERRCODE = 'exclusion_violation',
+                CONSTRAINT = '{BOOKING_SESSION_CONSTRAINT}',
+                MESSAGE = 'Lab is reserved for a session during this time slot';
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    f"""
+    CREATE TRIGGER {BOOKING_SESSION_CONSTRAINT}
+    BEFORE INSERT OR UPDATE OF computer_id, start_time, end_time, is_approved, is_cancelled
+    ON booking_computerbooking
+    FOR EACH ROW EXECUTE FUNCTION {BOOKING_SESSION_CONSTRAINT}()
+    """,
+]
+
+DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {BOOKING_SESSION_CONSTRAINT} ON booking_computerbooking",
+    f"DROP FUNCTION IF EXISTS {BOOKING_SESSION_CONSTRAINT}()",
+    f"ALTER TABLE booking_labsession DROP CONSTRAINT IF EXISTS {SESSION_OVERLAP_CONSTRAINT}",
+    f"ALTER TABLE booking_computerbooking DROP CONSTRAINT IF EXISTS {BOOKING_OVERLAP_CONSTRAINT}",
+]
+
+
+def database_enforcement_enabled():
+    """True when the overlap rule should be enforced by the database."""
+    return getattr(settings, 'BOOKING_OVERLAP_ENFORCEMENT', 'application') == 'database'
+
+
+def supports_exclusion_constraints():
+    return connection.vendor == 'postgresql'
+
+
+def constraint_violation_message(error):
+    """Return the user-facing message for an overlap IntegrityError, or None."""
+    cause = error.__cause__
+    name = getattr(getattr(cause, 'diag', None), 'constraint_name', None)
+    if name in CONSTRAINT_MESSAGES:
+        return CONSTRAINT_MESSAGES[name]
+    text = str(error)
+    for constraint, message in CONSTRAINT_MESSAGES.items():
+        if constraint in text:
+            return message
+    return None
+
+
+def save_with_overlap_rule(instance, save, lock_queryset):
+    """
+    Validate and save instance according to the configured enforcement mode.
+
+    save is a callable performing the actual write. lock_queryset selects
+    the lab row (of the booked computer or the session) that serialises
+    concurrent writers in the locked fallback.
+    """
+    if not database_enforcement_enabled():
+        instance.clean()
+        save()
+        return
+
+    if supports_exclusion_constraints():
+        instance.clean(check_overlaps=False)
+        try:
+            with transaction.atomic():
+                save()
+        except IntegrityError as e:
+            message = constraint_violation_message(e)
+            if message is None:
+                raise
+            raise ValidationError(message)
+        return
+
+    with transaction.atomic():
+        # A no-op UPDATE takes the row lock on server databases and the
+        # database write lock on SQLite before the overlap queries run.
+        lock_queryset.update(id=F('id'))
+        instance.clean()
+        save()
@@ -0,0 +1,183 @@
+"""
+Read-time expansion of recurring sessions.
+
+With RECURRING_SESSION_EXPANSION set to 'lazy' an approved RecurringSession
+is no longer written out as one LabSession row per occurrence. Calendars,
+availability checks and dashboards expand the series for the window they
+show instead, and approving a series is a single row update.
+
+Expanded occurrences are cached per (series, days covered by the window)
+under a per-series version token. The token is replaced whenever the series
+is saved or deleted (see booking.signals), so editing or cancelling a
+series invalidates all of its cached windows at once.
+
+Rows are only materialized when an occurrence needs state of its own, such
+as attendance: the materialize_recurring_occurrences task writes them for
+the coming days. A materialized row always takes precedence over the
+virtual occurrence starting at the same time.
+"""
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import LabSession, RecurringSession
+from .timeranges import date_range
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+# How far ahead "upcoming" listings expand recurring series
+UPCOMING_WINDOW = timedelta(days=28)
+
+
+def lazy_expansion_enabled():
+    """True when recurring series are expanded at read time."""
+    return getattr(settings, 'RECURRING_SESSION_EXPANSION', 'materialize') == 'lazy'
+
+
+def _version_key(series_id):
+    return f'recurring_session:{series_id}:version'
+
+
+def series_version(series_id):
+    version = cache.get(_version_key(series_id))
+    if version is None:
+        # A random token rather than a counter, so a version evicted from
+        # the cache is never reissued and cannot revive stale windows
+        cache.add(_version_key(series_id), uuid4().hex, None)
+        version = cache.get(_version_key(series_id))
+    return version
+
+
+def invalidate_series(series_id):
+    """Drop every cached window of the series."""
+    cache.set(_version_key(series_id), uuid4().hex, None)
+
+
+def _day_bounds(window_start, window_end):
+    """Local midnights enclosing the window, so nearby windows share a cache entry"""
+    return date_range(timezone.localtime(window_start).date(), timezone.localtime(window_end).date())
+
+
+def expand_series(series, window_start, window_end):
+    """Return the (start, end) occurrences of series overlapping the window."""
+    if series.pk is None:
+        return series.get_occurrences(window_start, window_end)
+
+    day_start, day_end = _day_bounds(window_start, window_end)
+    key = 'recurring_session:{}:{}:{}:{}'.format(
+        series.pk, series_version(series.pk), day_start.date(), day_end.date()
+    )
+    occurrences = cache.get(key)
+    if occurrences is None:
+        occurrences = series.get_occurrences(day_start, day_end)
+        cache.set(key, occurrences, CACHE_TIMEOUT)
+
+    return [
+        (start, end) for start, end in occurrences
+        if start < window_end and end > window_start
+    ]
+
+
+def recurring_occurrences(window_start, window_end, labs=None, lecturer=None, exclude_series=None):
+    """
+    Return unsaved LabSession instances, ordered by start time, for the
+    occurrences of approved recurring series overlapping the window that
+    have not been materialized.
+
+    Costs two queries however many series or occurrences are involved: the
+    series active in the window and their materialized rows in it.
+    """
+    series_list = RecurringSession.objects.filter(
+        is_approved=True,
+        start_date__lte=timezone.localtime(window_end).date(),
+        end_date__gte=timezone.localtime(window_start).date()
+    ).select_related('lab', 'lecturer')
+    if labs is not None:
+        series_list = series_list.filter(lab__in=labs)
+    if lecturer is not None:
+        series_list = series_list.filter(lecturer=lecturer)
+    if exclude_series is not None:
+        series_list = series_list.exclude(pk=exclude_series)
+    series_list = list(series_list)
+    if not series_list:
+        return []
+
+    # Includes cancelled rows, so cancelling one materialized occurrence
+    # also hides it from the expansion
+    materialized = set(LabSession.objects.filter(
+        recurring_session__in=series_list,
+        start_time__lt=window_end,
+        end_time__gt=window_start
+    ).values_list('recurring_session_id', 'start_time'))
+
+    sessions = [
+        LabSession(
+            lab=series.lab,
+            lecturer=series.lecturer,
+            title=series.title,
+            start_time=start_time,
+            end_time=end_time,
+            is_approved=True,
+            recurring_session=series
+        )
+        for series in series_list
+        for start_time, end_time in expand_series(series, window_start, window_end)
+        if (series.id, start_time) not in materialized
+    ]
+    sessions.sort(key=lambda session: session.start_time)
+    return sessions
+
+
+def has_recurring_conflict(lab, start_time, end_time, exclude_series=None):
+    """True if a lazily expanded occurrence in lab overlaps start_time..end_time."""
+    return bool(recurring_occurrences(start_time, end_time, labs=[lab], exclude_series=exclude_series))
+
+
+def materialize_occurrences(window_start, window_end, labs=None):
+    """
+    Write LabSession rows for the unmaterialized occurrences in the window,
+    so attendance can be taken for them. Returns the saved rows of those
+    occurrences, ordered by start time; occurrences another run
+    materialized first are skipped by the unique constraint on the series
+    and start time and returned as that run wrote them.
+
+    Run ahead of time by the materialize_recurring_occurrences task rather
+    than by the pages that list the occurrences.
+    """
+    from .signals import schedule_changed
+
+    with transaction.atomic():
+        occurrences = recurring_occurrences(window_start, window_end, labs=labs)
+        if not occurrences:
+            return []
+        LabSession.objects.bulk_create(occurrences, ignore_conflicts=True)
+        # bulk_create(ignore_conflicts=True) sets no pks, so read the rows back
+        keys = {(session.recurring_session_id, session.start_time) for session in occurrences}
+        sessions = [
+            session for session in LabSession.objects.filter(
+                recurring_session__in={series_id for series_id, _ in keys},
+                start_time__in={start_time for _, start_time in keys}
+            ).select_related('lab', 'lecturer').order_by('start_time', 'id')
+            if (session.recurring_session_id, session.start_time) in keys
+        ]
+        schedule_changed.send(
+            sender=LabSession,
+            changes={(session.lab_id, timezone.localdate(session.start_time)) for session in sessions}
+        )
+    return sessions
+
+
+def with_recurring_occurrences(sessions, window_start, window_end, **filters):
+    """
+    Merge lab sessions with the lazily expanded occurrences in the window.
+
+    Returns sessions unchanged unless lazy expansion is enabled.
+    """
+    if not lazy_expansion_enabled():
+        return sessions
+    occurrences = recurring_occurrences(window_start, window_end, **filters)
+    return sorted(list(sessions) + occurrences, key=lambda session: session.start_time)
@@ -0,0 +1,85 @@
+"""
+Notification retention.
+
+Read notifications older than NOTIFICATION_RETENTION_DAYS are copied to
+gzipped JSON Lines files, one per month of creation, under
+NOTIFICATION_ARCHIVE_DIR and then deleted, so the notification table stays
+at roughly the size of the retention window however old the system gets.
+Unread notifications are never purged: they are still owed to their user.
+
+Rows are archived and deleted in batches of ARCHIVE_BATCH_SIZE, each in its
+own short transaction, walking the primary key so every batch is an index
+range scan. A batch is written to its archive file (appended as a new gzip
+member) before it is deleted, so a run interrupted in between archives some
+rows twice but never loses one; archive readers should drop duplicate ids.
+"""
+import gzip
+import json
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Notification
+
+ARCHIVE_BATCH_SIZE = 1000
+
+ARCHIVED_FIELDS = (
+    'id', 'user_id', 'message', 'notification_type', 'is_read', 'created_at',
+    'booking_id', 'lab_session_id', 'recurring_session_id', 'coalesce_key', 'count',
+)
+
+
+def archive_path(month):
+    """The archive file of notifications created in month (a date)."""
+    return Path(settings.NOTIFICATION_ARCHIVE_DIR) / f'notifications-{month:%Y-%m}.jsonl.gz'
+
+
+def _archive(rows):
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(timezone.localdate(row['created_at']).replace(day=1), []).append(row)
+    for month, month_rows in by_month.items():
+        path = archive_path(month)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'ab') as raw:
+            with gzip.open(raw, 'at', encoding='utf-8') as archive:
+                for row in month_rows:
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+            # On disk before the rows are deleted
+            raw.flush()
+            os.fsync(raw.fileno())
+
+
+def purge_notifications(retention_days=None, batch_size=ARCHIVE_BATCH_SIZE, max_batches=None, now=None, dry_run=False):
+    """
+    Archive and delete the read notifications created more than
+    retention_days (default NOTIFICATION_RETENTION_DAYS) ago, batch_size at
+    a time and at most max_batches batches. With dry_run the rows are only
+    counted, nothing is written or deleted.
+
+    Returns the number of notifications purged (or that would be).
+    """
+    if retention_days is None:
+        retention_days = settings.NOTIFICATION_RETENTION_DAYS
+    cutoff = (now or timezone.now()) - timedelta(days=retention_days)
+    expired = Notification.objects.filter(is_read=True, created_at__lt=cutoff).order_by('id')
+
+    purged = batches = 0
+    last_id = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            rows = list(expired.filter(id__gt=last_id).values(*ARCHIVED_FIELDS)[:batch_size])
+            if not rows:
+                break
+            if not dry_run:
+                _archive(rows)
+                Notification.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        purged += len(rows)
+        batches += 1
+        last_id = rows[-1]['id']
+    return purged
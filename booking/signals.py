@@ -0,0 +1,147 @@
+from django.db import transaction
+from django.db.models import DEFERRED
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .models import Computer, ComputerBooking, LabSession, Notification, RecurringSession, User
+from .lab_status import invalidate_lab_status
+from .notifications import adjust_unread, forget_latest_id, invalidate_admin_map
+from .occupancy import (
+    days_touched, invalidate_occupancy, refresh_computer_rows, refresh_session_rows
+)
+from .recurrence import invalidate_series, lazy_expansion_enabled
+from .streams import publish_count, publish_notifications
+
+# Fields whose changes move a booking or session on the occupancy grid
+BOOKING_OCCUPANCY_FIELDS = ('computer_id', 'start_time', 'end_time', 'is_approved', 'is_cancelled')
+SESSION_OCCUPANCY_FIELDS = ('lab_id', 'start_time', 'end_time', 'is_approved', 'is_cancelled')
+
+# Sent by bulk writes of bookings and lab sessions that bypass the model
+# signals (update(), bulk_create()), with changes: the set of (computer id,
+# local date) pairs of the bookings they changed, or (lab id, local date)
+# pairs of the sessions, dated by the day the rows start
+schedule_changed = Signal()
+
+
+@receiver(post_save, sender=RecurringSession)
+@receiver(post_delete, sender=RecurringSession)
+def invalidate_recurring_session_cache(sender, instance, **kwargs):
+    # Edits and cancellations change the occurrences of every cached window
+    invalidate_series(instance.pk)
+    if lazy_expansion_enabled():
+        lab_id = instance.lab_id
+        transaction.on_commit(lambda: invalidate_occupancy(lab_id))
+
+
+def _occupancy_changes(instance, fields, parent_field, update_fields=None):
+    """
+    Return {parent_id: days} of grid rows a save or delete of instance may
+    have changed, covering both its loaded and its current interval.
+    """
+    if update_fields is not None and not {
+        field.removesuffix('_id') for field in fields
+    } & {field.removesuffix('_id') for field in update_fields}:
+        return {}
+
+    current = {field: getattr(instance, field) for field in fields}
+    loaded = getattr(instance, '_loaded_values', {})
+    previous = {field: loaded.get(field, DEFERRED) for field in fields}
+    instance._loaded_values = {**loaded, **current}
+    if previous == current:
+        return {}
+
+    changes = {current[parent_field]: set(days_touched(current['start_time'], current['end_time']))}
+    if DEFERRED not in (previous[parent_field], previous['start_time'], previous['end_time']):
+        changes.setdefault(previous[parent_field], set()).update(
+            days_touched(previous['start_time'], previous['end_time'])
+        )
+    return changes
+
+
+@receiver(post_save, sender=ComputerBooking)
+def refresh_booking_occupancy(sender, instance, update_fields=None, **kwargs):
+    changes = _occupancy_changes(instance, BOOKING_OCCUPANCY_FIELDS, 'computer_id', update_fields)
+    for computer_id, days in changes.items():
+        transaction.on_commit(lambda computer_id=computer_id, days=days: refresh_computer_rows(computer_id, days))
+
+
+@receiver(post_delete, sender=ComputerBooking)
+def clear_booking_occupancy(sender, instance, **kwargs):
+    computer_id = instance.computer_id
+    days = days_touched(instance.start_time, instance.end_time)
+    transaction.on_commit(lambda: refresh_computer_rows(computer_id, days))
+
+
+@receiver(post_save, sender=LabSession)
+def refresh_session_occupancy(sender, instance, update_fields=None, **kwargs):
+    changes = _occupancy_changes(instance, SESSION_OCCUPANCY_FIELDS, 'lab_id', update_fields)
+    for lab_id, days in changes.items():
+        transaction.on_commit(lambda lab_id=lab_id, days=days: refresh_session_rows(lab_id, days))
+
+
+@receiver(post_delete, sender=LabSession)
+def clear_session_occupancy(sender, instance, **kwargs):
+    lab_id = instance.lab_id
+    days = days_touched(instance.start_time, instance.end_time)
+    transaction.on_commit(lambda: refresh_session_rows(lab_id, days))
+
+
+@receiver(post_save, sender=Computer)
+@receiver(post_delete, sender=Computer)
+def invalidate_lab_status_on_computer_change(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_lab_status)
+
+
+@receiver(post_save, sender=Computer)
+def invalidate_lab_occupancy_on_save(sender, instance, created, **kwargs):
+    # Grids list the lab's computers, so adding one rebuilds them, and
+    # moving one to another lab rebuilds those of both labs
+    loaded = getattr(instance, '_loaded_values', {})
+    previous_lab_id = loaded.get('lab_id', instance.lab_id)
+    instance._loaded_values = {**loaded, 'lab_id': instance.lab_id}
+    if not created and previous_lab_id == instance.lab_id:
+        return
+    for lab_id in {previous_lab_id, instance.lab_id}:
+        transaction.on_commit(lambda lab_id=lab_id: invalidate_occupancy(lab_id))
+
+
+@receiver(post_delete, sender=Computer)
+def invalidate_lab_occupancy_on_delete(sender, instance, **kwargs):
+    lab_id = instance.lab_id
+    transaction.on_commit(lambda: invalidate_occupancy(lab_id))
+
+
+@receiver(m2m_changed, sender=User.managed_labs.through)
+def invalidate_admin_map_on_managed_labs(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_admin_map()
+
+
+@receiver(post_save, sender=User)
+def invalidate_admin_map_on_user_save(sender, instance, update_fields=None, **kwargs):
+    # Logins save last_login alone and cannot change who is an admin or on
+    # a digest
+    if update_fields is None or {'is_admin', 'is_super_admin', 'notification_digest'} & set(update_fields):
+        invalidate_admin_map()
+
+
+@receiver(post_delete, sender=User)
+def invalidate_admin_map_on_user_delete(sender, instance, **kwargs):
+    invalidate_admin_map()
+
+
+@receiver(post_save, sender=Notification)
+def count_created_notification(sender, instance, created, **kwargs):
+    # bulk_notify() counts its own rows; this covers Notification.objects.create()
+    if created and not instance.is_read:
+        adjust_unread([instance.user_id], 1)
+    if created:
+        forget_latest_id([instance.user_id])
+        publish_notifications([instance])
+
+
+@receiver(post_delete, sender=Notification)
+def uncount_deleted_notification(sender, instance, **kwargs):
+    if not instance.is_read:
+        adjust_unread([instance.user_id], -1)
+        publish_count([instance.user_id])
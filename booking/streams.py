@@ -0,0 +1,269 @@
+"""
+Live notification streams.
+
+New notifications and unread count changes are published, once their
+transaction commits, on a per-user channel; notification_stream (an async
+view, served by an ASGI worker) relays them to the browser as server-sent
+events instead of the browser polling unread_notifications_json.
+
+Two channels are available, picked by NOTIFICATION_CHANNEL_URL:
+
+* InMemoryChannel (no URL) delivers within the process only, which is
+  enough for tests and a single-process development server;
+* RedisChannel (a redis:// URL) publishes through Redis pub/sub, so
+  notifications written by the WSGI workers and Celery reach the ASGI
+  workers. Each ASGI worker holds one pattern subscription and fans the
+  messages out to its own streams, rather than one Redis connection per
+  open stream.
+
+Every message carries the recipient's unread count as committed, read
+once by the publisher for all recipients. An open stream therefore only
+reads the database when it connects, on a pool thread whose connection is
+closed right away, and holds no database connection while it waits.
+
+Publishing never fails the caller: a channel error is logged and the
+browser catches up from the database when it reconnects.
+"""
+import asyncio
+import json
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Notification, User
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'notifications:user:'
+
+# Seconds between keep-alive comments on an idle stream, below common proxy
+# read timeouts
+KEEPALIVE_INTERVAL = 20
+
+# Milliseconds the browser waits before reconnecting a dropped stream
+RECONNECT_DELAY = 5000
+
+# Most missed notifications replayed to a reconnecting stream
+CATCH_UP_LIMIT = 100
+
+
+def notification_payload(notification):
+    """The JSON form of a notification shared by the poll and the stream."""
+    return {
+        'id': notification.id,
+        'message': notification.message,
+        'notification_type': notification.notification_type,
+        'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+class InMemoryChannel:
+    """
+    Delivers messages to the streams of the current process, each of which
+    reads from its own asyncio.Queue. publish() may be called from any
+    thread, such as the thread pool running sync views under ASGI.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # The stream's event loop has shut down
+                pass
+
+    def subscribe(self, user_id):
+        """
+        Async context manager entering to a queue of the messages published
+        to user_id from then on.
+        """
+        return _Subscription(self, user_id)
+
+
+class _Subscription:
+    # A class rather than an asynccontextmanager, so leaving it does not
+    # depend on the order in which the event loop finalizes generators
+
+    def __init__(self, channel, user_id):
+        self.channel = channel
+        self.user_id = user_id
+        self.subscriber = None
+
+    async def __aenter__(self):
+        self.subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self.channel._lock:
+            self.channel._subscribers.setdefault(self.user_id, set()).add(self.subscriber)
+        return self.subscriber[1]
+
+    async def __aexit__(self, *exc_info):
+        with self.channel._lock:
+            subscribers = self.channel._subscribers[self.user_id]
+            subscribers.discard(self.subscriber)
+            if not subscribers:
+                del self.channel._subscribers[self.user_id]
+
+
+class RedisChannel(InMemoryChannel):
+    """
+    Publishes through Redis; a listener task per event loop receives every
+    user's messages and hands them to the local subscribers.
+    """
+
+    def __init__(self, url):
+        super().__init__()
+        self.url = url
+        self._publisher = None
+        self._listeners = {}
+
+    def publish(self, user_id, message):
+        import redis
+
+        if self._publisher is None:
+            self._publisher = redis.Redis.from_url(self.url)
+        self._publisher.publish(f'{CHANNEL_PREFIX}{user_id}', json.dumps(message))
+
+    def subscribe(self, user_id):
+        loop = asyncio.get_running_loop()
+        listener = self._listeners.get(loop)
+        if listener is None or listener.done():
+            self._listeners[loop] = loop.create_task(self._listen())
+        return super().subscribe(user_id)
+
+    async def _listen(self):
+        import redis
+        import redis.asyncio
+
+        while True:
+            client = redis.asyncio.Redis.from_url(self.url)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(f'{CHANNEL_PREFIX}*')
+                    async for message in pubsub.listen():
+                        if message['type'] != 'pmessage':
+                            continue
+                        user_id = int(message['channel'].rsplit(b':', 1)[1])
+                        InMemoryChannel.publish(self, user_id, json.loads(message['data']))
+            except (redis.RedisError, OSError):
+                logger.warning('Notification channel listener lost Redis, reconnecting', exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+_channel = None
+
+
+def get_channel():
+    """The process-wide channel configured by NOTIFICATION_CHANNEL_URL."""
+    global _channel
+    if _channel is None:
+        url = getattr(settings, 'NOTIFICATION_CHANNEL_URL', '')
+        _channel = RedisChannel(url) if url else InMemoryChannel()
+    return _channel
+
+
+def _publish(messages):
+    try:
+        counts = dict(User.objects.filter(id__in=list(messages)).values_list('id', 'unread_notifications'))
+    except Exception:
+        logger.exception('Could not read the unread counts of notification streams')
+        return
+    channel = get_channel()
+    for user_id, message in messages.items():
+        message['count'] = counts.get(user_id, 0)
+        try:
+            channel.publish(user_id, message)
+        except Exception:
+            logger.exception('Could not publish notifications of user %s', user_id)
+
+
+def publish_notifications(notifications):
+    """
+    Announce new notifications to their recipients' streams once the
+    transaction commits, one message per recipient.
+    """
+    messages = {}
+    for notification in notifications:
+        message = messages.setdefault(notification.user_id, {'notifications': []})
+        if not notification.is_read:
+            message['notifications'].append(notification_payload(notification))
+    if messages:
+        transaction.on_commit(lambda: _publish(messages))
+
+
+def publish_count(user_ids):
+    """Send the streams of user_ids their unread count once the transaction commits."""
+    messages = {user_id: {'notifications': []} for user_id in user_ids}
+    if messages:
+        transaction.on_commit(lambda: _publish(messages))
+
+
+def _event(event, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines += [f'event: {event}', f'data: {json.dumps(data)}']
+    return '\n'.join(lines) + '\n\n'
+
+
+def _close_connection():
+    # Resolves the connection of the calling thread, unlike passing the
+    # bound method of the event loop's one
+    connection.close()
+
+
+def _connect(user_id, last_event_id):
+    """
+    The unread notifications after last_event_id (if any) and the unread
+    count of a connecting stream. Runs on a pool thread and closes its
+    connection, so the stream holds none while it is open.
+    """
+    try:
+        missed = []
+        if last_event_id is not None:
+            missed = list(Notification.objects.filter(
+                user_id=user_id, is_read=False, id__gt=last_event_id
+            ).order_by('id')[:CATCH_UP_LIMIT])
+        count = User.objects.filter(pk=user_id).values_list('unread_notifications', flat=True).first()
+        return missed, count or 0
+    finally:
+        connection.close()
+
+
+async def notification_events(user_id, last_event_id=None):
+    """
+    The server-sent events of a user's stream: a 'count' event on connect
+    and after every change, a 'notification' event (with the notification
+    id as event id) per new unread notification, and keep-alive comments.
+
+    Subscribes before reading the database, so nothing published between
+    the catch-up and the first message is lost. A reconnecting browser
+    sends the id of the last event it saw and gets the unread notifications
+    it missed.
+    """
+    yield f'retry: {RECONNECT_DELAY}\n\n'
+    # The middleware may have opened a connection on the request's thread;
+    # it would otherwise stay open until the browser disconnects
+    await sync_to_async(_close_connection)()
+    async with get_channel().subscribe(user_id) as queue:
+        missed, count = await sync_to_async(_connect, thread_sensitive=False)(user_id, last_event_id)
+        for notification in missed:
+            yield _event('notification', notification_payload(notification), notification.id)
+        yield _event('count', {'count': count})
+
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            for payload in message['notifications']:
+                yield _event('notification', payload, payload['id'])
+            yield _event('count', {'count': message['count']})
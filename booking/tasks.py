@@ -1,56 +1,130 @@
 from celery import shared_task
+from django.db import transaction
 from django.utils import timezone
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
-from .models import ComputerBooking, LabSession, Notification, User, Announcement
+from .models import ComputerBooking, Lab, LabSession, Notification, User, Announcement
+from .email_utils import drain_outbox
+from .notifications import bulk_notify, send_digests
+from .occupancy import store_grids
+from .recurrence import lazy_expansion_enabled, materialize_occurrences
+from .retention import purge_notifications
+from .timeranges import date_range
 from datetime import timedelta
 
-@shared_task
-def check_ending_bookings():
-    """Check for bookings that are ending soon and send notifications"""
-    now = timezone.now()
-    
-    # Find bookings ending in the next 5-6 minutes that haven't had reminders sent
-    ending_soon = ComputerBooking.objects.filter(
-        end_time__gt=now + timedelta(minutes=5),
-        end_time__lte=now + timedelta(minutes=6),
-        is_approved=True,
-        is_cancelled=False,
-        reminder_sent=False
-    )
+def send_ending_reminders(now=None):
+    """
+    Notify students whose bookings end in 5-6 minutes and mark the reminders
+    sent. Costs a fixed handful of queries however many bookings end: the
+    batch, its extension eligibility (two queries), one notification insert
+    and one UPDATE. Returns the ids of the bookings reminded.
+    """
+    now = now or timezone.now()
     
-    count = 0
-    for booking in ending_soon:
-        # Create notification for user
-        message = (
-            f"Your booking for {booking.computer} ends in 5 minutes. "
-        )
+    with transaction.atomic():
+        # Find bookings ending in the next 5-6 minutes that haven't had reminders sent;
+        # rows locked by an overlapping run are left to it
+        ending_soon = list(ComputerBooking.objects.filter(
+            end_time__gt=now + timedelta(minutes=5),
+            end_time__lte=now + timedelta(minutes=6),
+            is_approved=True,
+            is_cancelled=False,
+            reminder_sent=False
+        ).select_related('computer__lab').select_for_update(skip_locked=True, of=('self',)))
+        if not ending_soon:
+            return []
         
-        # Check if extension is possible
-        if booking.can_be_extended():
-            message += "You can extend your session by 30 minutes."
-            notification_type = 'booking_ending'
-        else:
-            message += "No extension is available at this time."
-            notification_type = 'extension_unavailable'
+        can_extend = ComputerBooking.extension_eligibility(ending_soon)
         
-        Notification.objects.create(
-            user=booking.student,
-            message=message,
-            notification_type=notification_type,
-            booking=booking
-        )
+        notifications = []
+        for booking in ending_soon:
+            # Create notification for user
+            message = (
+                f"Your booking for {booking.computer} ends in 5 minutes. "
+            )
+            
+            # Check if extension is possible
+            if can_extend[booking.id]:
+                message += "You can extend your session by 30 minutes."
+                notification_type = 'booking_ending'
+            else:
+                message += "No extension is available at this time."
+                notification_type = 'extension_unavailable'
+            
+            notifications.append(Notification(
+                user_id=booking.student_id,
+                message=message,
+                notification_type=notification_type,
+                booking=booking
+            ))
+        bulk_notify(notifications)
         
-        # Mark reminder as sent
-        booking.reminder_sent = True
-        booking.save(update_fields=['reminder_sent'])
-        count += 1
+        # Mark reminders as sent
+        booking_ids = [booking.id for booking in ending_soon]
+        ComputerBooking.objects.filter(id__in=booking_ids).update(reminder_sent=True)
     
+    return booking_ids
+
+
+@shared_task
+def check_ending_bookings():
+    """Check for bookings that are ending soon and send notifications"""
+    count = len(send_ending_reminders())
     return f'Processed {count} ending bookings'
 
 
+@shared_task
+def drain_email_outbox():
+    """Send the booking and session emails waiting in the outbox"""
+    sent, failed = drain_outbox()
+    return f'Sent {sent} outbox emails, {failed} failed'
+
+
+@shared_task
+def send_notification_digests():
+    """Send the notification digests that are due"""
+    sent = send_digests()
+    return f'Sent {sent} notification digests'
+
+
+@shared_task
+def materialize_recurring_occurrences():
+    """
+    Write the rows of lazily expanded recurring occurrences from today to
+    RECURRING_MATERIALIZE_DAYS ahead, so attendance can be taken for them
+    """
+    if not lazy_expansion_enabled():
+        return 'Recurring sessions are materialized on approval'
+    today = timezone.localdate()
+    sessions = materialize_occurrences(
+        *date_range(today, today + timedelta(days=settings.RECURRING_MATERIALIZE_DAYS))
+    )
+    return f'Materialized {len(sessions)} recurring occurrences'
+
+
+@shared_task
+def build_occupancy_grids():
+    """
+    Store the occupancy grids of every lab from today to OCCUPANCY_GRID_DAYS
+    ahead that are missing, so week views are answered from them
+    """
+    today = timezone.localdate()
+    stored = sum(
+        store_grids(lab_id, today, settings.OCCUPANCY_GRID_DAYS)
+        for lab_id in Lab.objects.values_list('id', flat=True)
+    )
+    return f'Stored {stored} occupancy grids'
+
+
+@shared_task
+def purge_old_notifications():
+    """Archive and delete read notifications past the retention period"""
+    purged = purge_notifications()
+    return f'Archived and purged {purged} notifications'
+
+
 @shared_task
 def notify_admins_pending_bookings():
     """Send email notifications to admins about pending bookings that need approval"""
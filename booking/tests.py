@@ -1,3 +1,1116 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import itertools
+import json
+import random
+import tempfile
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import retention
+from .allocation import allocate_computer, book_computer
+from .approval import PLAN_OBJECTIVES, approve_bookings, plan_approvals, weighted_interval_schedule
+from .availability import hourly_slots, lab_slot_availability, overlap_flags
+from .email_utils import drain_outbox, send_booking_approval_emails
+from .lab_status import lab_status, lab_status_snapshot
+from .models import (
+    Computer, ComputerBooking, Lab, LabOccupancy, LabSession, Notification, NotificationDigestEntry,
+    OutboxEmail, RecurringSession, User
+)
+from .notifications import adjust_unread, lab_admin_ids, mark_read, notify, send_digests
+from .occupancy import interval_mask, lab_grids, store_grids, week_view
+from .overlap import BOOKING_OVERLAP_CONSTRAINT, BOOKING_SESSION_CONSTRAINT, save_with_overlap_rule
+from .recurrence import materialize_occurrences, recurring_occurrences
+from .retention import archive_path, purge_notifications
+from .signals import _occupancy_changes
+from .streams import InMemoryChannel, notification_events, notification_payload
+from .tasks import build_occupancy_grids, materialize_recurring_occurrences, send_ending_reminders
+from .timeranges import date_range, day_start, touching_dates, within_dates
+
+
+class ApprovalPlanTests(TestCase):
+    """plan_approvals() weighs pending sessions against the bookings they would shut out"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lab = Lab.objects.create(name='Lab 1', location='Block A', capacity=4)
+        cls.computers = Computer.objects.bulk_create([
+            Computer(lab=cls.lab, computer_number=number) for number in range(1, 5)
+        ])
+        cls.student = User.objects.create(username='student', is_student=True)
+        cls.lecturer = User.objects.create(username='lecturer', is_lecturer=True)
+        cls.day = timezone.localdate() + timedelta(days=1)
+        cls.morning = day_start(cls.day) + timedelta(hours=9)
+
+    def at(self, hours):
+        return self.morning + timedelta(hours=hours)
+
+    def sessions(self, *times):
+        # bulk_create: pending requests are only read by the planner
+        return LabSession.objects.bulk_create([
+            LabSession(
+                lab=self.lab, lecturer=self.lecturer, title='Practical',
+                start_time=self.at(start), end_time=self.at(end)
+            )
+            for start, end in times
+        ])
+
+    def bookings(self, *times):
+        return ComputerBooking.objects.bulk_create([
+            ComputerBooking(
+                computer=self.computers[computer], student=self.student,
+                start_time=self.at(start), end_time=self.at(end)
+            )
+            for computer, start, end in times
+        ])
+
+    def test_bookings_outnumber_a_session(self):
+        session, = self.sessions((0, 2))
+        bookings = self.bookings((0, 0, 1), (1, 0.5, 1.5), (2, 1, 2))
+
+        plan = plan_approvals(self.lab, self.day)
+
+        self.assertEqual(plan.sessions, [])
+        self.assertEqual({booking.id for booking in plan.bookings}, {booking.id for booking in bookings})
+        self.assertEqual(plan.rejected, [(session, 'Overlaps a request chosen for the plan')])
+
+    def test_session_outweighs_short_bookings(self):
+        session, = self.sessions((0, 3))
+        booking, = self.bookings((0, 1, 1.5))
+
+        plan = plan_approvals(self.lab, self.day, objective='hours')
+
+        self.assertEqual(plan.sessions, [session])
+        self.assertEqual(plan.bookings, [])
+        self.assertEqual(plan.rejected, [(booking, 'Lab is reserved for a session chosen for the plan')])
+
+    def test_bookings_fill_the_gaps_around_sessions(self):
+        sessions = self.sessions((0, 1), (3, 4))
+        bookings = self.bookings((0, 1, 2), (1, 1.5, 3), (0, 4, 5))
+
+        plan = plan_approvals(self.lab, self.day)
+
+        self.assertEqual(plan.sessions, sessions)
+        self.assertEqual(plan.bookings, bookings)
+        self.assertEqual(plan.rejected, [])
+
+    def test_approved_requests_are_respected(self):
+        LabSession.objects.create(
+            lab=self.lab, lecturer=self.lecturer, title='Approved',
+            start_time=self.at(0), end_time=self.at(1), is_approved=True
+        )
+        session, = self.sessions((0.5, 1.5))
+        booking, = self.bookings((0, 0, 0.5))
+
+        plan = plan_approvals(self.lab, self.day)
+
+        self.assertEqual(plan.sessions + plan.bookings, [])
+        self.assertCountEqual(plan.rejected, [
+            (session, 'Lab is already booked for this time slot'),
+            (booking, 'Lab is reserved for a session during this time slot'),
+        ])
+
+    def test_plan_is_optimal(self):
+        """The planned weight matches a brute force over every choice of sessions"""
+        rng = random.Random(0)
+        self.sessions(*[(start, start + rng.choice((1, 2))) for start in (rng.randrange(8) for _ in range(6))])
+        self.bookings(*[
+            (rng.randrange(4), start, start + rng.choice((0.5, 1, 1.5)))
+            for start in (rng.randrange(18) / 2 for _ in range(30))
+        ])
+        sessions = list(LabSession.objects.filter(lab=self.lab))
+        bookings = list(ComputerBooking.objects.filter(computer__lab=self.lab))
+
+        for objective, weight in PLAN_OBJECTIVES.items():
+            best = 0
+            for size in range(len(sessions) + 1):
+                for chosen in itertools.combinations(sessions, size):
+                    if any(
+                        first.start_time < second.end_time and second.start_time < first.end_time
+                        for first, second in itertools.combinations(chosen, 2)
+                    ):
+                        continue
+                    free = [
+                        booking for booking in bookings
+                        if not any(
+                            booking.start_time < session.end_time and session.start_time < booking.end_time
+                            for session in chosen
+                        )
+                    ]
+                    total = sum(weight(session) for session in chosen) + sum(
+                        weight(booking)
+                        for computer in self.computers
+                        for booking in weighted_interval_schedule(
+                            [booking for booking in free if booking.computer_id == computer.id], weight
+                        )
+                    )
+                    best = max(best, total)
+
+            plan = plan_approvals(self.lab, self.day, objective=objective)
+            with self.subTest(objective=objective):
+                for first, second in itertools.combinations(plan.sessions + plan.bookings, 2):
+                    if isinstance(first, ComputerBooking) and isinstance(second, ComputerBooking) and (
+                        first.computer_id != second.computer_id
+                    ):
+                        continue
+                    self.assertFalse(first.start_time < second.end_time and second.start_time < first.end_time)
+                self.assertEqual(sum(weight(item) for item in plan.sessions + plan.bookings), best)
+                self.assertEqual(len(plan.sessions) + len(plan.bookings) + len(plan.rejected), 36)
+
+
+class ScheduleTestCase(TestCase):
+    """A lab of two computers, a student and a lecturer, tomorrow from 9:00"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lab = Lab.objects.create(name='Lab 1', location='Block A', capacity=2)
+        cls.computer, cls.other = Computer.objects.bulk_create([
+            Computer(lab=cls.lab, computer_number=number) for number in (1, 2)
+        ])
+        cls.student = User.objects.create(username='student', email='student@example.com', is_student=True)
+        cls.lecturer = User.objects.create(username='lecturer', email='lecturer@example.com', is_lecturer=True)
+        cls.day = timezone.localdate() + timedelta(days=1)
+        cls.morning = day_start(cls.day) + timedelta(hours=9)
+
+    def setUp(self):
+        cache.clear()
+
+    def at(self, hours):
+        return self.morning + timedelta(hours=hours)
+
+    def booking(self, start, end, computer=None, **fields):
+        return ComputerBooking.objects.create(
+            computer=computer or self.computer, student=self.student,
+            start_time=self.at(start), end_time=self.at(end), **fields
+        )
+
+    def session(self, start, end, **fields):
+        return LabSession.objects.create(
+            lab=self.lab, lecturer=self.lecturer, title='Practical',
+            start_time=self.at(start), end_time=self.at(end), **fields
+        )
+
+    def series(self, **fields):
+        """An unsaved weekly series of three two-hour occurrences from tomorrow 9:00"""
+        return RecurringSession(**{
+            'lab': self.lab, 'lecturer': self.lecturer, 'title': 'Weekly practical',
+            'start_time': timezone.localtime(self.morning).time(),
+            'end_time': timezone.localtime(self.at(2)).time(),
+            'start_date': self.day, 'end_date': self.day + timedelta(days=20),
+            'recurrence_type': 'weekly', 'is_approved': True,
+            **fields
+        })
+
+
+class AvailabilityTests(ScheduleTestCase):
+    """The in-memory availability engine and its overlap sweep"""
+
+    def test_overlap_flags(self):
+        # [50, 60) is pushed while sweeping [0, 100) but lies after [10, 20)
+        self.assertEqual(overlap_flags([(0, 100), (10, 20)], [(50, 60)]), [True, False])
+        self.assertEqual(overlap_flags([(0, 10), (10, 20)], [(10, 11)]), [False, True])
+
+        rng = random.Random(0)
+        for _ in range(200):
+            intervals = [(start, start + rng.randint(1, 30)) for start in (rng.randrange(100) for _ in range(8))]
+            blockers = [(start, start + rng.randint(1, 30)) for start in (rng.randrange(100) for _ in range(5))]
+            self.assertEqual(overlap_flags(intervals, blockers), [
+                any(blocker_start < end and start < blocker_end for blocker_start, blocker_end in blockers)
+                for start, end in intervals
+            ])
+
+    def test_slot_availability(self):
+        self.booking(0, 1, is_approved=True)
+        self.booking(0.5, 1.5, computer=self.other, is_approved=True)
+        self.booking(3, 4, computer=self.other)  # pending
+        self.booking(4, 5, computer=self.other, is_approved=True, is_cancelled=True)
+        self.session(2, 3, is_approved=True)
+
+        slots = hourly_slots(self.day, self.day, first_hour=9, last_hour=14)
+        availability = lab_slot_availability(self.lab, slots)
+        self.assertEqual([slot['start_time'] for slot in availability], [start for start, _ in slots])
+        self.assertEqual([slot['free_computers'] for slot in availability], [0, 1, 2, 2, 2])
+        self.assertEqual([slot['session_blocked'] for slot in availability], [False, False, True, False, False])
+        self.assertEqual([slot['is_free'] for slot in availability], [False, True, False, True, True])
+
+        availability = lab_slot_availability(self.lab, slots, computer=self.other)
+        self.assertEqual([slot['is_free'] for slot in availability], [False, False, False, True, True])
+
+
+class OverlapRuleTests(ScheduleTestCase):
+    """save_with_overlap_rule() in each enforcement mode"""
+
+    def test_application_mode(self):
+        self.booking(0, 1, is_approved=True)
+        with self.assertRaisesMessage(ValidationError, 'Computer is already booked for this time slot'):
+            self.booking(0.5, 1.5)
+        self.session(2, 3, is_approved=True)
+        with self.assertRaisesMessage(ValidationError, 'Lab is reserved for a session during this time slot'):
+            self.booking(2.5, 3.5, computer=self.other)
+
+        # Touching intervals and other computers do not overlap
+        self.booking(1, 2)
+        self.booking(0, 1, computer=self.other)
+        self.assertEqual(ComputerBooking.objects.count(), 3)
+
+    @override_settings(BOOKING_OVERLAP_ENFORCEMENT='database')
+    def test_locked_fallback(self):
+        self.booking(0, 1, is_approved=True)
+        with CaptureQueriesContext(connection) as queries:
+            booking = self.booking(1, 2)
+        # The lab row is locked before the overlap checks read anything, for
+        # bookings as for sessions
+        statements = [query['sql'] for query in queries if not query['sql'].startswith('SAVEPOINT')]
+        self.assertTrue(statements[0].startswith('UPDATE "booking_lab"'), statements[0])
+
+        with self.assertRaisesMessage(ValidationError, 'Computer is already booked for this time slot'):
+            self.booking(0.5, 1.5)
+        self.assertEqual(ComputerBooking.objects.count(), 2)
+
+        self.session(2, 3, is_approved=True)
+        with self.assertRaisesMessage(ValidationError, 'Lab is already booked for this time slot'):
+            self.session(2.5, 3.5, is_approved=True)
+        booking.end_time = self.at(2.5)
+        with self.assertRaisesMessage(ValidationError, 'Lab is reserved for a session during this time slot'):
+            booking.save()
+
+    def violation(self, constraint):
+        # What Django raises for a violated exclusion constraint or trigger:
+        # the driver's error, carrying the constraint name, is the cause
+        cause = Exception('conflicting key value violates exclusion constraint')
+        cause.diag = SimpleNamespace(constraint_name=constraint)
+        error = IntegrityError(*cause.args)
+        error.__cause__ = cause
+        return error
+
+    @override_settings(BOOKING_OVERLAP_ENFORCEMENT='database')
+    @mock.patch('booking.overlap.supports_exclusion_constraints', return_value=True)
+    def test_constraint_violations(self, supports):
+        self.booking(0, 1, is_approved=True)
+        # The overlap queries are left to the constraints
+        overlapping = ComputerBooking(
+            computer=self.computer, student=self.student, start_time=self.at(0.5), end_time=self.at(1.5)
+        )
+        saves = []
+        save_with_overlap_rule(overlapping, lambda: saves.append(True), None)
+        self.assertEqual(saves, [True])
+
+        for constraint, message in [
+            (BOOKING_OVERLAP_CONSTRAINT, 'Computer is already booked for this time slot'),
+            (BOOKING_SESSION_CONSTRAINT, 'Lab is reserved for a session during this time slot'),
+        ]:
+            with self.subTest(constraint=constraint), self.assertRaisesMessage(ValidationError, message):
+                save_with_overlap_rule(overlapping, mock.Mock(side_effect=self.violation(constraint)), None)
+
+        # Matched on the message when the driver gives no diagnostics
+        with self.assertRaisesMessage(ValidationError, 'Computer is already booked for this time slot'):
+            save_with_overlap_rule(
+                overlapping,
+                mock.Mock(side_effect=IntegrityError(f'violates constraint "{BOOKING_OVERLAP_CONSTRAINT}"')),
+                None
+            )
+        # Other integrity errors are not overlaps
+        with self.assertRaises(IntegrityError):
+            save_with_overlap_rule(overlapping, mock.Mock(side_effect=IntegrityError('NOT NULL')), None)
+        # Neither is an invalid interval, still rejected before the write
+        overlapping.end_time = overlapping.start_time
+        with self.assertRaisesMessage(ValidationError, 'End time must be after start time'):
+            save_with_overlap_rule(overlapping, mock.Mock(), None)
+
+
+class RecurringConflictTests(ScheduleTestCase):
+    """check_session_conflicts() intersects a whole series with two queries"""
+
+    def test_conflicts(self):
+        series = self.series()
+        starts = [start for start, _ in series.get_occurrences()]
+        self.assertEqual([end - start for start, end in series.get_occurrences()], [timedelta(hours=2)] * 3)
+        with self.assertNumQueries(2):
+            self.assertEqual(series.check_session_conflicts(), [])
+
+        # Sessions clash when they overlap an occurrence, touching is fine
+        LabSession.objects.bulk_create([
+            LabSession(
+                lab=self.lab, lecturer=self.lecturer, title='Clash', is_approved=True,
+                start_time=starts[1] + timedelta(hours=1), end_time=starts[1] + timedelta(hours=3)
+            ),
+            LabSession(
+                lab=self.lab, lecturer=self.lecturer, title='After', is_approved=True,
+                start_time=starts[2] + timedelta(hours=2), end_time=starts[2] + timedelta(hours=3)
+            ),
+        ])
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                series.check_session_conflicts(), [timezone.localtime(starts[1]).strftime('%Y-%m-%d %H:%M')]
+            )
+
+        # Another approved series covers every date it spans, whatever its times
+        self.series(
+            start_date=self.day + timedelta(days=14), end_date=self.day + timedelta(days=14), recurrence_type='daily'
+        ).save()
+        self.assertEqual(series.check_session_conflicts(), [
+            timezone.localtime(start).strftime('%Y-%m-%d %H:%M') for start in starts[1:]
+        ])
+        with self.assertRaisesMessage(ValidationError, 'Conflicts exist with existing sessions'):
+            series.save()
+
+
+class RecurringMaterializeTests(ScheduleTestCase):
+    """RecurringSession.materialize() only ever applies the difference"""
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create(username='admin', is_super_admin=True)
+
+    def test_materialize_is_idempotent(self):
+        series = self.series()
+        series.save()
+        starts = [start for start, _ in series.get_occurrences()]
+        self.assertEqual(sorted(series.occurrences.values_list('start_time', flat=True)), starts)
+
+        self.assertEqual(series.materialize(), (0, 0))
+        # A copy loaded before the first materialization adds nothing either
+        self.assertEqual(RecurringSession.objects.get(pk=series.pk).materialize(), (0, 0))
+        self.assertEqual(series.occurrences.count(), 3)
+        self.assertEqual(
+            list(Notification.objects.filter(user=self.admin).values_list('message', flat=True)),
+            [f"Recurring session 'Weekly practical' in Lab 1 by lecturer: 3 lab sessions scheduled"]
+        )
+
+    def test_materialize_applies_changes(self):
+        series = self.series()
+        series.save()
+        series.end_date = self.day + timedelta(days=13)
+        series.title = 'Renamed practical'
+        self.assertEqual(series.materialize(), (0, 1))
+        self.assertEqual(list(series.occurrences.values_list('title', flat=True)), ['Renamed practical'] * 2)
+
+        series.end_date = self.day + timedelta(days=20)
+        self.assertEqual(series.materialize(), (1, 0))
+        self.assertEqual(series.occurrences.count(), 3)
+
+    def test_skipped_rows_are_not_counted(self):
+        bulk_create = LabSession.objects.bulk_create
+
+        def conflicting(sessions, **kwargs):
+            # As ON CONFLICT DO NOTHING does for a row a constraint rejects
+            return bulk_create(sessions[1:], **kwargs)
+
+        series = self.series(is_approved=False)
+        series.save()
+        series.is_approved = True
+        with mock.patch.object(LabSession.objects, 'bulk_create', side_effect=conflicting):
+            series.save()
+        self.assertEqual(series.occurrences.count(), 2)
+        self.assertEqual(
+            Notification.objects.get(user=self.admin).message,
+            "Recurring session 'Weekly practical' in Lab 1 by lecturer: 2 lab sessions scheduled"
+        )
+        self.assertEqual(series.materialize(), (1, 0))
+
+
+@override_settings(RECURRING_SESSION_EXPANSION='lazy')
+class LazyRecurrenceTests(ScheduleTestCase):
+    """Lazily expanded series get rows only when the task materializes them"""
+
+    def setUp(self):
+        super().setUp()
+        self.series_row = self.series()
+        self.series_row.save()
+        self.window = (self.morning - timedelta(days=1), self.morning + timedelta(days=21))
+
+    def test_expansion(self):
+        self.assertFalse(LabSession.objects.exists())
+        occurrences = recurring_occurrences(*self.window)
+        self.assertEqual(
+            [(session.start_time, session.end_time) for session in occurrences], self.series_row.get_occurrences()
+        )
+        self.assertTrue(all(session.pk is None for session in occurrences))
+        # A virtual occurrence blocks the lab like a row would
+        with self.assertRaisesMessage(ValidationError, 'Lab is reserved for a session during this time slot'):
+            self.booking(1, 3)
+
+    def test_materialize_returns_saved_rows(self):
+        first, = materialize_occurrences(self.morning, self.at(1))
+        self.assertEqual((first.start_time, first.recurring_session_id), (self.morning, self.series_row.id))
+        self.assertIsNotNone(first.pk)
+
+        # Only the occurrences still missing rows
+        sessions = materialize_occurrences(*self.window)
+        self.assertEqual([session.pk for session in sessions], list(
+            LabSession.objects.exclude(pk=first.pk).order_by('start_time').values_list('pk', flat=True)
+        ))
+        self.assertEqual(len(sessions), 2)
+        self.assertEqual(materialize_occurrences(*self.window), [])
+        self.assertEqual(recurring_occurrences(*self.window), [])
+
+        # However many runs race, one row per occurrence
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            LabSession.objects.bulk_create([LabSession(
+                lab=self.lab, lecturer=self.lecturer, title='Duplicate', recurring_session=self.series_row,
+                start_time=first.start_time, end_time=first.end_time, is_approved=True
+            )])
+
+    def test_rows_come_from_the_task(self):
+        admin = User.objects.create(username='admin', is_super_admin=True)
+        self.client.defaults['HTTP_HOST'] = 'localhost'
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin_check_in_dashboard'), {'date': self.day.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(LabSession.objects.exists())
+
+        with override_settings(RECURRING_MATERIALIZE_DAYS=8):
+            self.assertEqual(materialize_recurring_occurrences(), 'Materialized 2 recurring occurrences')
+        self.assertEqual(
+            list(LabSession.objects.order_by('start_time').values_list('start_time', flat=True)),
+            [start for start, _ in self.series_row.get_occurrences()[:2]]
+        )
+
+
+class TimeRangeTests(ScheduleTestCase):
+    """Local dates become raw column ranges rather than __date lookups"""
+
+    def test_local_date_boundaries(self):
+        midnight = day_start(self.day)
+        late = self.booking(14.5, 14.75)
+        overnight = ComputerBooking.objects.create(
+            computer=self.other, student=self.student,
+            start_time=midnight - timedelta(minutes=30), end_time=midnight + timedelta(minutes=30)
+        )
+        ComputerBooking.objects.create(
+            computer=self.computer, student=self.student,
+            start_time=midnight + timedelta(days=1), end_time=midnight + timedelta(days=1, hours=1)
+        )
+
+        self.assertEqual(date_range(self.day), (midnight, day_start(self.day + timedelta(days=1))))
+        within = ComputerBooking.objects.filter(**within_dates('start_time', self.day))
+        self.assertEqual(list(within), [late])
+        self.assertEqual(list(within), list(ComputerBooking.objects.filter(start_time__date=self.day)))
+        self.assertNotIn('cast', str(within.query).lower())
+        self.assertCountEqual(
+            ComputerBooking.objects.filter(**touching_dates('start_time', 'end_time', self.day)), [late, overnight]
+        )
+        self.assertEqual(ComputerBooking.objects.filter(**within_dates(
+            'start_time', self.day - timedelta(days=1), self.day + timedelta(days=1)
+        )).count(), 3)
+
+    def test_cancelled_sessions_do_not_block(self):
+        self.session(0, 2, is_approved=True, is_cancelled=True)
+        self.session(1, 3, is_approved=True)
+        with self.assertRaisesMessage(ValidationError, 'Lab is already booked for this time slot'):
+            self.session(2, 4, is_approved=True)
+
+
+class OccupancyRefreshTests(ScheduleTestCase):
+    """Bookings and sessions keep the stored occupancy grids current"""
+
+    def test_occupancy_changes(self):
+        fields = ComputerBooking.VALIDATED_FIELDS
+        booking = self.booking(0, 1)
+        fresh = ComputerBooking.objects.get(pk=booking.pk)
+        self.assertEqual(_occupancy_changes(fresh, fields, 'computer_id'), {})
+        fresh.end_time = self.at(2)
+        self.assertEqual(_occupancy_changes(fresh, fields, 'computer_id', update_fields=['reminder_sent']), {})
+
+        # Moving to the other computer and past midnight changes both rows
+        fresh.computer = self.other
+        fresh.end_time = self.at(16)
+        self.assertEqual(_occupancy_changes(fresh, fields, 'computer_id'), {
+            self.other.id: {self.day, self.day + timedelta(days=1)},
+            self.computer.id: {self.day},
+        })
+        # The handler remembers what it saw, so the next save starts from there
+        self.assertEqual(_occupancy_changes(fresh, fields, 'computer_id'), {})
+
+    def test_reads_do_not_store_grids(self):
+        self.booking(0, 1, is_approved=True)
+        self.session(3, 4, is_approved=True)
+        grid, = lab_grids(self.lab, self.day)
+        self.assertEqual(grid.busy_count(interval_mask(self.at(0), self.at(1), self.day)), 1)
+        swept = week_view(self.lab, self.day, days=2)
+        self.assertFalse(LabOccupancy.objects.exists())
+
+        self.assertEqual(store_grids(self.lab, self.day, 2), 2)
+        self.assertEqual(store_grids(self.lab, self.day, 2), 0)
+        with self.assertNumQueries(1):
+            stored = week_view(self.lab, self.day, days=2)
+        self.assertEqual(stored, swept)
+        self.assertEqual(week_view(self.lab, self.day, days=2, computer=self.other)[1]['free_computers'], 1)
+
+    def test_grids_follow_changes(self):
+        store_grids(self.lab, self.day)
+        morning = interval_mask(self.at(0), self.at(1), self.day)
+        grid, = lab_grids(self.lab, self.day)
+        self.assertEqual((grid.busy_count(morning), grid.sessions), (0, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = self.booking(0, 1, is_approved=True)
+        grid, = lab_grids(self.lab, self.day)
+        self.assertEqual(grid.busy_count(morning), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.computer = self.other
+            booking.start_time = self.at(3)
+            booking.end_time = self.at(4)
+            booking.save()
+            self.session(0, 1, is_approved=True)
+        grid, = lab_grids(self.lab, self.day)
+        self.assertEqual(grid.rows[grid.computer_ids.index(self.computer.id)], 0)
+        self.assertEqual(
+            grid.rows[grid.computer_ids.index(self.other.id)], interval_mask(self.at(3), self.at(4), self.day)
+        )
+        self.assertEqual(grid.sessions, morning)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.delete()
+        grid, = lab_grids(self.lab, self.day)
+        self.assertEqual(grid.busy_count(interval_mask(self.at(0), self.at(12), self.day)), 0)
+        self.assertEqual(LabOccupancy.objects.count(), 1)
+
+    def test_moving_a_computer_drops_both_labs_grids(self):
+        lab = Lab.objects.create(name='Lab 2', location='Block B', capacity=1)
+        with override_settings(OCCUPANCY_GRID_DAYS=2):
+            self.assertEqual(build_occupancy_grids(), 'Stored 4 occupancy grids')
+
+        computer = Computer.objects.get(pk=self.other.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            computer.specs = 'Upgraded'
+            computer.save()
+        self.assertEqual(LabOccupancy.objects.count(), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            computer.lab = lab
+            computer.save()
+        self.assertFalse(LabOccupancy.objects.exists())
+
+
+class AllocationTests(ScheduleTestCase):
+    """allocate_computer() picks the tightest free computer or the nearest free window"""
+
+    def test_best_fit(self):
+        # Pending requests count as taken
+        self.booking(-1, 0)
+        allocation = allocate_computer(self.lab, self.at(0), timedelta(hours=1))
+        self.assertEqual(allocation, {
+            'computer': self.computer, 'start_time': self.at(0), 'end_time': self.at(1), 'exact': True
+        })
+        self.assertEqual(allocate_computer(self.lab, self.at(-1), timedelta(hours=1))['computer'], self.other)
+
+        Computer.objects.filter(pk=self.other.pk).update(status='maintenance')
+        self.assertIsNone(allocate_computer(self.lab, self.at(-1), timedelta(hours=1), search=timedelta(0)))
+
+    def test_nearest_window(self):
+        self.booking(0, 1)
+        self.booking(0, 1.5, computer=self.other)
+        # Later and earlier are an hour away; later wins the tie
+        allocation = allocate_computer(self.lab, self.at(0), timedelta(hours=1))
+        self.assertEqual(allocation, {
+            'computer': self.computer, 'start_time': self.at(1), 'end_time': self.at(2), 'exact': False
+        })
+
+        self.session(3, 4, is_approved=True)
+        allocation = allocate_computer(self.lab, self.at(3), timedelta(hours=1))
+        self.assertEqual((allocation['start_time'], allocation['exact']), (self.at(4), False))
+
+    def test_book_computer(self):
+        self.booking(0, 1)
+        self.booking(0, 1, computer=self.other)
+
+        booking, allocation = book_computer(self.lab, self.student, self.at(0), timedelta(hours=1))
+        self.assertIsNone(booking)
+        self.assertFalse(allocation['exact'])
+
+        booking, allocation = book_computer(
+            self.lab, self.student, self.at(0), timedelta(hours=1), accept_alternative=True
+        )
+        self.assertEqual((booking.start_time, booking.computer), (self.at(1), self.computer))
+        self.assertFalse(booking.is_approved)
+        booking, _ = book_computer(self.lab, self.student, self.at(1), timedelta(hours=1))
+        self.assertEqual(booking.computer, self.other)
+
+
+class ExtensionEligibilityTests(ScheduleTestCase):
+    """Extensions and ending reminders ignore cancelled bookings and sessions"""
+
+    def test_eligibility(self):
+        extendable = self.booking(0, 1, is_approved=True)
+        followed = self.booking(0, 1, computer=self.other, is_approved=True)
+        self.booking(1.25, 2, computer=self.other, is_approved=True)
+        self.booking(1.25, 2, is_approved=True, is_cancelled=True)
+        cancelled = self.session(1, 2, is_approved=True, is_cancelled=True)
+
+        bookings = list(ComputerBooking.objects.filter(pk__in=[extendable.pk, followed.pk]).select_related('computer'))
+        with self.assertNumQueries(2):
+            eligibility = ComputerBooking.extension_eligibility(bookings)
+        self.assertEqual(eligibility, {extendable.id: True, followed.id: False})
+
+        cancelled.is_cancelled = False
+        cancelled.save()
+        self.assertFalse(extendable.can_be_extended())
+
+    def test_ending_reminders(self):
+        booking = self.booking(0, 1, is_approved=True)
+        self.session(1, 2, is_approved=True, is_cancelled=True)
+
+        self.assertEqual(send_ending_reminders(now=self.at(1) - timedelta(minutes=5, seconds=30)), [booking.id])
+        notification = Notification.objects.get()
+        self.assertEqual(notification.notification_type, 'booking_ending')
+        self.assertEqual(send_ending_reminders(now=self.at(1) - timedelta(minutes=5, seconds=30)), [])
+
+
+class NotifyTests(ScheduleTestCase):
+    """notify() writes an event's notifications at once to the lab's admins"""
+
+    def test_lab_admins(self):
+        admin = User.objects.create(username='lab_admin', is_admin=True)
+        admin.managed_labs.add(self.lab)
+        super_admin = User.objects.create(username='super_admin', is_super_admin=True)
+
+        self.assertCountEqual(lab_admin_ids(self.lab.id), [admin.id, super_admin.id])
+        with self.assertNumQueries(0):
+            self.assertEqual(lab_admin_ids(0), [super_admin.id])
+
+        other_lab = Lab.objects.create(name='Lab 2', location='Block B', capacity=1)
+        admin.managed_labs.add(other_lab)
+        self.assertCountEqual(lab_admin_ids(other_lab.id), [admin.id, super_admin.id])
+        # Logins do not drop the map
+        admin.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            lab_admin_ids(self.lab.id)
+        admin.is_admin = False
+        admin.save()
+        self.assertEqual(lab_admin_ids(self.lab.id), [super_admin.id])
+
+    def test_fan_out(self):
+        booking = self.booking(0, 1)
+        with CaptureQueriesContext(connection) as queries:
+            created = notify(
+                [self.student, self.lecturer.id, self.student.id], 'Booked', 'new_booking', booking=booking
+            )
+        self.assertEqual([notification.user_id for notification in created], [self.student.id, self.lecturer.id])
+        self.assertEqual(sum(query['sql'].startswith('INSERT') for query in queries), 1)
+        self.assertEqual(Notification.objects.filter(booking=booking).count(), 2)
+        self.assertEqual(User.objects.get(pk=self.student.pk).unread_notifications, 1)
+
+        # Deferred notifications follow the transaction
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.assertEqual(notify([self.student], 'Later', 'new_booking', on_commit=True), [])
+        self.assertFalse(Notification.objects.filter(message='Later').exists())
+        callbacks[0]()
+        self.assertTrue(Notification.objects.filter(message='Later').exists())
+
+
+class BookingSaveTests(ScheduleTestCase):
+    """ComputerBooking.save() compares against the values it loaded"""
+
+    def test_unchanged_overlap_fields_skip_validation(self):
+        booking = ComputerBooking.objects.get(pk=self.booking(0, 1).pk)
+        booking.reminder_sent = True
+        with CaptureQueriesContext(connection) as queries:
+            booking.save(update_fields=['reminder_sent'])
+        self.assertEqual([query['sql'].split()[0] for query in queries], ['UPDATE'])
+
+        with CaptureQueriesContext(connection) as queries:
+            booking.save()
+        self.assertFalse(any('"booking_lab"' in query['sql'] for query in queries))
+
+        self.booking(1.5, 2.5, is_approved=True)
+        booking.end_time = self.at(2)
+        with self.assertRaisesMessage(ValidationError, 'Computer is already booked for this time slot'):
+            booking.save(update_fields=['end_time'])
+
+    def test_transition_timestamps(self):
+        booking = ComputerBooking.objects.get(pk=self.booking(0, 1).pk)
+        booking.is_approved = True
+        booking.save()
+        approved_at = booking.approved_at
+        self.assertIsNotNone(approved_at)
+        booking.save()
+        self.assertEqual(booking.approved_at, approved_at)
+
+        booking.is_cancelled = True
+        booking.save(update_fields=['is_cancelled'])
+        stored = ComputerBooking.objects.get(pk=booking.pk)
+        self.assertEqual((stored.cancelled_at, stored.approved_at), (booking.cancelled_at, approved_at))
+        self.assertIsNotNone(stored.cancelled_at)
+
+        # Fields left out of the loaded values are read once
+        deferred = ComputerBooking.objects.only('id', 'computer_id').get(pk=booking.pk)
+        deferred.extension_requested = True
+        with CaptureQueriesContext(connection) as queries:
+            deferred.save(update_fields=['extension_requested'])
+        self.assertEqual([query['sql'].split()[0] for query in queries], ['SELECT', 'UPDATE'])
+        self.assertIsNotNone(ComputerBooking.objects.get(pk=booking.pk).extension_requested_at)
+
+
+class ApproveBookingsTests(ScheduleTestCase):
+    """approve_bookings() approves what it can and leaves conflicts pending"""
+
+    @mock.patch('booking.email_utils._kick_outbox')
+    def test_conflicts_are_skipped(self, kick):
+        first = self.booking(2, 3)
+        overlapping = self.booking(2.5, 3.5)
+        taken = self.booking(0.5, 1.5)
+        blocked = self.booking(4, 5, computer=self.other)
+        elsewhere = self.booking(2.5, 3.5, computer=self.other)
+        # Approved after the requests were made
+        approved_before = self.booking(0, 1, is_approved=True)
+        self.session(4, 5, is_approved=True)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            approved, skipped = approve_bookings(ComputerBooking.objects.all())
+
+        self.assertEqual({booking.id for booking in approved}, {first.id, elsewhere.id})
+        self.assertEqual({booking.id: reason for booking, reason in skipped}, {
+            overlapping.id: 'Overlaps an earlier request approved in this batch',
+            taken.id: 'Computer is already booked for this time slot',
+            blocked.id: 'Lab is reserved for a session during this time slot',
+        })
+        self.assertCountEqual(
+            ComputerBooking.objects.filter(is_approved=True).values_list('id', flat=True),
+            [approved_before.id, first.id, elsewhere.id]
+        )
+        self.assertCountEqual(
+            OutboxEmail.objects.values_list('idempotency_key', flat=True),
+            [f'booking:{first.id}:approval', f'booking:{elsewhere.id}:approval']
+        )
+        self.assertEqual(Notification.objects.filter(notification_type='booking_approved').count(), 2)
+
+        # Nothing left to approve the second time
+        self.assertEqual(approve_bookings(ComputerBooking.objects.filter(id=first.id)), ([], []))
+
+
+
+@mock.patch('booking.email_utils._kick_outbox')
+class OutboxTests(ScheduleTestCase):
+    """Queued emails are sent once, and failed sends retried up to a limit"""
+
+    def queue(self):
+        booking = self.booking(0, 1, is_approved=True)
+        send_booking_approval_emails([booking])
+        return booking
+
+    def test_idempotency_key(self, kick):
+        booking = self.queue()
+        # A copy loaded before the flag was set queues nothing new
+        stale = ComputerBooking.objects.get(pk=booking.pk)
+        stale.approval_email_sent = False
+        send_booking_approval_emails([stale])
+        self.assertEqual(OutboxEmail.objects.get().idempotency_key, f'booking:{booking.id}:approval')
+
+        self.assertEqual(drain_outbox(), (1, 0))
+        self.assertEqual(drain_outbox(), (0, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['student@example.com'])
+
+    def test_failed_sends_are_retried(self, kick):
+        self.queue()
+        with mock.patch('booking.email_utils.EmailMultiAlternatives.send', side_effect=OSError('SMTP down')), \
+                self.assertLogs('booking.email_utils', 'ERROR'):
+            self.assertEqual(drain_outbox(max_attempts=2), (0, 1))
+        outbox_email = OutboxEmail.objects.get()
+        self.assertEqual((outbox_email.attempts, outbox_email.last_error, outbox_email.sent_at), (1, 'SMTP down', None))
+
+        self.assertEqual(drain_outbox(max_attempts=2), (1, 0))
+        outbox_email.refresh_from_db()
+        self.assertEqual((outbox_email.attempts, outbox_email.last_error), (2, ''))
+        self.assertIsNotNone(outbox_email.sent_at)
+
+    def test_attempts_are_limited(self, kick):
+        self.queue()
+        with mock.patch('booking.email_utils.EmailMultiAlternatives.send', side_effect=OSError('SMTP down')), \
+                self.assertLogs('booking.email_utils', 'ERROR'):
+            self.assertEqual(drain_outbox(max_attempts=2), (0, 1))
+            self.assertEqual(drain_outbox(max_attempts=2), (0, 1))
+        self.assertEqual(drain_outbox(max_attempts=2), (0, 0))
+        self.assertEqual(mail.outbox, [])
+
+
+    def test_empty_outbox_opens_no_connection(self, kick):
+        with mock.patch('booking.email_utils.get_connection') as get_connection:
+            self.assertEqual(drain_outbox(), (0, 0))
+        get_connection.assert_not_called()
+
+    def test_batches_are_claimed_before_sending(self, kick):
+        self.queue()
+        claims = []
+
+        def send(email, fail_silently):
+            claims.append(OutboxEmail.objects.values_list('attempts', 'claimed_until').get())
+            return 1
+
+        with mock.patch('booking.email_utils.EmailMultiAlternatives.send', send):
+            self.assertEqual(drain_outbox(), (1, 0))
+        (attempts, claimed_until), = claims
+        self.assertEqual(attempts, 1)
+        self.assertGreater(claimed_until, timezone.now())
+        self.assertIsNone(OutboxEmail.objects.get().claimed_until)
+
+    def test_leased_rows_are_skipped(self, kick):
+        self.queue()
+        OutboxEmail.objects.update(claimed_until=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(drain_outbox(), (0, 0))
+
+        # The drain holding the lease died; the row is retried once it runs out
+        OutboxEmail.objects.update(attempts=1, claimed_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(drain_outbox(), (1, 0))
+        self.assertEqual(OutboxEmail.objects.get().attempts, 2)
+
+
+class UnreadNotificationTests(ScheduleTestCase):
+    """The unread counter, the polled unread list and its ETag"""
+
+    def unread(self):
+        return User.objects.get(pk=self.student.pk).unread_notifications
+
+    def notify(self, count=1):
+        return [
+            notify([self.student], f'Message {number}', 'booking_approved')[0]
+            for number in range(count)
+        ]
+
+    def test_counter(self):
+        first, second, third = self.notify(3)
+        self.assertEqual(self.unread(), 3)
+
+        student = User.objects.get(pk=self.student.pk)
+        self.assertEqual(mark_read(student, [first.id]), 1)
+        self.assertEqual(mark_read(student, [first.id]), 0)
+        self.assertEqual((student.unread_notifications, self.unread()), (2, 2))
+        self.assertEqual(mark_read(student), 2)
+        self.assertEqual(self.unread(), 0)
+
+        # Never below zero
+        adjust_unread([self.student.pk], -5)
+        self.assertEqual(self.unread(), 0)
+        Notification.objects.create(user=self.student, message='One', notification_type='booking_approved')
+        self.assertEqual(self.unread(), 1)
+
+
+    def get(self, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get('/notifications/unread/json/', params, **headers)
+
+    def test_unread_json(self):
+        # HostValidationMiddleware rejects requests without a Host header
+        self.client.defaults['HTTP_HOST'] = 'localhost'
+        self.client.force_login(self.student)
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = [notification.id for notification in self.notify(5)]
+
+        data = self.get(limit=2).json()
+        self.assertEqual([item['id'] for item in data['notifications']], ids[:2:-1])
+        self.assertEqual((data['count'], data['cursor'], data['has_more']), (5, ids[-1], False))
+
+        data = self.get(since=ids[0], limit=2).json()
+        self.assertEqual([item['id'] for item in data['notifications']], ids[1:3])
+        self.assertEqual((data['cursor'], data['has_more']), (ids[2], True))
+        data = self.get(since=data['cursor'], limit=2).json()
+        self.assertEqual([item['id'] for item in data['notifications']], ids[3:])
+        self.assertFalse(data['has_more'])
+        self.assertEqual(self.get(since='x').status_code, 400)
+
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_read(self.student, ids[:1])
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.notify()
+        self.assertEqual(self.get(etag).status_code, 200)
+
+
+
+
+class NotificationStreamTests(ScheduleTestCase):
+    """Notification streams get one message per recipient after commit"""
+
+    def test_published_on_commit(self):
+        channel = mock.Mock()
+        with mock.patch('booking.streams.get_channel', return_value=channel):
+            with self.captureOnCommitCallbacks() as callbacks:
+                first, _ = notify([self.student, self.lecturer], 'Approved', 'booking_approved')
+            channel.publish.assert_not_called()
+            # One query for the counts of every recipient
+            with self.assertNumQueries(1):
+                for callback in callbacks:
+                    callback()
+            self.assertEqual(channel.publish.call_args_list, [
+                mock.call(self.student.id, {'notifications': [notification_payload(first)], 'count': 1}),
+                mock.call(self.lecturer.id, {'notifications': [mock.ANY], 'count': 1}),
+            ])
+
+            channel.publish.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                mark_read(User.objects.get(pk=self.student.pk))
+            channel.publish.assert_called_once_with(self.student.id, {'notifications': [], 'count': 0})
+
+    def test_events(self):
+        notification = Notification(
+            id=7, message='Approved', notification_type='booking_approved', created_at=self.morning
+        )
+        channel = InMemoryChannel()
+
+        async def read():
+            events = notification_events(self.student.id, last_event_id=6)
+            received = [await anext(events) for _ in range(3)]
+            channel.publish(self.student.id, {'notifications': [], 'count': 0})
+            received += [await anext(events), await anext(events)]
+            await events.aclose()
+            return received
+
+        with mock.patch('booking.streams.get_channel', return_value=channel), \
+                mock.patch('booking.streams._connect', return_value=([notification], 1)) as connect, \
+                mock.patch('booking.streams._close_connection'), \
+                mock.patch('booking.streams.KEEPALIVE_INTERVAL', 0.01):
+            received = asyncio.run(read())
+
+        connect.assert_called_once_with(self.student.id, 6)
+        self.assertEqual(received, [
+            'retry: 5000\n\n',
+            f'id: 7\nevent: notification\ndata: {json.dumps(notification_payload(notification))}\n\n',
+            'event: count\ndata: {"count": 1}\n\n',
+            'event: count\ndata: {"count": 0}\n\n',
+            ': keep-alive\n\n',
+        ])
+        self.assertEqual(channel._subscribers, {})
+
+
+class PurgeNotificationsTests(ScheduleTestCase):
+    """Old read notifications are archived before they are deleted"""
+
+    def setUp(self):
+        super().setUp()
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        archive_settings = override_settings(NOTIFICATION_ARCHIVE_DIR=archive_dir.name)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        self.now = timezone.now()
+        self.old = Notification.objects.bulk_create([
+            Notification(user=self.student, message=f'Old {number}', notification_type='booking_approved', is_read=True)
+            for number in range(3)
+        ])
+        self.unread_old, self.recent = Notification.objects.bulk_create([
+            Notification(user=self.student, message='Unread', notification_type='booking_approved'),
+            Notification(user=self.student, message='Recent', notification_type='booking_approved', is_read=True),
+        ])
+        Notification.objects.exclude(id=self.recent.id).update(created_at=self.now - timedelta(days=100))
+
+    def archived(self):
+        path = archive_path(timezone.localdate(self.now - timedelta(days=100)).replace(day=1))
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            return [json.loads(line) for line in archive]
+
+    def test_archive_then_delete(self):
+        self.assertEqual(purge_notifications(retention_days=90, dry_run=True, now=self.now), 3)
+        self.assertEqual(Notification.objects.count(), 5)
+
+        self.assertEqual(purge_notifications(retention_days=90, batch_size=2, max_batches=1, now=self.now), 2)
+        self.assertEqual(purge_notifications(retention_days=90, batch_size=2, now=self.now), 1)
+        archived = self.archived()
+        self.assertEqual([row['id'] for row in archived], [notification.id for notification in self.old])
+        self.assertEqual(archived[0]['message'], 'Old 0')
+        self.assertCountEqual(
+            Notification.objects.values_list('id', flat=True), [self.unread_old.id, self.recent.id]
+        )
+
+    def test_failed_archive_deletes_nothing(self):
+        with mock.patch.object(retention, '_archive', side_effect=OSError('Disk full')):
+            with self.assertRaises(OSError):
+                purge_notifications(retention_days=90, now=self.now)
+        self.assertEqual(Notification.objects.count(), 5)
+
+
+class CoalesceDigestTests(ScheduleTestCase):
+    """Repeated events fold into one notification, or wait for a digest"""
+
+    def event(self, recipients, number):
+        return notify(
+            recipients, f'Booking {number}', 'new_booking', coalesce_key='new_booking:lab:1',
+            summary='{count} new bookings in Lab 1', booking=self.booking(number, number + 0.5)
+        )
+
+    def test_repeats_are_folded(self):
+        admin = User.objects.create(username='admin', is_admin=True)
+        for number in range(3):
+            self.event([admin], number)
+
+        notification = Notification.objects.get(user=admin)
+        self.assertEqual((notification.count, notification.message), (3, '3 new bookings in Lab 1'))
+        self.assertIsNone(notification.booking)
+        self.assertEqual(User.objects.get(pk=admin.pk).unread_notifications, 1)
+
+        # A read notification absorbs nothing
+        mark_read(admin)
+        self.event([admin], 3)
+        self.assertEqual(Notification.objects.get(user=admin, is_read=False).message, 'Booking 3')
+
+    def test_digests(self):
+        hourly = User.objects.create(username='hourly', notification_digest='hourly')
+        daily = User.objects.create(username='daily', notification_digest='daily')
+        for number in range(2):
+            self.event([hourly, daily], number)
+        self.assertFalse(Notification.objects.filter(user__in=[hourly, daily]).exists())
+        self.assertEqual(NotificationDigestEntry.objects.get(user=hourly).count, 2)
+
+        now = timezone.now()
+        with override_settings(NOTIFICATION_DIGEST_HOUR=(timezone.localtime(now).hour + 1) % 24):
+            self.assertEqual(send_digests(now), 1)
+        self.assertEqual(Notification.objects.get(user=hourly).message, '2 new bookings in Lab 1')
+        self.assertFalse(NotificationDigestEntry.objects.filter(user=hourly).exists())
+
+        with override_settings(NOTIFICATION_DIGEST_HOUR=timezone.localtime(now).hour):
+            self.assertEqual(send_digests(now), 1)
+        digest = Notification.objects.get(user=daily)
+        self.assertEqual((digest.notification_type, digest.message), ('digest', '2 new bookings in Lab 1'))
+        self.assertFalse(NotificationDigestEntry.objects.exists())
+
+    def test_folded_rows_are_archived_with_their_count(self):
+        admin = User.objects.create(username='admin', is_admin=True)
+        for number in range(2):
+            self.event([admin], number)
+        mark_read(admin)
+        created_at = timezone.now() - timedelta(days=100)
+        Notification.objects.update(created_at=created_at)
+
+        with tempfile.TemporaryDirectory() as archive_dir, override_settings(NOTIFICATION_ARCHIVE_DIR=archive_dir):
+            self.assertEqual(purge_notifications(retention_days=90), 1)
+            with gzip.open(archive_path(timezone.localdate(created_at).replace(day=1)), 'rt') as archive:
+                row, = [json.loads(line) for line in archive]
+        self.assertEqual((row['coalesce_key'], row['count']), ('new_booking:lab:1', 2))
+
+
+class LabStatusTests(ScheduleTestCase):
+    """Computer counts by status come from one cached grouped query"""
+
+    def test_snapshot(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(lab_status(self.lab.id), {'available': 2, 'maintenance': 0, 'reserved': 0, 'total': 2})
+            self.assertEqual(lab_status_snapshot()['totals']['total'], 2)
+        self.assertEqual(lab_status(0)['total'], 0)
+
+        computer = Computer.objects.get(pk=self.other.pk)
+        computer.status = 'maintenance'
+        with self.captureOnCommitCallbacks(execute=True):
+            computer.save()
+        self.assertEqual(lab_status(self.lab.id), {'available': 1, 'maintenance': 1, 'reserved': 0, 'total': 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            computer.delete()
+        self.assertEqual(lab_status_snapshot()['totals'], {
+            'available': 1, 'maintenance': 0, 'reserved': 0, 'total': 1
+        })
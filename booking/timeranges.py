@@ -0,0 +1,45 @@
+"""
+Timezone-aware ranges for local dates.
+
+Filtering on ``start_time__date`` wraps the column in a date conversion, so
+the database cannot use an index on it. These helpers turn local dates into
+half-open [start, end) ranges of aware datetimes, letting lookups compare the
+raw column instead.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+
+def day_start(day):
+    """Aware local midnight at the start of day."""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def date_range(start_date, end_date=None):
+    """
+    Return (start, end) covering the local dates start_date to end_date
+    inclusive; end is the midnight after end_date and is excluded.
+    """
+    if end_date is None:
+        end_date = start_date
+    return day_start(start_date), day_start(end_date + timedelta(days=1))
+
+
+def within_dates(field, start_date, end_date=None):
+    """
+    Lookups for rows whose field falls on the local dates start_date to
+    end_date, the index-friendly equivalent of field__date__range.
+    """
+    start, end = date_range(start_date, end_date)
+    return {f'{field}__gte': start, f'{field}__lt': end}
+
+
+def touching_dates(start_field, end_field, start_date, end_date=None):
+    """
+    Lookups for rows whose start_field..end_field interval touches the local
+    dates start_date to end_date, the index-friendly equivalent of
+    start_field__date__lte=end_date, end_field__date__gte=start_date.
+    """
+    start, end = date_range(start_date, end_date)
+    return {f'{start_field}__lt': end, f'{end_field}__gte': start}
@@ -18,6 +18,7 @@ urlpatterns = [
     path('Dashboard/sessions/<int:session_id>/approve/', views.approve_session_view, name='approve_session'),
     path('notifications/', views.notification_list_view, name='notification_list'),
     path('notifications/unread/json/', views.unread_notifications_json, name='unread_notifications_json'),
+    path('notifications/stream/', views.notification_stream, name='notification_stream'),
     path('recurring-booking/', views.recurring_booking_view, name='recurring_booking'),
     path('free-timeslots/', views.free_timeslots_view, name='free_timeslots'),   
     path('labs/<int:lab_id>/free-timeslots/', views.free_timeslots_view, name='lab_free_timeslots'),
@@ -31,6 +32,7 @@ urlpatterns = [
     path('bulk-approve-bookings/', views.bulk_approve_bookings_view, name='bulk_approve_bookings'),
     path('bulk-approve-sessions/', views.bulk_approve_sessions_view, name='bulk_approve_sessions'),
     path('bulk-approve-recurring-sessions/', views.bulk_approve_recurring_sessions_view, name='bulk_approve_recurring_sessions'),
+    path('Dashboard/approval-planner/', views.approval_planner_view, name='approval_planner'),
     path('bulk-cancel-bookings/', views.bulk_cancel_bookings_view, name='bulk_cancel_bookings'),
     path('bulk-cancel-sessions/', views.bulk_cancel_sessions_view, name='bulk_cancel_sessions'),
     path('bulk-cancel-recurring-sessions/', views.bulk_cancel_recurring_sessions_view, name='bulk_cancel_recurring_sessions'),
@@ -68,4 +70,5 @@ urlpatterns = [
     path('subscribe/', subscribe_newsletter, name='subscribe_newsletter'),
     path('assign-student/', views.assign_student_view, name='assign_student'),
     path('api/labs/<int:lab_id>/computers/', views.lab_computers_api, name='lab_computers_api'),
+    path('api/labs/<int:lab_id>/allocate/', views.allocate_computer_api, name='allocate_computer_api'),
 ]
\ No newline at end of file
@@ -1,11 +1,14 @@
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse as DjangoJsonResponse
-from django.views.decorators.http import require_GET, require_POST
+from django.http import HttpResponse, JsonResponse as DjangoJsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_GET, require_POST, require_http_methods
 from django.views.generic import TemplateView
 from django.contrib import messages
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.urls import reverse
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.forms import PasswordChangeForm
 from datetime import datetime, timedelta
@@ -18,13 +21,25 @@ from .models import (
 )
 from .forms import (
     ComputerBookingForm, LabSessionForm, RecurringSessionForm, 
-    StudentRatingForm, UserProfileForm, AttendanceForm, BulkAttendanceForm
+    StudentRatingForm, UserProfileForm, AttendanceForm, BulkAttendanceForm,
+    ApprovalPlanForm
 )
 from .email_utils import (
     send_booking_approval_email, send_booking_rejection_email,
     send_session_approval_email, send_session_rejection_email,
     send_booking_cancellation_email, send_session_cancellation_email
 )
+from .approval import apply_plan, approve_bookings, plan_approvals
+from .lab_status import lab_status, lab_status_snapshot
+from .occupancy import week_view
+from .notifications import (
+    NOTIFICATION_LIST_PAGE_SIZE, NOTIFICATION_MAX_PAGE_SIZE, NOTIFICATION_PAGE_SIZE,
+    latest_notification_id, mark_read, notification_state,
+    notify, notify_lab_admins
+)
+from .streams import notification_events, notification_payload
+from .timeranges import touching_dates, within_dates
+from .recurrence import UPCOMING_WINDOW, with_recurring_occurrences
  
 class LandingPageView(TemplateView):
     template_name = 'landing.html'
@@ -99,8 +114,6 @@ def home_view(request):
     upcoming_bookings = None
     upcoming_sessions = None
     recurring_sessions = None
-    notifications = Notification.objects.filter(user=request.user, is_read=False)
-    
     if request.user.is_student:
         upcoming_bookings = ComputerBooking.objects.filter(
             student=request.user,
@@ -113,25 +126,29 @@ def home_view(request):
             lecturer=request.user,
             end_time__gte=timezone.now()
         ).order_by('start_time')
+        upcoming_sessions = with_recurring_occurrences(
+            upcoming_sessions, timezone.now(), timezone.now() + UPCOMING_WINDOW,
+            lecturer=request.user
+        )
         
         recurring_sessions = RecurringSession.objects.filter(
             lecturer=request.user,
             is_approved=True,
-            end_date__gte=timezone.now().date()
+            end_date__gte=timezone.localdate()
         ).order_by('start_date')
     
     labs = Lab.objects.all()
     
     # Add available_computers count for each lab
+    lab_counts = lab_status_snapshot()['labs']
     for lab in labs:
-        lab.available_computers = lab.computers.filter(status='available').count()
+        lab.available_computers = lab_counts.get(lab.id, {}).get('available', 0)
     
     return render(request, 'home.html', {
         'labs': labs,
         'upcoming_bookings': upcoming_bookings,
         'upcoming_sessions': upcoming_sessions,
         'recurring_sessions': recurring_sessions,
-        'notifications': notifications
     })
 
 @login_required
@@ -150,19 +167,20 @@ def lab_detail_view(request, lab_id):
         end_time__gte=timezone.now(),
         is_approved=True
     ).order_by('start_time')
+    upcoming_sessions = with_recurring_occurrences(
+        upcoming_sessions, timezone.now(), timezone.now() + UPCOMING_WINDOW, labs=[lab]
+    )
     
     # Get computer counts by status
-    available_computers = computers.filter(status='available').count()
-    reserved_computers = computers.filter(status='reserved').count()
-    maintenance_computers = computers.filter(status='maintenance').count()
+    counts = lab_status(lab.id)
     
     return render(request, 'lab_detail.html', {
         'lab': lab,
         'computers': computers,
         'upcoming_sessions': upcoming_sessions,
-        'available_computers': available_computers,
-        'reserved_computers': reserved_computers,
-        'maintenance_computers': maintenance_computers,
+        'available_computers': counts['available'],
+        'reserved_computers': counts['reserved'],
+        'maintenance_computers': counts['maintenance'],
     })
 
 @login_required
@@ -181,18 +199,9 @@ def student_booking_view(request, lab_id, computer_id=None):
         if form.is_valid():
             booking = form.save(commit=False)
             booking.student = request.user
+            # ComputerBooking.save notifies the lab's admins
             booking.save()
             
-            # Updated notification with proper reference to booking
-            admin_users = User.objects.filter(is_admin=True)
-            for admin in admin_users:
-                Notification.objects.create(
-                    user=admin,
-                    message=f"New computer booking: {booking.computer} by {request.user.username}",
-                    notification_type='new_booking',
-                    booking=booking  # Add direct reference to booking
-                )
-            
             return redirect('booking_success', booking_id=booking.id)
     else:
         initial_data = {}
@@ -220,18 +229,9 @@ def lecturer_booking_view(request):
             session.lecturer = request.user
             
             try:
+                # LabSession.save notifies the lab's admins
                 session.save()
                 
-                # Updated notification with proper reference to lab session
-                admin_users = User.objects.filter(is_admin=True)
-                for admin in admin_users:
-                    Notification.objects.create(
-                        user=admin,
-                        message=f"New lab session request: {session.lab.name} by {request.user.username}",
-                        notification_type='session_booked',
-                        lab_session=session  # Add direct reference to session
-                    )
-                
                 messages.success(request, "Lab session request submitted for approval")
                 return redirect('home')
             except ValidationError as e:
@@ -370,11 +370,12 @@ def admin_dashboard_view(request):
             messages.error(request, "Invalid date format. Please use YYYY-MM-DD.")
     
     # Get basic stats
+    computer_counts = lab_status_snapshot()['totals']
     stats = {
         'total_labs': Lab.objects.count(),
-        'total_computers': Computer.objects.count(),
-        'available_computers': Computer.objects.filter(status='available').count(),
-        'maintenance_computers': Computer.objects.filter(status='maintenance').count(),
+        'total_computers': computer_counts['total'],
+        'available_computers': computer_counts['available'],
+        'maintenance_computers': computer_counts['maintenance'],
         'pending_bookings_count': pending_computer_bookings.count(),
         'pending_sessions_count': pending_lab_sessions.count(),
         'pending_recurring_sessions': RecurringSession.objects.filter(is_approved=False,).count(),
@@ -389,12 +390,12 @@ def admin_dashboard_view(request):
     ).order_by('start_date')
     
     # Add this:
-    today = timezone.now().date()
+    today = timezone.localdate()
     today_bookings = ComputerBooking.objects.filter(
-        start_time__date=today
+        **within_dates('start_time', today)
     )
     today_sessions = LabSession.objects.filter(
-        start_time__date=today
+        **within_dates('start_time', today)
     )
 
     students = User.objects.filter(is_student=True).order_by('username')
@@ -461,6 +462,7 @@ def admin_dashboard_view(request):
     return render(request, 'admin_dashboard.html', context)
 
 @login_required
+@transaction.atomic
 def approve_booking_view(request, booking_id):
     if not request.user.is_admin:
         messages.error(request, "Access denied. Admin privileges required.")
@@ -491,6 +493,7 @@ def approve_booking_view(request, booking_id):
     return redirect('admin_dashboard')
 
 @login_required
+@transaction.atomic
 def approve_session_view(request, session_id):
     if not request.user.is_admin:
         messages.error(request, "Access denied. Admin privileges required.")
@@ -522,24 +525,34 @@ def approve_session_view(request, session_id):
 
 @login_required
 def notification_list_view(request):
-    notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
-    
     # Mark all as read
     if request.method == 'POST':
-        Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+        mark_read(request.user)
         return redirect('notification_list')
     
+    # Keyset pages, newest first: ?before=<id> continues below the oldest
+    # notification of the previous page
+    try:
+        before = int(request.GET['before']) if 'before' in request.GET else None
+    except ValueError:
+        before = None
+    notifications = Notification.objects.filter(user=request.user)
+    if before is not None:
+        notifications = notifications.filter(id__lt=before)
+    page = list(notifications.order_by('-id')[:NOTIFICATION_LIST_PAGE_SIZE + 1])
+    older_cursor = page[NOTIFICATION_LIST_PAGE_SIZE - 1].id if len(page) > NOTIFICATION_LIST_PAGE_SIZE else None
+    
     return render(request, 'notification_list.html', {
-        'notifications': notifications
+        'notifications': page[:NOTIFICATION_LIST_PAGE_SIZE],
+        'older_cursor': older_cursor,
+        'is_first_page': before is None
     })
 
 @login_required
 def free_timeslots_view(request, lab_id=None, computer_id=None):
-    from datetime import time  # Add this import
-    
     # Determine the scope of the search (lab-wide or computer-specific)
     if computer_id:
-        computer = get_object_or_404(Computer, id=computer_id)
+        computer = get_object_or_404(Computer.objects.select_related('lab'), id=computer_id)
         lab = computer.lab
     elif lab_id:
         lab = get_object_or_404(Lab, id=lab_id)
@@ -551,78 +564,25 @@ def free_timeslots_view(request, lab_id=None, computer_id=None):
             'labs': labs
         })
     
-    # Set up date range (next 7 days)
-    start_date = timezone.now().date()
-    end_date = start_date + timedelta(days=7)
+    # Set up date range (today and the next 7 days), hourly slots from 8:00 AM to 8:00 PM
+    start_date = timezone.localdate()
     
-    # Get all booked time slots
-    if computer:
-        # Computer-specific bookings
-        booked_slots = ComputerBooking.objects.filter(
-            computer=computer,
-            is_approved=True,
-            is_cancelled=False,
-            start_time__date__range=[start_date, end_date]
-        )
-    else:
-        # Lab-wide sessions
-        booked_lab_sessions = LabSession.objects.filter(
-            lab=lab,
-            is_approved=True,
-            start_time__date__range=[start_date, end_date]
-        )
+    # Answered from the lab's stored occupancy grids: one query for the
+    # whole window once the build_occupancy_grids task has stored them,
+    # otherwise swept in memory; the request never writes grids
+    availability = week_view(lab, start_date, days=8, computer=computer)
     
-    # Prepare time slots
     time_slots = []
-    current_date = start_date
-    while current_date <= end_date:
-        # Generate hourly slots from 8:00 AM to 8:00 PM
-        for hour in range(8, 20):
-            slot_start_time = time(hour=hour, minute=0)
-            slot_start = timezone.make_aware(datetime.combine(current_date, slot_start_time))
-            slot_end = slot_start + timedelta(hours=1)
-
-            # Check if slot is free
-            if computer:
-                # For a specific computer, check if the slot is available
-                is_free = not booked_slots.filter(
-                    start_time__lt=slot_end,
-                    end_time__gt=slot_start
-                ).exists()
-            else:
-                # For lab-wide view, check only lab sessions
-                # Check how many computers are available during this slot
-                all_computers = Computer.objects.filter(lab=lab)
-                booked_computers = ComputerBooking.objects.filter(
-                    computer__lab=lab,
-                    is_approved=True,
-                    is_cancelled=False,
-                    start_time__lt=slot_end,
-                    end_time__gt=slot_start
-                ).values_list('computer_id', flat=True).distinct()
-                
-                available_computers = all_computers.count() - len(set(booked_computers))
-                
-                # Check if lab session blocks this time
-                lab_session_blocks = booked_lab_sessions.filter(
-                    start_time__lt=slot_end,
-                    end_time__gt=slot_start
-                ).exists()
-                
-                # Slot is free if there are available computers AND no lab session blocks it
-                is_free = available_computers > 0 and not lab_session_blocks
-
-            # Add is_weekend property
-            is_weekend = current_date.weekday() >= 5  # 5=Saturday, 6=Sunday
-
-            time_slots.append({
-                'date': current_date,
-                'start_time': slot_start,
-                'end_time': slot_end,
-                'is_free': is_free,
-                'is_weekend': is_weekend
-            })
-        current_date += timedelta(days=1)
+    for slot in availability:
+        slot_date = timezone.localtime(slot['start_time']).date()
+        time_slots.append({
+            'date': slot_date,
+            'start_time': slot['start_time'],
+            'end_time': slot['end_time'],
+            'is_free': slot['is_free'],
+            'free_computers': slot['free_computers'],
+            'is_weekend': slot_date.weekday() >= 5  # 5=Saturday, 6=Sunday
+        })
     
     return render(request, 'free_timeslots.html', {
         'lab': lab,
@@ -646,14 +606,12 @@ def recurring_booking_view(request):
                 recurring_session.save()
                 
                 # Updated notification with proper type and reference
-                admin_users = User.objects.filter(is_admin=True)
-                for admin in admin_users:
-                    Notification.objects.create(
-                        user=admin,
-                        message=f"New recurring session request: {recurring_session.lab.name} - {recurring_session.title}",
-                        notification_type='recurring_session_created',  # Updated type
-                        recurring_session=recurring_session  # Add direct reference
-                    )
+                notify_lab_admins(
+                    recurring_session.lab_id,
+                    f"New recurring session request: {recurring_session.lab.name} - {recurring_session.title}",
+                    'recurring_session_created',
+                    recurring_session=recurring_session
+                )
                 
                 messages.success(request, "Recurring session request submitted for approval")
                 return redirect('home')
@@ -696,12 +654,7 @@ def cancel_recurring_session_view(request, session_id):
     
     if request.method == 'POST':
         # Delete all future lab sessions associated with this recurring session
-        LabSession.objects.filter(
-            lab=recurring_session.lab,
-            lecturer=recurring_session.lecturer,
-            title=recurring_session.title,
-            start_time__gte=timezone.now()
-        ).delete()
+        recurring_session.occurrences.filter(start_time__gte=timezone.now()).delete()
         
         # Delete the recurring session
         recurring_session.delete()
@@ -717,14 +670,12 @@ def cancel_recurring_session_view(request, session_id):
             )
         elif request.user == recurring_session.lecturer:
             # Lecturer cancelled their own session, notify admins
-            admin_users = User.objects.filter(is_admin=True)
-            for admin in admin_users:
-                Notification.objects.create(
-                    user=admin,
-                    message=f"Recurring session '{recurring_session.title}' was cancelled by {recurring_session.lecturer.username}.",
-                    notification_type='recurring_session_rejected',
-                    recurring_session=recurring_session
-                )
+            notify_lab_admins(
+                recurring_session.lab_id,
+                f"Recurring session '{recurring_session.title}' was cancelled by {recurring_session.lecturer.username}.",
+                'recurring_session_rejected',
+                recurring_session=recurring_session
+            )
         
         messages.success(request, "Recurring session cancelled successfully")
         return redirect('recurring_sessions_list')
@@ -778,6 +729,16 @@ def reject_recurring_session_view(request, session_id):
     messages.success(request, "Recurring session rejected successfully")
     return redirect('admin_dashboard')
 
+def _skipped_approvals_message(skipped, limit=10):
+    """Summary of the bookings a bulk approval left pending, and why"""
+    details = [
+        f"{booking.booking_code} ({booking.computer}, {timezone.localtime(booking.start_time).strftime('%Y-%m-%d %H:%M')}): {reason}"
+        for booking, reason in skipped[:limit]
+    ]
+    if len(skipped) > limit:
+        details.append(f"and {len(skipped) - limit} more")
+    return f"{len(skipped)} bookings were left pending because of conflicts: " + "; ".join(details)
+
 @login_required
 def bulk_approve_bookings_view(request):
     if not request.user.is_admin:
@@ -785,31 +746,20 @@ def bulk_approve_bookings_view(request):
         return redirect('home')
     
     if request.method == 'POST':
-        # Approve all pending bookings
-        pending_bookings = ComputerBooking.objects.filter(is_approved=False, is_cancelled=False, end_time__gte=timezone.now())
-        
-        count = 0
-        for booking in pending_bookings:
-            booking.is_approved = True
-            booking.save()
-            
-            # Create notification
-            Notification.objects.create(
-                user=booking.student,
-                message=f"Your booking for {booking.computer} has been approved.",
-                notification_type='booking_approved',
-                booking=booking
-            )
-            
-            # Send approval email
-            send_booking_approval_email(booking)
-            count += 1
+        # Approve every pending booking that conflicts with nothing approved
+        # and with no earlier request; emails are sent in the background
+        approved, skipped = approve_bookings(
+            ComputerBooking.objects.filter(end_time__gte=timezone.now())
+        )
         
-        messages.success(request, f"{count} bookings approved successfully and confirmation emails sent")
+        messages.success(request, f"{len(approved)} bookings approved successfully and confirmation emails queued")
+        if skipped:
+            messages.warning(request, _skipped_approvals_message(skipped))
     
     return redirect('admin_dashboard')
 
 @login_required
+@transaction.atomic
 def bulk_approve_sessions_view(request):
     if not request.user.is_admin:
         messages.error(request, "Access denied. Admin privileges required.")
@@ -868,6 +818,39 @@ def bulk_approve_recurring_sessions_view(request):
     
     return redirect('admin_dashboard')
 
+@login_required
+def approval_planner_view(request):
+    if not request.user.is_admin and not request.user.is_super_admin:
+        messages.error(request, "Access denied. Admin privileges required.")
+        return redirect('home')
+    
+    labs = Lab.objects.all() if request.user.is_super_admin else request.user.managed_labs.all()
+    today = timezone.localdate()
+    form = ApprovalPlanForm(
+        request.POST if request.method == 'POST' else (request.GET or None),
+        labs=labs,
+        initial={'start_date': today, 'end_date': today + timedelta(days=6), 'objective': 'count'}
+    )
+    
+    plan = None
+    if form.is_valid():
+        params = [form.cleaned_data[field] for field in ('lab', 'start_date', 'end_date', 'objective')]
+        if request.method == 'POST':
+            # Re-plans under lock and only applies what the admin previewed
+            plan, applied = apply_plan(*params, expected_signature=request.POST.get('signature'))
+            if applied:
+                messages.success(
+                    request,
+                    f"{len(plan.sessions)} lab sessions and {len(plan.bookings)} bookings approved "
+                    f"({plan.hours:.1f} hours); confirmation emails queued"
+                )
+                return redirect('admin_dashboard')
+            messages.warning(request, "Pending requests changed since the preview. Review the updated plan before applying it.")
+        else:
+            plan = plan_approvals(*params)
+    
+    return render(request, 'approval_planner.html', {'form': form, 'plan': plan})
+
 @login_required
 def bulk_cancel_bookings_view(request):
     if not request.user.is_admin:
@@ -952,12 +935,7 @@ def bulk_cancel_recurring_sessions_view(request):
             )
             
             # Delete all future lab sessions associated with this recurring session
-            LabSession.objects.filter(
-                lab=session.lab,
-                lecturer=session.lecturer,
-                title=session.title,
-                start_time__gte=timezone.now()
-            ).delete()
+            session.occurrences.filter(start_time__gte=timezone.now()).delete()
             
             # Delete the recurring session
             session.delete()
@@ -968,6 +946,7 @@ def bulk_cancel_recurring_sessions_view(request):
     return redirect('admin_dashboard')
 
 @login_required
+@transaction.atomic
 def reject_booking_view(request, booking_id):
     if not request.user.is_admin:
         messages.error(request, "Access denied. Admin privileges required.")
@@ -994,6 +973,7 @@ def reject_booking_view(request, booking_id):
     return redirect('admin_dashboard')
 
 @login_required
+@transaction.atomic
 def reject_session_view(request, session_id):
     if not request.user.is_admin:
         messages.error(request, "Access denied. Admin privileges required.")
@@ -1019,6 +999,7 @@ def reject_session_view(request, session_id):
     return redirect('admin_dashboard')
 
 @login_required
+@transaction.atomic
 def cancel_booking_view(request, booking_id):
     if not request.user.is_admin and not request.user == booking.student:
         messages.error(request, "Access denied.")
@@ -1042,14 +1023,14 @@ def cancel_booking_view(request, booking_id):
             send_booking_cancellation_email(booking, cancelled_by="Administrator")
         else:
             # Notify admins when a student cancels
-            admin_users = User.objects.filter(is_admin=True)
-            for admin in admin_users:
-                Notification.objects.create(
-                    user=admin,
-                    message=f"Booking for {booking.computer} by {booking.student.username} has been cancelled.",
-                    notification_type='booking_cancelled',
-                    booking=booking
-                )
+            notify_lab_admins(
+                booking.computer.lab_id,
+                f"Booking for {booking.computer} by {booking.student.username} has been cancelled.",
+                'booking_cancelled',
+                coalesce_key=f'booking_cancelled:lab:{booking.computer.lab_id}',
+                summary=f"{{count}} bookings cancelled in {booking.computer.lab.name}",
+                booking=booking
+            )
             # Send cancellation email to student
             send_booking_cancellation_email(booking, cancelled_by="Student")
         
@@ -1059,6 +1040,7 @@ def cancel_booking_view(request, booking_id):
     return render(request, 'cancel_booking.html', {'booking': booking})
 
 @login_required
+@transaction.atomic
 def cancel_session_view(request, session_id):
     if not request.user.is_admin:
         messages.error(request, "Access denied. Admin privileges required.")
@@ -1079,13 +1061,12 @@ def cancel_session_view(request, session_id):
         send_session_cancellation_email(session, cancelled_by="Administrator")
         
         # Also notify attending students
-        for student in session.attending_students.all():
-            Notification.objects.create(
-                user=student,
-                message=f"The lab session '{session.title}' scheduled for {session.lab.name} has been cancelled.",
-                notification_type='session_cancelled',
-                lab_session=session
-            )
+        notify(
+            session.attending_students.values_list('id', flat=True),
+            f"The lab session '{session.title}' scheduled for {session.lab.name} has been cancelled.",
+            'session_cancelled',
+            lab_session=session
+        )
         
         # Delete the session
         session.delete()
@@ -1358,27 +1339,77 @@ def extend_booking(request, booking_id):
     
     return redirect('booking_detail', booking_id=booking.id)
 
+def _unread_notifications_etag(request):
+    # Changes whenever a notification arrives or is folded into another, or
+    # the unread count moves; costs one cache lookup, the counter comes with
+    # request.user
+    if not request.user.is_authenticated:
+        return None
+    latest_id, counts = notification_state(request.user.pk)
+    return f"{request.user.unread_notifications}-{latest_id}-{counts}"
+
 @login_required
+@condition(etag_func=_unread_notifications_etag)
 def unread_notifications_json(request):
-    """Return unread notifications as JSON"""
-    unread = Notification.objects.filter(
-        user=request.user,
-        is_read=False
-    ).order_by('-created_at')
+    """
+    Return unread notifications as JSON.
     
-    notifications = []
-    for notification in unread:
-        notifications.append({
-            'id': notification.id,
-            'message': notification.message,
-            'notification_type': notification.notification_type,
-            'created_at': notification.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        })
+    Without a since cursor the newest page is returned; with since (the
+    cursor of an earlier response) only newer notifications, oldest first,
+    up to limit per request. Polls that change nothing get a 304.
+    """
+    try:
+        since = int(request.GET['since']) if 'since' in request.GET else None
+        limit = min(max(int(request.GET.get('limit', NOTIFICATION_PAGE_SIZE)), 1), NOTIFICATION_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'since and limit must be integers'}, status=400)
     
-    return JsonResponse({
-        'count': unread.count(),
-        'notifications': notifications
+    unread = Notification.objects.filter(user=request.user, is_read=False)
+    if since is None:
+        page = list(unread.order_by('-id')[:limit])
+        has_more = False
+        cursor = latest_notification_id(request.user.pk)
+    else:
+        page = list(unread.filter(id__gt=since).order_by('id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        cursor = page[-1].id if page else since
+    
+    response = JsonResponse({
+        'count': request.user.unread_notifications,
+        'notifications': [notification_payload(notification) for notification in page],
+        'cursor': cursor,
+        'has_more': has_more
     })
+    # Let the browser revalidate with If-None-Match instead of refetching
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@require_GET
+async def notification_stream(request):
+    """
+    Stream new notifications and the unread count as server-sent events.
+    
+    Async, so an open stream holds no thread of an ASGI worker; under WSGI
+    it would tie up a worker thread for as long as the page stays open.
+    A reconnecting EventSource sends Last-Event-ID and is replayed what it
+    missed.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    try:
+        last_event_id = int(request.headers['Last-Event-ID']) if 'Last-Event-ID' in request.headers else None
+    except ValueError:
+        last_event_id = None
+    
+    response = StreamingHttpResponse(
+        notification_events(user.pk, last_event_id), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the events
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.shortcuts import render, redirect, get_object_or_404
@@ -1408,9 +1439,9 @@ def admin_check_in_dashboard(request):
             try:
                 selected_date = datetime.strptime(date_str, '%Y-%m-%d').date()
             except ValueError:
-                selected_date = timezone.now().date()
+                selected_date = timezone.localdate()
         else:
-            selected_date = timezone.now().date()
+            selected_date = timezone.localdate()
         
         now = timezone.now()
         tomorrow = selected_date + timedelta(days=1)
@@ -1426,21 +1457,24 @@ def admin_check_in_dashboard(request):
         ).select_related('lab', 'lecturer')
         
         # If user is lab-specific admin, filter by their labs
+        managed_labs = None
         if request.user.is_admin and not request.user.is_super_admin:
             managed_labs = request.user.managed_labs.all()
             base_bookings_query = base_bookings_query.filter(computer__lab__in=managed_labs)
             base_sessions_query = base_sessions_query.filter(lab__in=managed_labs)
         
+        # Occurrences of lazily expanded recurring sessions are listed once
+        # the materialize_recurring_occurrences task has written their rows,
+        # which attendance is recorded against
+        
         # Get bookings that overlap with the selected date
         today_bookings = base_bookings_query.filter(
-            start_time__date__lte=selected_date,
-            end_time__date__gte=selected_date
+            **touching_dates('start_time', 'end_time', selected_date)
         ).order_by('start_time')
         
         # Get lab sessions for the selected date
         today_sessions = base_sessions_query.filter(
-            start_time__date__lte=selected_date,
-            end_time__date__gte=selected_date
+            **touching_dates('start_time', 'end_time', selected_date)
         ).order_by('start_time')
         
         # Create session_attendance dictionary
@@ -1911,6 +1945,71 @@ def lab_computers_api(request, lab_id):
         return JsonResponse(data)
     except Lab.DoesNotExist:
         return JsonResponse({'error': 'Lab not found'}, status=404)
+
+def _allocation_json(allocation):
+    return {
+        'computer_id': allocation['computer'].id,
+        'computer_number': allocation['computer'].computer_number,
+        'start_time': allocation['start_time'],
+        'end_time': allocation['end_time'],
+        'exact': allocation['exact'],
+    }
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+def allocate_computer_api(request, lab_id):
+    """
+    Pick a computer for a lab, start time and duration.
+    
+    GET returns the suggested computer (or the nearest free window when the
+    requested time is full); POST also books it for the student. Parameters:
+    start (ISO datetime), duration (minutes) and, for POST, accept_alternative
+    to book a suggested alternative window.
+    """
+    lab = get_object_or_404(Lab, id=lab_id)
+    params = request.POST if request.method == 'POST' else request.GET
+    
+    try:
+        start_time = parse_datetime(params.get('start', ''))
+        duration = int(params.get('duration', ''))
+    except ValueError:
+        start_time, duration = None, 0
+    if start_time is None or not 15 <= duration <= 12 * 60:
+        return JsonResponse({'error': 'Provide start as an ISO datetime and duration in minutes (15-720)'}, status=400)
+    if timezone.is_naive(start_time):
+        start_time = timezone.make_aware(start_time)
+    if start_time < timezone.now():
+        return JsonResponse({'error': 'Booking must be for a future time'}, status=400)
+    duration = timedelta(minutes=duration)
+    
+    if request.method == 'GET':
+        allocation = lab.allocate_computer(start_time, duration)
+        if allocation is None:
+            return JsonResponse({'error': 'No computer is free around this time'}, status=404)
+        return JsonResponse({'allocation': _allocation_json(allocation)})
+    
+    if not request.user.is_student:
+        return JsonResponse({'error': 'Only students can book computers'}, status=403)
+    
+    accept_alternative = params.get('accept_alternative') in ('1', 'true', 'on')
+    try:
+        booking, allocation = lab.book_next_free_computer(
+            request.user, start_time, duration, accept_alternative=accept_alternative
+        )
+    except ValidationError as e:
+        return JsonResponse({'error': ', '.join(e.messages)}, status=409)
+    
+    if allocation is None:
+        return JsonResponse({'error': 'No computer is free around this time'}, status=404)
+    if booking is None:
+        # Only an alternative window is free; the client may confirm it
+        return JsonResponse({'allocation': _allocation_json(allocation)}, status=409)
+    
+    return JsonResponse({
+        'booking_id': booking.id,
+        'allocation': _allocation_json(allocation),
+        'redirect_url': reverse('booking_success', args=[booking.id]),
+    }, status=201)
     
 @login_required
 @user_passes_test(is_admin)
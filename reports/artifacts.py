@@ -0,0 +1,161 @@
+"""
+Report documents rendered in the background.
+
+Rendering a PDF of a long date range can outlast a web request, so the
+report pages only ask for one: request_artifact() records a ReportArtifact
+and queues reports.tasks.render_report_artifact, and the browser polls the
+artifact's status until the document can be downloaded.
+
+Artifacts are keyed like the cached report statistics (reports.report_cache),
+so requests for the same report over unchanged data within
+REPORT_CACHE_TIMEOUT share one document instead of rendering it again, and
+the worker renders from the statistics the report page already cached.
+A ready artifact expires REPORT_CACHE_TIMEOUT after it was completed and is
+purged nightly with its document, along with old failed artifacts and
+stalled ones (STALLED_AFTER).
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .documents import BUILDERS
+from .models import ReportArtifact
+from .utils import SystemUsageReporter
+
+logger = logging.getLogger(__name__)
+
+# An artifact still pending this long after it was requested, or running
+# this long after its worker started it, is taken for lost (its worker died
+# or its task was never queued) and rendered again on the next request. A
+# worker that does finish afterwards discards its document.
+STALLED_AFTER = timedelta(minutes=30)
+
+
+def _queue(artifact_id):
+    from .tasks import render_report_artifact
+    try:
+        render_report_artifact.delay(str(artifact_id))
+    except Exception:
+        logger.warning('Could not queue the rendering of report artifact %s', artifact_id, exc_info=True)
+
+
+def _cache_window():
+    return timedelta(seconds=settings.REPORT_CACHE_TIMEOUT)
+
+
+def request_artifact(report_type, format, start_date, end_date, user=None):
+    """
+    The artifact of the report in format ('pdf' or 'html'): the live one of
+    the same report over the same data if there is one, else a new one
+    whose rendering is queued once the transaction commits.
+    """
+    key = SystemUsageReporter(start_date, end_date).get_report_key(report_type)
+    now = timezone.now()
+    with transaction.atomic():
+        artifact = ReportArtifact.objects.select_for_update().filter(
+            cache_key=key, format=format
+        ).exclude(status='failed').first()
+
+        if artifact is not None and artifact.status == 'ready' and (
+            artifact.completed_at < now - _cache_window()
+        ):
+            _delete([artifact])
+            artifact = None
+        elif artifact is not None and artifact.status != 'ready' and (
+            artifact.started_at or artifact.created_at
+        ) < now - STALLED_AFTER:
+            artifact.status = 'failed'
+            artifact.error = 'Rendering did not finish'
+            artifact.save(update_fields=['status', 'error'])
+            artifact = None
+
+        if artifact is None:
+            try:
+                with transaction.atomic():
+                    artifact = ReportArtifact.objects.create(
+                        report_type=report_type,
+                        format=format,
+                        start_date=start_date,
+                        end_date=end_date,
+                        cache_key=key,
+                        requested_by=user
+                    )
+            except IntegrityError:
+                # A concurrent request for the same report created it first
+                artifact = ReportArtifact.objects.exclude(status='failed').get(cache_key=key, format=format)
+            else:
+                artifact_id = artifact.id
+                transaction.on_commit(lambda: _queue(artifact_id))
+    return artifact
+
+
+def render_artifact(artifact_id):
+    """
+    Render a pending artifact's document and store it. Returns the
+    artifact, or None if it is no longer pending (a repeated delivery of
+    its task) or was taken for stalled while it rendered.
+    """
+    with transaction.atomic():
+        artifact = ReportArtifact.objects.select_for_update().filter(id=artifact_id, status='pending').first()
+        if artifact is None:
+            return None
+        artifact.status = 'running'
+        artifact.started_at = timezone.now()
+        artifact.save(update_fields=['status', 'started_at'])
+
+    try:
+        reporter = SystemUsageReporter(artifact.start_date, artifact.end_date)
+        statistics = reporter.get_cached_report_statistics(artifact.report_type)
+        content = BUILDERS[artifact.format](artifact.report_type, statistics)
+        artifact.file.save(artifact.filename, ContentFile(content), save=False)
+    except Exception as e:
+        logger.exception('Could not render report artifact %s', artifact.id)
+        artifact.status = 'failed'
+        artifact.error = str(e)
+    else:
+        artifact.status = 'ready'
+    artifact.completed_at = timezone.now()
+
+    # Only while still running: a request that took it for stalled has
+    # failed it and may have queued another artifact of the same report
+    finished = ReportArtifact.objects.filter(id=artifact.id, status='running').update(
+        status=artifact.status, file=artifact.file.name or '', error=artifact.error,
+        completed_at=artifact.completed_at
+    )
+    if not finished:
+        logger.warning('Report artifact %s was taken for stalled; discarding its document', artifact.id)
+        if artifact.file:
+            artifact.file.delete(save=False)
+        return None
+    return artifact
+
+
+def _delete(artifacts):
+    for artifact in artifacts:
+        if artifact.file:
+            artifact.file.delete(save=False)
+    ReportArtifact.objects.filter(id__in=[artifact.id for artifact in artifacts]).delete()
+
+
+def purge_artifacts(now=None):
+    """
+    Delete, with their documents, the ready artifacts completed before the
+    cache window, the failed ones requested before it and the pending or
+    running ones stalled. Returns how many were deleted.
+    """
+    now = now or timezone.now()
+    expired_before = now - _cache_window()
+    stalled_before = now - STALLED_AFTER
+    expired = list(ReportArtifact.objects.filter(
+        Q(status='ready', completed_at__lt=expired_before)
+        | Q(status='failed', created_at__lt=expired_before)
+        | Q(status='pending', created_at__lt=stalled_before)
+        | Q(status='running', started_at__lt=stalled_before)
+    ))
+    _delete(expired)
+    return len(expired)
@@ -0,0 +1,209 @@
+"""
+Report documents.
+
+The PDF and HTML exports of a report, rendered from the statistics its page
+shows (SystemUsageReporter.get_report_statistics()) rather than computed
+again. reports.artifacts runs them in a Celery worker and stores the result.
+"""
+import io
+
+from django.template.loader import render_to_string
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+REPORT_TITLES = {
+    'system_usage': 'System Usage Report',
+    'lab_utilization': 'Lab Utilization Report',
+    'computer_inventory': 'Computer Inventory Report',
+    'attendance': 'Attendance Report',
+}
+
+
+def build_pdf(report_type, statistics):
+    """Render the statistics of a report as a PDF document with ReportLab; returns its bytes"""
+    # Create PDF in memory
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.75*inch, bottomMargin=0.75*inch)
+    
+    styles = getSampleStyleSheet()
+    story = []
+    
+    # Define custom styles
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#2c6e49'),
+        spaceAfter=6,
+        alignment=TA_CENTER,
+        fontName='Helvetica-Bold'
+    )
+    
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=14,
+        textColor=colors.HexColor('#2c6e49'),
+        spaceAfter=12,
+        spaceBefore=12,
+        fontName='Helvetica-Bold'
+    )
+    
+    # Header
+    story.append(Paragraph("Lab Management System", title_style))
+    story.append(Paragraph(REPORT_TITLES[report_type], styles['Heading2']))
+    story.append(Spacer(1, 0.2*inch))
+    
+    summary = statistics['summary']
+    
+    # Summary section
+    story.append(Paragraph("Report Summary", heading_style))
+    
+    summary_data = [
+        ['Metric', 'Value'],
+        ['Report Generated', summary['report_generated']],
+        ['Date Range', summary['date_range']],
+        ['Total Bookings', str(summary['total_bookings'])],
+        ['Total Lab Sessions', str(summary['total_sessions'])],
+        ['Total Hours Logged', f"{summary['total_hours']} hours"],
+        ['Active Students', str(summary['total_users'])],
+        ['Total Labs', str(summary['total_labs'])],
+        ['Total Computers', str(summary['total_computers'])],
+    ]
+    
+    summary_table = Table(summary_data, colWidths=[2.5*inch, 2.5*inch])
+    summary_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2c6e49')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('FONTSIZE', (0, 1), (-1, -1), 10),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f0f0f0')])
+    ]))
+    
+    story.append(summary_table)
+    story.append(Spacer(1, 0.3*inch))
+    
+    # Attendance Statistics
+    if report_type in ['system_usage', 'attendance']:
+        story.append(Paragraph("Attendance Statistics", heading_style))
+        
+        booking_att = summary['booking_attendance']
+        session_att = summary['session_attendance']
+        
+        attendance_data = [
+            ['Category', 'Total', 'Present', 'Late', 'Absent', 'Excused'],
+            ['Computer Bookings', str(booking_att['total']), str(booking_att['present']), 
+             str(booking_att['late']), str(booking_att['absent']), str(booking_att['excused'])],
+            ['Lab Sessions', str(session_att['total']), str(session_att['present']), 
+             str(session_att['late']), str(session_att['absent']), str(session_att['excused'])],
+        ]
+        
+        att_table = Table(attendance_data)
+        att_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2c6e49')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f0f0f0')])
+        ]))
+        
+        story.append(att_table)
+        story.append(Spacer(1, 0.3*inch))
+    
+    # Lab Statistics
+    if report_type in ['system_usage', 'lab_utilization']:
+        story.append(PageBreak())
+        story.append(Paragraph("Lab Utilization", heading_style))
+        
+        labs = statistics['labs']
+        
+        for lab in labs[:5]:  # Limit to first 5 labs per page
+            lab_data = [
+                ['Lab Information', 'Value'],
+                ['Lab Name', lab['name']],
+                ['Location', lab['location']],
+                ['Capacity', f"{lab['computers']} computers"],
+                ['Total Bookings', str(lab['bookings'])],
+                ['Total Sessions', str(lab['sessions'])],
+                ['Usage Hours', f"{lab['total_hours']} hours"],
+                ['Utilization', f"{lab['utilization']}%"],
+            ]
+            
+            lab_table = Table(lab_data, colWidths=[2.5*inch, 2.5*inch])
+            lab_table.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e4c33')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, 0), (-1, 0), 11),
+                ('BOTTOMPADDING', (0, 0), (-1, 0), 10),
+                ('GRID', (0, 0), (-1, -1), 1, colors.grey),
+                ('FONTSIZE', (0, 1), (-1, -1), 9),
+                ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f5f5')])
+            ]))
+            
+            story.append(lab_table)
+            story.append(Spacer(1, 0.15*inch))
+    
+    # Computer Statistics
+    if report_type in ['system_usage', 'computer_inventory']:
+        story.append(PageBreak())
+        story.append(Paragraph("Computer Usage Statistics", heading_style))
+        
+        computers = statistics['computers'][:20]  # Top 20 computers
+        
+        computer_data = [['Computer #', 'Lab', 'Status', 'Bookings', 'Hours Used']]
+        for comp in computers:
+            computer_data.append([
+                str(comp['number']),
+                comp['lab'],
+                comp['status'].title(),
+                str(comp['bookings']),
+                f"{comp['hours']}"
+            ])
+        
+        comp_table = Table(computer_data)
+        comp_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2c6e49')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('FONTSIZE', (0, 1), (-1, -1), 9),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f0f0f0')])
+        ]))
+        
+        story.append(comp_table)
+    
+    # Build PDF
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def build_html(report_type, statistics):
+    """Render the statistics of a report as a standalone HTML page; returns its bytes"""
+    return render_to_string('reports/export.html', {
+        'report_type': report_type,
+        'title': REPORT_TITLES[report_type],
+        **statistics,
+    }).encode()
+
+
+BUILDERS = {
+    'pdf': build_pdf,
+    'html': build_html,
+}
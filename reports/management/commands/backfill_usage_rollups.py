@@ -0,0 +1,32 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from reports.rollups import BACKFILL_CHUNK_DAYS, backfill_daily_usage
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily usage rollups of a date range from the bookings, sessions and attendance records'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start', type=date.fromisoformat, default=None,
+            help='First date to rebuild, YYYY-MM-DD (default: the first booking or session)'
+        )
+        parser.add_argument(
+            '--end', type=date.fromisoformat, default=None,
+            help='Last date to rebuild, YYYY-MM-DD (default: today)'
+        )
+        parser.add_argument(
+            '--chunk-days', type=int, default=BACKFILL_CHUNK_DAYS,
+            help='Dates rebuilt per transaction'
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for chunk_start, chunk_end, rows in backfill_daily_usage(
+            options['start'], options['end'], chunk_days=options['chunk_days']
+        ):
+            total += rows
+            self.stdout.write(f'{chunk_start} to {chunk_end}: {rows} rows')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {total} daily usage rows'))
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('booking', '0012_notification_coalescing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('booking_count', models.PositiveIntegerField(default=0)),
+                ('booked_minutes', models.PositiveIntegerField(default=0)),
+                ('session_count', models.PositiveIntegerField(default=0)),
+                ('session_minutes', models.PositiveIntegerField(default=0)),
+                ('booking_present', models.PositiveIntegerField(default=0)),
+                ('booking_late', models.PositiveIntegerField(default=0)),
+                ('booking_absent', models.PositiveIntegerField(default=0)),
+                ('booking_excused', models.PositiveIntegerField(default=0)),
+                ('session_present', models.PositiveIntegerField(default=0)),
+                ('session_late', models.PositiveIntegerField(default=0)),
+                ('session_absent', models.PositiveIntegerField(default=0)),
+                ('session_excused', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('computer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_usage', to='booking.computer')),
+                ('lab', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_usage', to='booking.lab')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily usage',
+                'indexes': [models.Index(fields=['date', 'lab'], name='daily_usage_date_lab_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('computer__isnull', False)), fields=('date', 'computer'), name='daily_usage_computer_unique'), models.UniqueConstraint(condition=models.Q(('computer__isnull', True)), fields=('date', 'lab'), name='daily_usage_lab_unique')],
+            },
+        ),
+    ]
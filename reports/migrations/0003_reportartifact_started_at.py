@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0002_report_artifacts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportartifact',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
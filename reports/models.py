@@ -1,2 +1,108 @@
-# Report models - currently using views to aggregate data on-demand
-# Future: Consider caching aggregated reports or adding report scheduling
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from django.db.models import Q
+
+from booking.models import Computer, Lab, User
+
+
+class DailyUsage(models.Model):
+    """
+    One local date of usage, rolled up from the bookings, lab sessions and
+    attendance records by reports.rollups.
+
+    A row with a computer holds that computer's approved bookings starting
+    on the date and the attendance taken for its bookings; the row of the
+    lab with no computer holds the lab's approved sessions and their
+    attendance.
+    """
+    date = models.DateField()
+    lab = models.ForeignKey(Lab, on_delete=models.CASCADE, related_name='daily_usage')
+    computer = models.ForeignKey(Computer, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_usage')
+
+    booking_count = models.PositiveIntegerField(default=0)
+    booked_minutes = models.PositiveIntegerField(default=0)
+    session_count = models.PositiveIntegerField(default=0)
+    session_minutes = models.PositiveIntegerField(default=0)
+
+    booking_present = models.PositiveIntegerField(default=0)
+    booking_late = models.PositiveIntegerField(default=0)
+    booking_absent = models.PositiveIntegerField(default=0)
+    booking_excused = models.PositiveIntegerField(default=0)
+    session_present = models.PositiveIntegerField(default=0)
+    session_late = models.PositiveIntegerField(default=0)
+    session_absent = models.PositiveIntegerField(default=0)
+    session_excused = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'computer'], condition=Q(computer__isnull=False), name='daily_usage_computer_unique'
+            ),
+            models.UniqueConstraint(
+                fields=['date', 'lab'], condition=Q(computer__isnull=True), name='daily_usage_lab_unique'
+            ),
+        ]
+        indexes = [models.Index(fields=['date', 'lab'], name='daily_usage_date_lab_idx')]
+        verbose_name_plural = 'Daily usage'
+
+    def __str__(self):
+        return f"{self.computer or self.lab} usage on {self.date}"
+
+
+def artifact_storage():
+    """Storage of report documents, REPORT_ARTIFACT_DIR"""
+    return FileSystemStorage(location=settings.REPORT_ARTIFACT_DIR)
+
+
+class ReportArtifact(models.Model):
+    """
+    A report document (PDF or HTML) rendered in the background by
+    reports.artifacts. cache_key is the report_key() of its statistics, so
+    requests for the same report over unchanged data share one document.
+    """
+    FORMAT_CHOICES = [
+        ('pdf', 'PDF'),
+        ('html', 'HTML'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    report_type = models.CharField(max_length=30)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    cache_key = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    file = models.FileField(storage=artifact_storage, upload_to='%Y/%m/', blank=True)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='report_artifacts')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # One live document per report and format; failed ones are retried
+            models.UniqueConstraint(
+                fields=['cache_key', 'format'], condition=~Q(status='failed'), name='report_artifact_live_unique'
+            ),
+        ]
+        indexes = [models.Index(fields=['created_at'], name='report_artifact_created_idx')]
+
+    def __str__(self):
+        return f"{self.get_format_display()} {self.report_type} report {self.start_date} - {self.end_date}"
+
+    @property
+    def filename(self):
+        """The name the document is downloaded as"""
+        return f"{self.report_type.replace('_', '-')}-report-{self.start_date}-{self.end_date}.{self.format}"
@@ -0,0 +1,135 @@
+"""
+Cached report results.
+
+Report contexts are cached per report type, date range and parameters
+such as the page, so admins opening the same month share one
+computation. Instead of deleting entries, every key includes version
+counters that changes bump:
+
+* one per month, bumped for the months of the dates whose usage rollups
+  are rebuilt (reports.rollups), that is for every booking, session or
+  attendance change;
+* one for the reference data every report shows, bumped by reports.signals
+  when labs, computers or users change.
+
+A bumped counter changes the key, so stale entries are never read again
+and simply expire. A report of a closed past period keeps its key until
+its data is edited, so it stays cached for the whole REPORT_CACHE_TIMEOUT.
+Counters start from the clock rather than from 1, so one evicted and
+recreated can never match a key used before.
+
+The counters only reach every process through a shared cache (CACHE_URL).
+With the per-process memory cache an edit handled by one process leaves
+the others serving their old entries, so there REPORT_CACHE_TIMEOUT
+defaults to a minute, which bounds how stale a report can be.
+
+Concurrent misses of the same key take turns: the first computes the
+report under a short lock while the others wait for its result, for at
+most REPORT_CACHE_WAIT seconds (never more than MAX_WAIT, since a waiting
+request holds a web worker) before computing it themselves.
+"""
+import hashlib
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+
+REFERENCE_VERSION_KEY = 'reports:version:reference'
+
+# Seconds before the lock of a computation that never finished expires
+LOCK_TIMEOUT = 120
+
+# Seconds between checks for the result of another worker's computation
+POLL_INTERVAL = 0.1
+
+# Most seconds a request waits for another worker's computation
+MAX_WAIT = 5
+
+
+def _month_version_key(month):
+    return f'reports:version:{month:%Y-%m}'
+
+
+def _months(start_date, end_date):
+    month = start_date.replace(day=1)
+    while month <= end_date:
+        yield month
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _versions(keys):
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    for key in missing:
+        cache.add(key, time.time_ns(), None)
+    if missing:
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def _bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted: any fresh value differs from the versions in use
+            cache.set(key, time.time_ns(), None)
+
+
+def bump_usage_versions(start_date, end_date=None):
+    """Invalidate the cached reports covering any date from start_date to end_date."""
+    _bump([_month_version_key(month) for month in _months(start_date, end_date or start_date)])
+
+
+def bump_reference_version():
+    """Invalidate every cached report."""
+    _bump([REFERENCE_VERSION_KEY])
+
+
+def report_key(report_type, start_date, end_date, **params):
+    """The cache key of a report under the current versions of its data."""
+    version_keys = [REFERENCE_VERSION_KEY] + [
+        _month_version_key(month) for month in _months(start_date, end_date)
+    ]
+    signature = '|'.join([
+        report_type, start_date.isoformat(), end_date.isoformat(),
+        *(f'{name}={value}' for name, value in sorted(params.items())),
+        *(str(version) for version in _versions(version_keys)),
+    ])
+    return f'reports:{report_type}:{hashlib.sha1(signature.encode()).hexdigest()}'
+
+
+def cached_report(report_type, start_date, end_date, compute, **params):
+    """
+    The result of compute() for the report, from the cache if it holds one
+    for the current data, else computed once however many callers ask for
+    it at the same time and cached for REPORT_CACHE_TIMEOUT seconds.
+
+    params are anything else the result depends on, such as the page.
+    """
+    key = report_key(report_type, start_date, end_date, **params)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    lock_key = f'{key}:lock'
+    locked = cache.add(lock_key, True, LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + min(settings.REPORT_CACHE_WAIT, MAX_WAIT)
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            result = cache.get(key)
+            if result is not None:
+                return result
+            locked = cache.add(lock_key, True, LOCK_TIMEOUT)
+            if locked:
+                # The other computation failed and released its lock
+                break
+    try:
+        result = compute()
+        cache.set(key, result, settings.REPORT_CACHE_TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return result
@@ -0,0 +1,268 @@
+"""
+Daily usage rollups.
+
+DailyUsage holds one row per local date and computer (bookings and their
+attendance) and one per date and lab (sessions and their attendance), so
+reports over a range read a few rows per lab and day instead of every
+booking, session and attendance record in it.
+
+Rows are recomputed from the source tables, which keeps a refresh
+idempotent. A change only touches the rows of its computer (bookings) or
+lab (sessions) on its dates: reports.signals refreshes those once a save
+or delete commits, and bulk writes that bypass the model signals send
+booking.signals.schedule_changed with them. Each such refresh locks just
+its computer or lab row, so refreshes of different computers and labs run
+alongside each other, and it only writes the rows whose counters changed.
+A nightly task re-rolls every row of the last USAGE_ROLLUP_RECONCILE_DAYS
+days to catch anything that slipped past both, and backfill_usage_rollups
+builds history. Every refresh also invalidates the cached reports of its
+dates (reports.report_cache).
+
+Durations are stored in whole minutes and dates are those on which the
+booking or session starts, as in the reports that read them.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from booking.models import (
+    Computer, ComputerBooking, ComputerBookingAttendance, Lab, LabSession, SessionAttendance
+)
+from booking.timeranges import within_dates
+
+from .models import DailyUsage
+from .report_cache import bump_usage_versions
+
+ATTENDANCE_STATUSES = ('present', 'late', 'absent', 'excused')
+
+COUNTER_FIELDS = ('booking_count', 'booked_minutes', 'session_count', 'session_minutes') + tuple(
+    f'{kind}_{status}' for kind in ('booking', 'session') for status in ATTENDANCE_STATUSES
+)
+
+# Dates rebuilt per transaction by backfill_usage_rollups
+BACKFILL_CHUNK_DAYS = 31
+
+
+def _minutes(duration):
+    return round(duration.total_seconds() / 60) if duration else 0
+
+
+def _status_counts(prefix):
+    return {f'{prefix}_{status}': Count('id', filter=Q(status=status)) for status in ATTENDANCE_STATUSES}
+
+
+def build_daily_usage(start_date, end_date, computer_ids=None, lab_ids=None):
+    """
+    Compute the DailyUsage rows of the local dates start_date to end_date
+    with one grouped query per source table. Returns unsaved rows.
+
+    computer_ids limits the computer rows, and lab_ids the lab rows, to
+    those computers and labs (None for all, empty for none).
+    """
+    rows = {}
+    bookings = ComputerBooking.objects.filter(**within_dates('start_time', start_date, end_date))
+    booking_attendance = ComputerBookingAttendance.objects.filter(
+        **within_dates('booking__start_time', start_date, end_date)
+    )
+    sessions = LabSession.objects.filter(**within_dates('start_time', start_date, end_date))
+    session_attendance = SessionAttendance.objects.filter(
+        **within_dates('session__start_time', start_date, end_date)
+    )
+    if computer_ids is not None:
+        bookings = bookings.filter(computer_id__in=computer_ids)
+        booking_attendance = booking_attendance.filter(booking__computer_id__in=computer_ids)
+    if lab_ids is not None:
+        sessions = sessions.filter(lab_id__in=lab_ids)
+        session_attendance = session_attendance.filter(session__lab_id__in=lab_ids)
+
+    def row(date, lab_id, computer_id=None):
+        key = (date, lab_id, computer_id)
+        if key not in rows:
+            rows[key] = DailyUsage(date=date, lab_id=lab_id, computer_id=computer_id)
+        return rows[key]
+
+    # TruncDate converts to the current time zone, as within_dates does
+    for booking in bookings.filter(is_approved=True, is_cancelled=False).values(
+        'computer_id', lab_id=F('computer__lab_id'), date=TruncDate('start_time')
+    ).annotate(count=Count('id'), duration=Sum(F('end_time') - F('start_time'))).order_by():
+        usage = row(booking['date'], booking['lab_id'], booking['computer_id'])
+        usage.booking_count = booking['count']
+        usage.booked_minutes = _minutes(booking['duration'])
+
+    for session in sessions.filter(is_approved=True, is_cancelled=False).values('lab_id', date=TruncDate('start_time')).annotate(
+        count=Count('id'), duration=Sum(F('end_time') - F('start_time'))
+    ).order_by():
+        usage = row(session['date'], session['lab_id'])
+        usage.session_count = session['count']
+        usage.session_minutes = _minutes(session['duration'])
+
+    for attendance in booking_attendance.values(
+        computer_id=F('booking__computer_id'),
+        lab_id=F('booking__computer__lab_id'),
+        date=TruncDate('booking__start_time')
+    ).annotate(**_status_counts('booking')).order_by():
+        usage = row(attendance['date'], attendance['lab_id'], attendance['computer_id'])
+        for status in ATTENDANCE_STATUSES:
+            setattr(usage, f'booking_{status}', attendance[f'booking_{status}'])
+
+    for attendance in session_attendance.values(
+        lab_id=F('session__lab_id'), date=TruncDate('session__start_time')
+    ).annotate(**_status_counts('session')).order_by():
+        usage = row(attendance['date'], attendance['lab_id'])
+        for status in ATTENDANCE_STATUSES:
+            setattr(usage, f'session_{status}', attendance[f'session_{status}'])
+
+    return list(rows.values())
+
+
+def _store(stored, rows):
+    """
+    Make the stored rows (a queryset) match rows: update the changed ones,
+    insert the new ones and delete the rest. Returns the number of rows
+    written.
+    """
+    existing = {(usage.date, usage.lab_id, usage.computer_id): usage for usage in stored}
+    changed, created = [], []
+    now = timezone.now()
+    for usage in rows:
+        current = existing.pop((usage.date, usage.lab_id, usage.computer_id), None)
+        if current is None:
+            created.append(usage)
+        elif any(getattr(current, field) != getattr(usage, field) for field in COUNTER_FIELDS):
+            usage.pk = current.pk
+            usage.updated_at = now
+            changed.append(usage)
+    if existing:
+        DailyUsage.objects.filter(id__in=[usage.id for usage in existing.values()]).delete()
+    if changed:
+        DailyUsage.objects.bulk_update(changed, [*COUNTER_FIELDS, 'updated_at'])
+    DailyUsage.objects.bulk_create(created)
+    return len(changed) + len(created)
+
+
+def _date_runs(dates):
+    """(first, last) of each run of consecutive dates in dates."""
+    dates = sorted(set(dates))
+    while dates:
+        end = 0
+        while end + 1 < len(dates) and dates[end + 1] - dates[end] == timedelta(days=1):
+            end += 1
+        yield dates[0], dates[end]
+        dates = dates[end + 1:]
+
+
+def refresh_daily_usage(start_date, end_date=None):
+    """
+    Recompute every stored row of the local dates start_date to end_date
+    (inclusive). Returns the number of rows written.
+    """
+    end_date = end_date or start_date
+    with transaction.atomic():
+        # Locks every lab and computer, so no refresh of a single one
+        # writes its rows meanwhile
+        list(Lab.objects.select_for_update().order_by('id').values_list('id', flat=True))
+        list(Computer.objects.select_for_update().order_by('id').values_list('id', flat=True))
+        written = _store(
+            DailyUsage.objects.filter(date__range=(start_date, end_date)),
+            build_daily_usage(start_date, end_date)
+        )
+        transaction.on_commit(lambda: bump_usage_versions(start_date, end_date))
+    return written
+
+
+def refresh_computer_usage(computer_id, dates):
+    """Recompute the rows of one computer for dates."""
+    for start_date, end_date in _date_runs(dates):
+        with transaction.atomic():
+            # A no-op UPDATE locks the computer row (the database on
+            # SQLite), as in booking.overlap
+            Computer.objects.filter(pk=computer_id).update(id=F('id'))
+            _store(
+                DailyUsage.objects.filter(date__range=(start_date, end_date), computer_id=computer_id),
+                build_daily_usage(start_date, end_date, computer_ids=[computer_id], lab_ids=[])
+            )
+            transaction.on_commit(lambda start_date=start_date, end_date=end_date: bump_usage_versions(
+                start_date, end_date
+            ))
+
+
+def refresh_lab_usage(lab_id, dates):
+    """Recompute the session row of one lab for dates."""
+    for start_date, end_date in _date_runs(dates):
+        with transaction.atomic():
+            Lab.objects.filter(pk=lab_id).update(id=F('id'))
+            _store(
+                DailyUsage.objects.filter(
+                    date__range=(start_date, end_date), lab_id=lab_id, computer__isnull=True
+                ),
+                build_daily_usage(start_date, end_date, computer_ids=[], lab_ids=[lab_id])
+            )
+            transaction.on_commit(lambda start_date=start_date, end_date=end_date: bump_usage_versions(
+                start_date, end_date
+            ))
+
+
+def refresh_usage_on_commit(computers=(), labs=()):
+    """
+    Once the transaction commits, refresh the rows of the (computer id,
+    date) pairs in computers and the (lab id, date) pairs in labs.
+    """
+    computer_dates, lab_dates = {}, {}
+    for computer_id, date in computers:
+        computer_dates.setdefault(computer_id, set()).add(date)
+    for lab_id, date in labs:
+        lab_dates.setdefault(lab_id, set()).add(date)
+
+    def refresh():
+        for computer_id, dates in computer_dates.items():
+            refresh_computer_usage(computer_id, dates)
+        for lab_id, dates in lab_dates.items():
+            refresh_lab_usage(lab_id, dates)
+    if computer_dates or lab_dates:
+        transaction.on_commit(refresh)
+
+
+def backfill_daily_usage(start_date=None, end_date=None, chunk_days=BACKFILL_CHUNK_DAYS):
+    """
+    Rebuild the rows of start_date (default: the first booking or session)
+    to end_date (default: today), chunk_days dates per transaction.
+    Yields (chunk start, chunk end, rows written) as it goes.
+    """
+    end_date = end_date or timezone.localdate()
+    if start_date is None:
+        firsts = [
+            model.objects.order_by('start_time').values_list('start_time', flat=True).first()
+            for model in (ComputerBooking, LabSession)
+        ]
+        firsts = [timezone.localdate(first) for first in firsts if first is not None]
+        if not firsts:
+            return
+        start_date = min(firsts)
+
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end_date)
+        yield chunk_start, chunk_end, refresh_daily_usage(chunk_start, chunk_end)
+        chunk_start = chunk_end + timedelta(days=1)
+
+
+def usage_between(start_date, end_date):
+    """The stored rows of the local dates start_date to end_date."""
+    return DailyUsage.objects.filter(date__range=(start_date, end_date))
+
+
+def usage_totals():
+    """Sum() aggregates of the counters of DailyUsage rows, named total_<field>."""
+    return {f'total_{field}': Sum(field, default=0) for field in COUNTER_FIELDS}
+
+
+def attendance_summary(totals, kind):
+    """
+    {'total', 'present', 'late', 'absent', 'excused'} of the booking or
+    session attendance in a row of usage_totals()
+    """
+    counts = {status: (totals or {}).get(f'total_{kind}_{status}') or 0 for status in ATTENDANCE_STATUSES}
+    return {'total': sum(counts.values()), **counts}
@@ -0,0 +1,109 @@
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from booking.models import (
+    Computer, ComputerBooking, ComputerBookingAttendance, Lab, LabSession, SessionAttendance, User
+)
+from booking.signals import BOOKING_OCCUPANCY_FIELDS, SESSION_OCCUPANCY_FIELDS, schedule_changed
+
+from .report_cache import bump_reference_version
+from .rollups import refresh_usage_on_commit
+
+# Fields whose changes move a booking or session in the usage rollups, and
+# the field of the computer or lab whose rows hold it
+ROLLUP_FIELDS = {
+    ComputerBooking: BOOKING_OCCUPANCY_FIELDS,
+    LabSession: SESSION_OCCUPANCY_FIELDS,
+}
+ROLLUP_PARENT = {
+    ComputerBooking: 'computer_id',
+    LabSession: 'lab_id',
+}
+
+
+def _rollup_fields_changed(sender, update_fields):
+    return update_fields is None or bool(
+        {field.removesuffix('_id') for field in ROLLUP_FIELDS[sender]}
+        & {field.removesuffix('_id') for field in update_fields}
+    )
+
+
+def _refresh(sender, rows):
+    """refresh_usage_on_commit() for (computer or lab id, date) rows of bookings or sessions."""
+    if sender is ComputerBooking:
+        refresh_usage_on_commit(computers=rows)
+    else:
+        refresh_usage_on_commit(labs=rows)
+
+
+@receiver(pre_save, sender=ComputerBooking)
+@receiver(pre_save, sender=LabSession)
+def remember_rollup_row(sender, instance, **kwargs):
+    # Taken before the save, as the post_save handlers of booking.signals
+    # replace the loaded values with the saved ones
+    loaded = getattr(instance, '_loaded_values', {})
+    loaded_parent = loaded.get(ROLLUP_PARENT[sender])
+    loaded_start = loaded.get('start_time')
+    instance._rollup_rows = (
+        {(loaded_parent, timezone.localdate(loaded_start))} if loaded_parent and loaded_start else set()
+    )
+
+
+@receiver(post_save, sender=ComputerBooking)
+@receiver(post_save, sender=LabSession)
+def refresh_rollups_on_save(sender, instance, update_fields=None, **kwargs):
+    if _rollup_fields_changed(sender, update_fields):
+        _refresh(sender, getattr(instance, '_rollup_rows', set()) | {
+            (getattr(instance, ROLLUP_PARENT[sender]), timezone.localdate(instance.start_time))
+        })
+
+
+@receiver(post_delete, sender=ComputerBooking)
+@receiver(post_delete, sender=LabSession)
+def refresh_rollups_on_delete(sender, instance, **kwargs):
+    _refresh(sender, {(getattr(instance, ROLLUP_PARENT[sender]), timezone.localdate(instance.start_time))})
+
+
+def _attendance_rows(instance, relation, parent_field):
+    try:
+        parent = getattr(instance, relation)
+    except ObjectDoesNotExist:
+        # Deleted along with its booking or session, which refreshes the row
+        return set()
+    return {(getattr(parent, parent_field), timezone.localdate(parent.start_time))}
+
+
+@receiver(post_save, sender=ComputerBookingAttendance)
+@receiver(post_delete, sender=ComputerBookingAttendance)
+def refresh_rollups_on_booking_attendance(sender, instance, **kwargs):
+    refresh_usage_on_commit(computers=_attendance_rows(instance, 'booking', 'computer_id'))
+
+
+@receiver(post_save, sender=SessionAttendance)
+@receiver(post_delete, sender=SessionAttendance)
+def refresh_rollups_on_session_attendance(sender, instance, **kwargs):
+    refresh_usage_on_commit(labs=_attendance_rows(instance, 'session', 'lab_id'))
+
+
+@receiver(schedule_changed)
+def refresh_rollups_on_bulk_change(sender, changes, **kwargs):
+    _refresh(sender, changes)
+
+
+@receiver(post_save, sender=Lab)
+@receiver(post_delete, sender=Lab)
+@receiver(post_save, sender=Computer)
+@receiver(post_delete, sender=Computer)
+@receiver(post_delete, sender=User)
+def invalidate_reports_on_reference_change(sender, instance, **kwargs):
+    transaction.on_commit(bump_reference_version)
+
+
+@receiver(post_save, sender=User)
+def invalidate_reports_on_user_save(sender, instance, update_fields=None, **kwargs):
+    # Logins save last_login alone, which no report shows
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        transaction.on_commit(bump_reference_version)
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from .artifacts import purge_artifacts, render_artifact
+from .rollups import refresh_daily_usage
+
+
+@shared_task
+def reconcile_usage_rollups():
+    """Rebuild the daily usage rollups of the last USAGE_ROLLUP_RECONCILE_DAYS days"""
+    today = timezone.localdate()
+    rows = refresh_daily_usage(today - timedelta(days=settings.USAGE_ROLLUP_RECONCILE_DAYS), today)
+    return f'Wrote {rows} daily usage rows'
+
+
+@shared_task
+def render_report_artifact(artifact_id):
+    """Render and store the document of a requested report"""
+    artifact = render_artifact(artifact_id)
+    if artifact is None:
+        return f'Report artifact {artifact_id} is no longer pending or running'
+    return f'Report artifact {artifact_id} {artifact.status}'
+
+
+@shared_task
+def purge_report_artifacts():
+    """Delete report documents past the cache window"""
+    purged = purge_artifacts()
+    return f'Purged {purged} report artifacts'
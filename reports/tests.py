@@ -1,3 +1,424 @@
-from django.test import TestCase
+import io
+import os
+import threading
+import time
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from booking.models import (
+    Computer, ComputerBooking, ComputerBookingAttendance, Lab, LabSession, SessionAttendance, User
+)
+from booking.timeranges import day_start
+
+from . import artifacts
+from .artifacts import purge_artifacts, render_artifact, request_artifact
+from .models import DailyUsage, ReportArtifact
+from .report_cache import bump_reference_version, bump_usage_versions, cached_report, report_key
+from .rollups import refresh_daily_usage
+from .utils import SystemUsageReporter
+
+
+class SystemUsageReporterQueryCountTests(TestCase):
+    """The report's statistics cost a fixed number of queries, however many labs, computers and bookings there are"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lecturer = User.objects.create(username='lecturer', is_lecturer=True)
+        cls.start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=3)
+
+    def add_labs(self, count):
+        """Labs of 3 computers, each with bookings, attendance and a lab session"""
+        statuses = ['present', 'late', 'absent', 'excused']
+        for _ in range(count):
+            lab_number = Lab.objects.count() + 1
+            lab = Lab.objects.create(name=f'Lab {lab_number}', location='Block A', capacity=3)
+            student = User.objects.create(username=f'student{lab_number}', is_student=True)
+            computers = Computer.objects.bulk_create([
+                Computer(lab=lab, computer_number=number) for number in range(1, 4)
+            ])
+            # bulk_create: the statistics only read the rows
+            bookings = ComputerBooking.objects.bulk_create([
+                ComputerBooking(
+                    computer=computer,
+                    student=student,
+                    start_time=self.start + timedelta(hours=hour),
+                    end_time=self.start + timedelta(hours=hour, minutes=90),
+                    is_approved=True
+                )
+                for computer in computers for hour in range(0, 8, 2)
+            ])
+            ComputerBookingAttendance.objects.bulk_create([
+                ComputerBookingAttendance(booking=booking, status=statuses[index % 4])
+                for index, booking in enumerate(bookings)
+            ])
+            session = LabSession.objects.bulk_create([LabSession(
+                lab=lab,
+                lecturer=self.lecturer,
+                title='Practical',
+                start_time=self.start + timedelta(days=1),
+                end_time=self.start + timedelta(days=1, hours=2),
+                is_approved=True
+            )])[0]
+            SessionAttendance.objects.create(session=session, student=student, status='present')
+        # The lab status snapshot is dropped and the rollups refreshed on
+        # commit, which a TestCase never reaches
+        cache.clear()
+        refresh_daily_usage(timezone.localdate(self.start), timezone.localdate())
+
+    def assert_fixed_queries(self, method, queries):
+        reporter = SystemUsageReporter()
+        self.add_labs(1)
+        with self.assertNumQueries(queries):
+            small = getattr(reporter, method)()
+        self.add_labs(4)
+        with self.assertNumQueries(queries):
+            large = getattr(reporter, method)()
+        return small, large
+
+    def test_lab_statistics(self):
+        small, large = self.assert_fixed_queries('get_lab_statistics', 3)
+        self.assertEqual(len(large), 5)
+        lab = small[0]
+        self.assertEqual(lab['computers'], 3)
+        self.assertEqual(lab['bookings'], 12)
+        self.assertEqual(lab['booking_hours'], 18)
+        self.assertEqual(lab['sessions'], 1)
+        self.assertEqual(lab['session_hours'], 2)
+        self.assertEqual(lab['booking_attendance'], {'total': 12, 'present': 3, 'late': 3, 'absent': 3, 'excused': 3})
+        self.assertEqual(lab['session_attendance'], {'total': 1, 'present': 1, 'late': 0, 'absent': 0, 'excused': 0})
+
+    def test_computer_statistics(self):
+        small, large = self.assert_fixed_queries('get_computer_statistics', 2)
+        self.assertEqual(len(large), 15)
+        self.assertEqual([computer['bookings'] for computer in small], [4, 4, 4])
+        self.assertEqual([computer['hours'] for computer in small], [6, 6, 6])
+
+    def test_summary_statistics(self):
+        small, large = self.assert_fixed_queries('get_summary_statistics', 4)
+        self.assertEqual(small['total_bookings'], 12)
+        self.assertEqual(large['total_bookings'], 60)
+        self.assertEqual(large['total_hours'], 100)
+        self.assertEqual(large['total_computers'], 15)
+        self.assertEqual(large['booking_attendance']['present'], 15)
+
+    def test_active_computers(self):
+        small, large = self.assert_fixed_queries('get_active_computers', 2)
+        self.assertEqual(large['summary']['available_count'], 15)
+
+    def test_student_statistics(self):
+        small, large = self.assert_fixed_queries('get_student_statistics', 1)
+        self.assertEqual(small, [{
+            'name': 'student1',
+            'username': 'student1',
+            'school': 'N/A',
+            'bookings': 12,
+            'hours': 18,
+            'attendance_count': 12,
+            'present': 3,
+            'late': 3,
+            'absent': 3,
+            'attendance_rate': 50,
+        }])
+        self.assertEqual([student['username'] for student in large], [f'student{number}' for number in range(1, 6)])
+
+    def test_student_statistics_pages(self):
+        self.add_labs(5)
+        page = SystemUsageReporter().get_student_statistics(limit=2, offset=2)
+        self.assertEqual([student['username'] for student in page], ['student3', 'student4'])
+
+    def test_full_report(self):
+        self.assert_fixed_queries('get_full_report_context', 10)
+
+
+class DailyUsageRollupTests(TestCase):
+    """Saves and deletes keep the rollups current; the backfill rebuilds them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lab = Lab.objects.create(name='Lab 1', location='Block A', capacity=1)
+        cls.computer = Computer.objects.create(lab=cls.lab, computer_number=1)
+        cls.student = User.objects.create(username='student', is_student=True)
+        cls.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=2)
+
+    def test_changes_refresh_rollups(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = ComputerBooking.objects.create(
+                computer=self.computer,
+                student=self.student,
+                start_time=self.start,
+                end_time=self.start + timedelta(minutes=90),
+                is_approved=True
+            )
+        usage = DailyUsage.objects.get(computer=self.computer)
+        self.assertEqual(usage.date, timezone.localdate(self.start))
+        self.assertEqual((usage.booking_count, usage.booked_minutes), (1, 90))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ComputerBookingAttendance.objects.create(booking=booking, status='late')
+        usage = DailyUsage.objects.get(computer=self.computer)
+        self.assertEqual((usage.booking_late, usage.booking_present), (1, 0))
+
+        # Moving the booking refreshes both the old and the new date
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.start_time += timedelta(days=1)
+            booking.end_time += timedelta(days=1)
+            booking.save()
+        self.assertEqual(
+            list(DailyUsage.objects.values_list('date', flat=True)),
+            [timezone.localdate(booking.start_time)]
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.delete()
+        self.assertFalse(DailyUsage.objects.exists())
+
+    def test_changes_refresh_only_their_rows(self):
+        other = Computer.objects.create(lab=self.lab, computer_number=2)
+        # Everything on one local day, whatever the time the test runs
+        start = day_start(timezone.localdate(self.start)) + timedelta(hours=9)
+        with self.captureOnCommitCallbacks(execute=True):
+            booking, _ = [
+                ComputerBooking.objects.create(
+                    computer=computer,
+                    student=self.student,
+                    start_time=start + timedelta(hours=hour),
+                    end_time=start + timedelta(hours=hour + 1),
+                    is_approved=True
+                )
+                for computer, hour in ((self.computer, 0), (other, 2))
+            ]
+        untouched = DailyUsage.objects.get(computer=other).updated_at
+
+        # Moving a booking to another computer refreshes both computers' rows
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.computer = other
+            booking.save()
+        self.assertEqual(
+            dict(DailyUsage.objects.values_list('computer_id', 'booking_count')), {other.id: 2}
+        )
+
+        # A session only refreshes the lab's row
+        with self.captureOnCommitCallbacks(execute=True):
+            LabSession.objects.create(
+                lab=self.lab,
+                lecturer=User.objects.create(username='lecturer', is_lecturer=True),
+                title='Practical',
+                start_time=start + timedelta(hours=5),
+                end_time=start + timedelta(hours=6),
+                is_approved=True
+            )
+        self.assertEqual(DailyUsage.objects.get(computer__isnull=True).session_minutes, 60)
+        self.assertNotEqual(DailyUsage.objects.get(computer=other).updated_at, untouched)
+        refreshed = DailyUsage.objects.get(computer=other).updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            LabSession.objects.get().delete()
+        self.assertEqual(DailyUsage.objects.get(computer=other).updated_at, refreshed)
+        self.assertFalse(DailyUsage.objects.filter(computer__isnull=True).exists())
+
+    def test_backfill(self):
+        ComputerBooking.objects.bulk_create([
+            ComputerBooking(
+                computer=self.computer,
+                student=self.student,
+                start_time=self.start - timedelta(days=days),
+                end_time=self.start - timedelta(days=days) + timedelta(hours=1),
+                is_approved=True
+            )
+            for days in range(1, 41)
+        ])
+        call_command('backfill_usage_rollups', end=timezone.localdate(self.start), stdout=io.StringIO())
+        self.assertEqual(DailyUsage.objects.count(), 40)
+        self.assertEqual(sum(DailyUsage.objects.values_list('booked_minutes', flat=True)), 40 * 60)
+
+
+class ReportCacheTests(TestCase):
+    """Reports are computed once per range until their data changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.computed = 0
+
+    def compute(self):
+        self.computed += 1
+        return {'computed': self.computed}
+
+    def report(self):
+        return cached_report('lab_utilization', date(2026, 1, 15), date(2026, 2, 14), self.compute)
+
+    def test_versions_invalidate(self):
+        self.assertEqual(self.report(), {'computed': 1})
+        self.assertEqual(self.report(), {'computed': 1})
+
+        # Changes outside the range leave it cached
+        bump_usage_versions(date(2026, 3, 1))
+        self.assertEqual(self.report(), {'computed': 1})
+
+        bump_usage_versions(date(2026, 2, 10))
+        self.assertEqual(self.report(), {'computed': 2})
+
+        bump_reference_version()
+        self.assertEqual(self.report(), {'computed': 3})
+
+        # An evicted counter never brings back an old entry
+        cache.delete('reports:version:2026-01')
+        self.assertEqual(self.report(), {'computed': 4})
+
+    def test_concurrent_miss_waits(self):
+        key = report_key('lab_utilization', date(2026, 1, 15), date(2026, 2, 14))
+        # Another worker is computing the report
+        cache.add(f'{key}:lock', True)
+        finish = threading.Timer(0.3, lambda: cache.set(key, {'computed': 'elsewhere'}))
+        finish.start()
+        self.assertEqual(self.report(), {'computed': 'elsewhere'})
+        finish.join()
+        self.assertEqual(self.computed, 0)
+
+    @override_settings(REPORT_CACHE_WAIT=0.3)
+    def test_abandoned_lock(self):
+        key = report_key('lab_utilization', date(2026, 1, 15), date(2026, 2, 14))
+        cache.add(f'{key}:lock', True)
+        self.assertEqual(self.report(), {'computed': 1})
+
+    @override_settings(REPORT_CACHE_WAIT=30)
+    def test_wait_is_capped(self):
+        key = report_key('lab_utilization', date(2026, 1, 15), date(2026, 2, 14))
+        cache.add(f'{key}:lock', True)
+        started = time.monotonic()
+        with mock.patch('reports.report_cache.MAX_WAIT', 0.3):
+            self.assertEqual(self.report(), {'computed': 1})
+        self.assertLess(time.monotonic() - started, 5)
+
+
+class ReportArtifactTests(TestCase):
+    """Report documents are rendered once per report and data version, outside the request"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_admin=True)
+        cls.end = timezone.localdate()
+        cls.start = cls.end - timedelta(days=30)
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, artifact):
+        artifact = render_artifact(artifact.id)
+        self.addCleanup(artifact.file.delete, save=False)
+        return artifact
+
+    def documents(self):
+        return {
+            os.path.join(directory, name)
+            for directory, _, names in os.walk(settings.REPORT_ARTIFACT_DIR) for name in names
+        }
+
+    def test_identical_requests_share_an_artifact(self):
+        pdf = request_artifact('system_usage', 'pdf', self.start, self.end)
+        self.assertEqual(request_artifact('system_usage', 'pdf', self.start, self.end), pdf)
+        self.assertNotEqual(request_artifact('system_usage', 'html', self.start, self.end), pdf)
+        self.assertNotEqual(request_artifact('attendance', 'pdf', self.start, self.end), pdf)
+
+        # New data, new document
+        bump_usage_versions(self.end)
+        self.assertNotEqual(request_artifact('system_usage', 'pdf', self.start, self.end), pdf)
+
+    def test_render(self):
+        pdf = self.render(request_artifact('system_usage', 'pdf', self.start, self.end))
+        self.assertEqual(pdf.status, 'ready')
+        with pdf.file.open('rb') as document:
+            self.assertEqual(document.read(4), b'%PDF')
+        # A repeated delivery of the task renders nothing
+        self.assertIsNone(render_artifact(pdf.id))
+
+        html = self.render(request_artifact('lab_utilization', 'html', self.start, self.end))
+        with html.file.open('rb') as document:
+            self.assertIn(b'Lab Utilization Report', document.read())
+
+    def test_stalled_render_is_discarded(self):
+        documents = self.documents()
+        pdf = request_artifact('system_usage', 'pdf', self.start, self.end)
+        build = artifacts.BUILDERS['pdf']
+        retried = []
+
+        def slow_build(*args):
+            # The render outlasts STALLED_AFTER and the report is requested again
+            ReportArtifact.objects.filter(id=pdf.id).update(started_at=timezone.now() - artifacts.STALLED_AFTER * 2)
+            retried.append(request_artifact('system_usage', 'pdf', self.start, self.end))
+            return build(*args)
+
+        with mock.patch.dict(artifacts.BUILDERS, pdf=slow_build), self.assertLogs('reports.artifacts', 'WARNING'):
+            self.assertIsNone(render_artifact(pdf.id))
+
+        pdf.refresh_from_db()
+        self.assertEqual((pdf.status, pdf.file.name), ('failed', ''))
+        self.assertEqual(retried[0].status, 'pending')
+        self.assertEqual(self.documents(), documents)
+        self.assertEqual(self.render(retried[0]).status, 'ready')
+
+    def test_only_ready_artifacts_expire(self):
+        window = timedelta(seconds=settings.REPORT_CACHE_TIMEOUT)
+        long_ago = timezone.now() - window - timedelta(minutes=1)
+
+        # Rendering for longer than the cache window, but not stalled
+        pdf = request_artifact('system_usage', 'pdf', self.start, self.end)
+        ReportArtifact.objects.filter(id=pdf.id).update(created_at=long_ago)
+        self.assertEqual(request_artifact('system_usage', 'pdf', self.start, self.end), pdf)
+
+        # Ready from when it was completed
+        pdf = render_artifact(pdf.id)
+        self.assertEqual(request_artifact('system_usage', 'pdf', self.start, self.end), pdf)
+        document = pdf.file.name
+        ReportArtifact.objects.filter(id=pdf.id).update(completed_at=long_ago)
+        renewed = request_artifact('system_usage', 'pdf', self.start, self.end)
+        self.assertNotEqual(renewed, pdf)
+        self.assertFalse(pdf.file.storage.exists(document))
+
+    def test_purge(self):
+        now = timezone.now()
+        long_ago = now - timedelta(seconds=settings.REPORT_CACHE_TIMEOUT) - timedelta(minutes=1)
+        stalled = now - artifacts.STALLED_AFTER - timedelta(minutes=1)
+        rows = {
+            name: request_artifact(report_type, 'html', self.start, self.end)
+            for name, report_type in [
+                ('expired', 'system_usage'), ('recent', 'lab_utilization'), ('pending', 'attendance'),
+                ('stalled', 'computer_inventory'),
+            ]
+        }
+        ReportArtifact.objects.update(created_at=long_ago)
+        ReportArtifact.objects.filter(id=rows['expired'].id).update(status='ready', completed_at=long_ago)
+        ReportArtifact.objects.filter(id=rows['recent'].id).update(status='ready', completed_at=now)
+        ReportArtifact.objects.filter(id=rows['stalled'].id).update(status='running', started_at=stalled)
+        ReportArtifact.objects.filter(id=rows['pending'].id).update(created_at=now)
+        failed = ReportArtifact.objects.create(
+            report_type='system_usage', format='html', start_date=self.start, end_date=self.end,
+            cache_key='failed', status='failed'
+        )
+        ReportArtifact.objects.filter(id=failed.id).update(created_at=long_ago)
+
+        self.assertEqual(purge_artifacts(now), 3)
+        self.assertCountEqual(
+            ReportArtifact.objects.values_list('id', flat=True), [rows['recent'].id, rows['pending'].id]
+        )
+
+    def test_export_views(self):
+        # HostValidationMiddleware rejects requests without a Host header
+        self.client.defaults['HTTP_HOST'] = 'localhost'
+        self.client.force_login(self.admin)
+        response = self.client.get('/reports/system-usage/?days=30&format=pdf')
+        artifact = ReportArtifact.objects.get()
+        self.assertRedirects(response, f'/reports/documents/{artifact.id}/')
+        self.assertEqual(self.client.get(f'/reports/documents/{artifact.id}/status/').json()['status'], 'pending')
+        self.assertEqual(self.client.get(f'/reports/documents/{artifact.id}/download/').status_code, 404)
+
+        self.render(artifact)
+        status = self.client.get(f'/reports/documents/{artifact.id}/status/').json()
+        self.assertEqual(status['status'], 'ready')
+        response = self.client.get(status['download_url'])
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        response.close()
@@ -12,4 +12,7 @@ urlpatterns = [
     path('lab-utilization/', views.lab_utilization_report, name='lab_utilization'),
     path('computer-inventory/', views.computer_inventory_report, name='computer_inventory'),
     path('attendance/', views.attendance_report, name='attendance'),
+    path('documents/<uuid:artifact_id>/', views.artifact_detail, name='artifact'),
+    path('documents/<uuid:artifact_id>/status/', views.artifact_status, name='artifact_status'),
+    path('documents/<uuid:artifact_id>/download/', views.artifact_download, name='artifact_download'),
 ]
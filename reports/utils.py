@@ -1,100 +1,70 @@
 """
 Report generation utilities for system usage statistics
 """
+from django.conf import settings
 from django.utils import timezone
-from django.db.models import Count, Q, Sum, F, ExpressionWrapper, DurationField
+from django.db.models import Count, Q, Sum, F, DurationField
 from datetime import datetime, timedelta
-from booking.models import (
-    Lab, Computer, ComputerBooking, LabSession, 
-    ComputerBookingAttendance, SessionAttendance, User
-)
+from booking.models import Lab, Computer, User
+from booking.lab_status import lab_status, lab_status_snapshot
+from booking.timeranges import within_dates
+from .report_cache import cached_report, report_key
+from .rollups import ATTENDANCE_STATUSES, attendance_summary, usage_between, usage_totals
+
+
+REPORT_TYPES = ('system_usage', 'lab_utilization', 'computer_inventory', 'attendance')
+
+
+def _by_key(rows, key):
+    """Grouped aggregate rows keyed by their group"""
+    return {row[key]: row for row in rows.order_by()}
+
+
+def _hours(duration):
+    return duration.total_seconds() / 3600 if duration else 0
 
 
 class SystemUsageReporter:
     """Generate comprehensive system usage reports"""
     
     def __init__(self, start_date=None, end_date=None):
-        self.end_date = end_date or timezone.now().date()
+        self.end_date = end_date or timezone.localdate()
         self.start_date = start_date or (self.end_date - timedelta(days=30))
     
     def get_date_range_display(self):
         """Get formatted date range"""
         return f"{self.start_date.strftime('%B %d, %Y')} - {self.end_date.strftime('%B %d, %Y')}"
     
+    def _usage(self):
+        """Daily usage rollups of the date range"""
+        return usage_between(self.start_date, self.end_date)
+    
     def get_lab_statistics(self):
-        """Get comprehensive lab usage statistics"""
-        labs = Lab.objects.all()
-        lab_stats = []
+        """
+        Get comprehensive lab usage statistics, summed for every lab from
+        the daily usage rollups with one grouped query.
+        """
+        usage = _by_key(self._usage().values('lab').annotate(**usage_totals()), 'lab')
         
-        for lab in labs:
-            # Get bookings for this lab within date range
-            bookings = ComputerBooking.objects.filter(
-                computer__lab=lab,
-                start_time__date__gte=self.start_date,
-                start_time__date__lte=self.end_date,
-                is_approved=True,
-                is_cancelled=False
-            )
-            
-            # Get lab sessions for this lab within date range
-            sessions = LabSession.objects.filter(
-                lab=lab,
-                start_time__date__gte=self.start_date,
-                start_time__date__lte=self.end_date,
-                is_approved=True,
-                is_cancelled=False
-            )
-            
-            # Calculate total hours
-            booking_hours = 0
-            for booking in bookings:
-                duration = (booking.end_time - booking.start_time).total_seconds() / 3600
-                booking_hours += duration
-            
-            session_hours = 0
-            for session in sessions:
-                duration = (session.end_time - session.start_time).total_seconds() / 3600
-                session_hours += duration
-            
-            # Get attendance stats for bookings
-            booking_attendance = ComputerBookingAttendance.objects.filter(
-                booking__computer__lab=lab,
-                booking__start_time__date__gte=self.start_date,
-                booking__start_time__date__lte=self.end_date
-            )
-            
-            # Get attendance stats for sessions
-            session_attendance = SessionAttendance.objects.filter(
-                session__lab=lab,
-                session__start_time__date__gte=self.start_date,
-                session__start_time__date__lte=self.end_date
-            )
+        lab_stats = []
+        for lab in Lab.objects.all():
+            lab_usage = usage.get(lab.id, {})
+            booking_hours = lab_usage.get('total_booked_minutes', 0) / 60
+            session_hours = lab_usage.get('total_session_minutes', 0) / 60
             
             lab_stats.append({
                 'name': lab.name,
                 'location': lab.location,
                 'capacity': lab.capacity,
-                'computers': lab.computers.count(),
-                'bookings': bookings.count(),
+                'computers': lab_status(lab.id)['total'],
+                'bookings': lab_usage.get('total_booking_count', 0),
                 'booking_hours': round(booking_hours, 2),
-                'sessions': sessions.count(),
+                'sessions': lab_usage.get('total_session_count', 0),
                 'session_hours': round(session_hours, 2),
                 'total_hours': round(booking_hours + session_hours, 2),
                 'utilization': self._calculate_utilization(lab, booking_hours, session_hours),
-                'booking_attendance': {
-                    'total': booking_attendance.count(),
-                    'present': booking_attendance.filter(status='present').count(),
-                    'late': booking_attendance.filter(status='late').count(),
-                    'absent': booking_attendance.filter(status='absent').count(),
-                    'excused': booking_attendance.filter(status='excused').count(),
-                },
-                'session_attendance': {
-                    'total': session_attendance.count(),
-                    'present': session_attendance.filter(status='present').count(),
-                    'late': session_attendance.filter(status='late').count(),
-                    'absent': session_attendance.filter(status='absent').count(),
-                    'excused': session_attendance.filter(status='excused').count(),
-                }
+                'booking_attendance': attendance_summary(lab_usage, 'booking'),
+                'session_attendance': attendance_summary(lab_usage, 'session'),
             })
         
         return lab_stats
@@ -103,7 +73,7 @@ class SystemUsageReporter:
         """Calculate lab utilization percentage"""
         # Assuming lab operates 8 hours per day
         days = (self.end_date - self.start_date).days + 1
-        max_hours = days * 8 * lab.computers.count()
+        max_hours = days * 8 * lab_status(lab.id)['total']
         
         if max_hours == 0:
             return 0
@@ -113,31 +83,24 @@ class SystemUsageReporter:
         return min(100, round(utilization, 2))
     
     def get_computer_statistics(self):
-        """Get per-computer usage statistics"""
-        computers = Computer.objects.all().select_related('lab')
+        """Get per-computer usage statistics, summed from the daily usage rollups in one grouped query"""
+        bookings = _by_key(
+            self._usage().filter(computer__isnull=False).values('computer').annotate(
+                count=Sum('booking_count'), minutes=Sum('booked_minutes')
+            ),
+            'computer'
+        )
         computer_stats = []
         
-        for computer in computers:
-            bookings = ComputerBooking.objects.filter(
-                computer=computer,
-                start_time__date__gte=self.start_date,
-                start_time__date__lte=self.end_date,
-                is_approved=True,
-                is_cancelled=False
-            )
-            
-            hours = 0
-            for booking in bookings:
-                duration = (booking.end_time - booking.start_time).total_seconds() / 3600
-                hours += duration
-            
+        for computer in Computer.objects.all().select_related('lab'):
+            computer_bookings = bookings.get(computer.id, {})
             computer_stats.append({
                 'number': computer.computer_number,
                 'lab': computer.lab.name,
                 'specs': computer.specs,
                 'status': computer.status,
-                'bookings': bookings.count(),
-                'hours': round(hours, 2),
+                'bookings': computer_bookings.get('count', 0),
+                'hours': round(computer_bookings.get('minutes', 0) / 60, 2),
                 'active': computer.status == 'available'
             })
         
@@ -145,147 +108,98 @@ class SystemUsageReporter:
     
     def get_active_computers(self):
         """Get currently active/available computers"""
-        active = Computer.objects.filter(status='available').select_related('lab')
-        maintenance = Computer.objects.filter(status='maintenance').select_related('lab')
-        reserved = Computer.objects.filter(status='reserved').select_related('lab')
+        by_status = {'available': [], 'maintenance': [], 'reserved': []}
+        for c in Computer.objects.select_related('lab').order_by('id'):
+            by_status.setdefault(c.status, []).append({
+                'number': c.computer_number,
+                'lab': c.lab.name,
+                'specs': c.specs
+            })
+        counts = lab_status_snapshot()['totals']
         
         return {
-            'available': [
-                {
-                    'number': c.computer_number,
-                    'lab': c.lab.name,
-                    'specs': c.specs
-                } for c in active
-            ],
-            'maintenance': [
-                {
-                    'number': c.computer_number,
-                    'lab': c.lab.name,
-                    'specs': c.specs
-                } for c in maintenance
-            ],
-            'reserved': [
-                {
-                    'number': c.computer_number,
-                    'lab': c.lab.name,
-                    'specs': c.specs
-                } for c in reserved
-            ],
+            **by_status,
             'summary': {
-                'total': Computer.objects.count(),
-                'available_count': active.count(),
-                'maintenance_count': maintenance.count(),
-                'reserved_count': reserved.count(),
-                'availability_percentage': round((active.count() / Computer.objects.count() * 100) if Computer.objects.count() > 0 else 0, 2)
+                'total': counts['total'],
+                'available_count': counts['available'],
+                'maintenance_count': counts['maintenance'],
+                'reserved_count': counts['reserved'],
+                'availability_percentage': round((counts['available'] / counts['total'] * 100) if counts['total'] > 0 else 0, 2)
             }
         }
     
-    def get_student_statistics(self):
-        """Get student usage statistics"""
-        students = User.objects.filter(is_student=True)
+    def student_statistics(self):
+        """
+        Students with bookings in the date range, annotated with their
+        approved bookings, booked duration and attendance in one grouped
+        query, most bookings first.
+        """
+        live = Q(computer_bookings__is_approved=True, computer_bookings__is_cancelled=False)
+        attendance = {
+            'attendance_count': Count('computer_bookings__attendance'),
+            **{
+                status: Count('computer_bookings__attendance', filter=Q(computer_bookings__attendance__status=status))
+                for status in ATTENDANCE_STATUSES
+            },
+        }
+        # Filtering before annotating restricts the joined bookings to the
+        # date range, so every count below is for the range
+        return User.objects.filter(
+            is_student=True,
+            **within_dates('computer_bookings__start_time', self.start_date, self.end_date)
+        ).annotate(
+            booking_count=Count('computer_bookings', filter=live),
+            duration=Sum(
+                F('computer_bookings__end_time') - F('computer_bookings__start_time'),
+                output_field=DurationField(),
+                filter=live
+            ),
+            **attendance
+        ).filter(
+            Q(booking_count__gt=0) | Q(attendance_count__gt=0)
+        ).order_by('-booking_count', 'username')
+    
+    def get_student_statistics(self, limit=None, offset=0):
+        """
+        Get student usage statistics for the ranks offset to offset + limit
+        (default REPORT_TOP_STUDENTS) of student_statistics()
+        """
+        if limit is None:
+            limit = settings.REPORT_TOP_STUDENTS
         
         student_stats = []
-        for student in students:
-            bookings = ComputerBooking.objects.filter(
-                student=student,
-                start_time__date__gte=self.start_date,
-                start_time__date__lte=self.end_date,
-                is_approved=True,
-                is_cancelled=False
-            )
-            
-            hours = 0
-            for booking in bookings:
-                duration = (booking.end_time - booking.start_time).total_seconds() / 3600
-                hours += duration
-            
-            attendance = ComputerBookingAttendance.objects.filter(
-                booking__student=student,
-                booking__start_time__date__gte=self.start_date,
-                booking__start_time__date__lte=self.end_date
-            )
-            
-            if bookings.exists() or attendance.exists():
-                student_stats.append({
-                    'name': student.get_full_name(),
-                    'username': student.username,
-                    'school': student.get_school_display() if student.school else 'N/A',
-                    'bookings': bookings.count(),
-                    'hours': round(hours, 2),
-                    'attendance_count': attendance.count(),
-                    'attendance_rate': round((attendance.filter(status__in=['present', 'late']).count() / attendance.count() * 100) if attendance.exists() else 0, 2)
-                })
+        for student in self.student_statistics()[offset:offset + limit]:
+            attended = student.present + student.late
+            student_stats.append({
+                'name': student.get_full_name(),
+                'username': student.username,
+                'school': student.get_school_display() if student.school else 'N/A',
+                'bookings': student.booking_count,
+                'hours': round(_hours(student.duration), 2),
+                'attendance_count': student.attendance_count,
+                'present': student.present,
+                'late': student.late,
+                'absent': student.absent,
+                'attendance_rate': round((attended / student.attendance_count * 100) if student.attendance_count else 0, 2)
+            })
         
-        return sorted(student_stats, key=lambda x: x['bookings'], reverse=True)[:50]  # Top 50 students
+        return student_stats
     
     def get_summary_statistics(self):
-        """Get overall summary statistics"""
-        total_bookings = ComputerBooking.objects.filter(
-            start_time__date__gte=self.start_date,
-            start_time__date__lte=self.end_date,
-            is_approved=True,
-            is_cancelled=False
-        ).count()
-        
-        total_sessions = LabSession.objects.filter(
-            start_time__date__gte=self.start_date,
-            start_time__date__lte=self.end_date,
-            is_approved=True,
-            is_cancelled=False
-        ).count()
-        
-        booking_attendance = ComputerBookingAttendance.objects.filter(
-            booking__start_time__date__gte=self.start_date,
-            booking__start_time__date__lte=self.end_date
-        )
-        
-        session_attendance = SessionAttendance.objects.filter(
-            session__start_time__date__gte=self.start_date,
-            session__start_time__date__lte=self.end_date
-        )
-        
-        total_hours = 0
-        for booking in ComputerBooking.objects.filter(
-            start_time__date__gte=self.start_date,
-            start_time__date__lte=self.end_date,
-            is_approved=True,
-            is_cancelled=False
-        ):
-            duration = (booking.end_time - booking.start_time).total_seconds() / 3600
-            total_hours += duration
-        
-        for session in LabSession.objects.filter(
-            start_time__date__gte=self.start_date,
-            start_time__date__lte=self.end_date,
-            is_approved=True,
-            is_cancelled=False
-        ):
-            duration = (session.end_time - session.start_time).total_seconds() / 3600
-            total_hours += duration
+        """Get overall summary statistics, summed from the daily usage rollups"""
+        totals = self._usage().aggregate(**usage_totals())
         
         return {
             'report_generated': timezone.now().strftime('%B %d, %Y at %I:%M %p'),
             'date_range': self.get_date_range_display(),
-            'total_bookings': total_bookings,
-            'total_sessions': total_sessions,
+            'total_bookings': totals['total_booking_count'],
+            'total_sessions': totals['total_session_count'],
             'total_users': User.objects.filter(is_student=True).count(),
             'total_labs': Lab.objects.count(),
-            'total_computers': Computer.objects.count(),
-            'total_hours': round(total_hours, 2),
-            'booking_attendance': {
-                'total': booking_attendance.count(),
-                'present': booking_attendance.filter(status='present').count(),
-                'late': booking_attendance.filter(status='late').count(),
-                'absent': booking_attendance.filter(status='absent').count(),
-                'excused': booking_attendance.filter(status='excused').count(),
-            },
-            'session_attendance': {
-                'total': session_attendance.count(),
-                'present': session_attendance.filter(status='present').count(),
-                'late': session_attendance.filter(status='late').count(),
-                'absent': session_attendance.filter(status='absent').count(),
-                'excused': session_attendance.filter(status='excused').count(),
-            }
+            'total_computers': lab_status_snapshot()['totals']['total'],
+            'total_hours': round((totals['total_booked_minutes'] + totals['total_session_minutes']) / 60, 2),
+            'booking_attendance': attendance_summary(totals, 'booking'),
+            'session_attendance': attendance_summary(totals, 'session'),
         }
     
     def get_full_report_context(self):
@@ -297,3 +211,38 @@ class SystemUsageReporter:
             'active_computers': self.get_active_computers(),
             'top_students': self.get_student_statistics(),
         }
+    
+    def get_report_statistics(self, report_type, page=1):
+        """
+        Get the statistics shown by a report of report_type, on its page and
+        in its documents alike; page is the page of the attendance report's
+        student ranking, fetched with one extra row telling whether there is
+        a next page
+        """
+        if report_type == 'system_usage':
+            return self.get_full_report_context()
+        statistics = {'summary': self.get_summary_statistics()}
+        if report_type == 'lab_utilization':
+            statistics['labs'] = self.get_lab_statistics()
+        elif report_type == 'computer_inventory':
+            statistics['computers'] = self.get_computer_statistics()
+            statistics['active_computers'] = self.get_active_computers()
+        elif report_type == 'attendance':
+            per_page = settings.REPORT_TOP_STUDENTS
+            statistics['students'] = self.get_student_statistics(limit=per_page + 1, offset=(page - 1) * per_page)
+        return statistics
+    
+    def get_cached_report_statistics(self, report_type, page=1):
+        """get_report_statistics(), computed once for the date range until its data changes"""
+        return cached_report(
+            report_type, self.start_date, self.end_date,
+            lambda: self.get_report_statistics(report_type, page),
+            page=page, per_page=settings.REPORT_TOP_STUDENTS
+        )
+    
+    def get_report_key(self, report_type, page=1):
+        """The cache key of get_cached_report_statistics() under the current data"""
+        return report_key(
+            report_type, self.start_date, self.end_date,
+            page=page, per_page=settings.REPORT_TOP_STUDENTS
+        )
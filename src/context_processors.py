@@ -1,25 +1,29 @@
 """
 Custom context processors for the Lab Management System.
 """
+from django.conf import settings
+from django.urls import reverse
 from django.utils import timezone
 from datetime import datetime
-from booking.models import Notification
 
 
 def notifications_context(request):
     """
     Add unread notifications count to the template context.
+    Read from the counter kept on the user, so it costs no query.
+    With NOTIFICATION_STREAMING the stream URL is added for the page to
+    open instead of polling.
     """
     unread_notifications_count = 0
+    notification_stream_url = ''
     if hasattr(request, 'user') and request.user.is_authenticated:
-        unread_notifications = Notification.objects.filter(
-            user=request.user,
-            is_read=False
-        )
-        unread_notifications_count = unread_notifications.count()
+        unread_notifications_count = request.user.unread_notifications
+        if settings.NOTIFICATION_STREAMING:
+            notification_stream_url = reverse('notification_stream')
     
     return {
-        'unread_notifications_count': unread_notifications_count
+        'unread_notifications_count': unread_notifications_count,
+        'notification_stream_url': notification_stream_url
     }
 
 
@@ -174,6 +174,81 @@ DATABASES = {
     )
 }
 
+# How booking/session overlaps are enforced: 'application' runs the overlap
+# queries in clean() before saving, 'database' relies on the PostgreSQL
+# exclusion constraints installed by `manage.py overlap_constraints`
+# (other backends fall back to locked pre-checks)
+BOOKING_OVERLAP_ENFORCEMENT = config('BOOKING_OVERLAP_ENFORCEMENT', default='application')
+
+# How approved recurring sessions become lab sessions: 'materialize' writes
+# a LabSession row for every occurrence on approval, 'lazy' keeps the series
+# compact and expands occurrences for the requested window at read time
+RECURRING_SESSION_EXPANSION = config('RECURRING_SESSION_EXPANSION', default='materialize')
+
+# With 'lazy' expansion, days ahead (from today) whose occurrences get rows
+# for attendance from the materialize_recurring_occurrences task
+RECURRING_MATERIALIZE_DAYS = config('RECURRING_MATERIALIZE_DAYS', default=7, cast=int)
+
+# Days ahead (from today) whose occupancy grids the build_occupancy_grids
+# task stores; week views of other windows are swept in memory
+OCCUPANCY_GRID_DAYS = config('OCCUPANCY_GRID_DAYS', default=8, cast=int)
+
+# Cache (Redis when CACHE_URL is set, otherwise per-process memory).
+# Deployments with more than one process need the shared cache: report
+# invalidation bumps version counters held in it, which a per-process
+# cache never shows to the other processes
+CACHE_URL = config('CACHE_URL', default='')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
+
+# Live notifications: channel carrying new notifications to the streams of
+# the ASGI workers (Redis pub/sub URL; empty keeps them in-process), and
+# whether pages open a stream (the proxy must route /notifications/stream/
+# to the ASGI service) instead of polling
+NOTIFICATION_CHANNEL_URL = config('NOTIFICATION_CHANNEL_URL', default='')
+NOTIFICATION_STREAMING = config('NOTIFICATION_STREAMING', default=False, cast=bool)
+
+# Read notifications older than this many days are archived to
+# NOTIFICATION_ARCHIVE_DIR (gzipped JSON Lines per month) and deleted
+NOTIFICATION_RETENTION_DAYS = config('NOTIFICATION_RETENTION_DAYS', default=90, cast=int)
+NOTIFICATION_ARCHIVE_DIR = config('NOTIFICATION_ARCHIVE_DIR', default=str(BASE_DIR / 'archive' / 'notifications'))
+
+# Local hour at which daily notification digests are sent
+NOTIFICATION_DIGEST_HOUR = config('NOTIFICATION_DIGEST_HOUR', default=8, cast=int)
+
+# Students per page of the report usage ranking
+REPORT_TOP_STUDENTS = config('REPORT_TOP_STUDENTS', default=50, cast=int)
+
+# Days of daily usage rollups rebuilt every night, catching changes that
+# reached the database without passing through the model signals
+USAGE_ROLLUP_RECONCILE_DAYS = config('USAGE_ROLLUP_RECONCILE_DAYS', default=7, cast=int)
+
+# Seconds a computed report is cached; edits to its data invalidate it
+# sooner, but only through a shared cache, so without CACHE_URL reports
+# are kept for a minute at most. Concurrent requests for a report being
+# computed wait up to REPORT_CACHE_WAIT seconds (5 at most) for that result
+# and then compute it themselves.
+REPORT_CACHE_TIMEOUT = config(
+    'REPORT_CACHE_TIMEOUT', default=60 * 60 * 24 * 7 if CACHE_URL else 60, cast=int
+)
+REPORT_CACHE_WAIT = config('REPORT_CACHE_WAIT', default=3, cast=float)
+
+# Directory of the PDF and HTML report documents rendered by the workers,
+# shared with the web servers that let admins download them
+REPORT_ARTIFACT_DIR = config('REPORT_ARTIFACT_DIR', default=str(BASE_DIR / 'media' / 'reports'))
 
 
 # Password validation
@@ -251,6 +326,34 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'booking.tasks.broadcast_scheduled_announcements',
         'schedule': crontab(minute='0', hour='*'),  # Run every hour at the top of the hour
     },
+    'drain-email-outbox': {
+        'task': 'booking.tasks.drain_email_outbox',
+        'schedule': crontab(minute='*/1'),  # Catch up on emails whose immediate drain was not queued
+    },
+    'send-notification-digests': {
+        'task': 'booking.tasks.send_notification_digests',
+        'schedule': crontab(minute='0'),  # Run every hour; daily digests go out at NOTIFICATION_DIGEST_HOUR
+    },
+    'materialize-recurring-occurrences': {
+        'task': 'booking.tasks.materialize_recurring_occurrences',
+        'schedule': crontab(minute='5'),  # Run every hour; only does anything with lazy expansion
+    },
+    'build-occupancy-grids': {
+        'task': 'booking.tasks.build_occupancy_grids',
+        'schedule': crontab(minute='10'),  # Run every hour; stores only the grids that are missing
+    },
+    'purge-old-notifications': {
+        'task': 'booking.tasks.purge_old_notifications',
+        'schedule': crontab(minute='30', hour='3'),  # Run daily at 3:30 AM
+    },
+    'reconcile-usage-rollups': {
+        'task': 'reports.tasks.reconcile_usage_rollups',
+        'schedule': crontab(minute='15', hour='2'),  # Run daily at 2:15 AM
+    },
+    'purge-report-artifacts': {
+        'task': 'reports.tasks.purge_report_artifacts',
+        'schedule': crontab(minute='45', hour='3'),  # Run daily at 3:45 AM
+    },
 }
 
 # Add these settings for the host validation middleware
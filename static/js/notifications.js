@@ -10,31 +10,63 @@ function initNotifications() {
         Notification.requestPermission();
     }
     
-    // Start polling for new notifications
-    checkNewNotifications();
+    // Listen on the notification stream when the server offers one,
+    // otherwise poll for new notifications
+    const streamUrl = document.body.dataset.notificationStream;
+    if (streamUrl && "EventSource" in window) {
+        listenForNotifications(streamUrl);
+    } else {
+        checkNewNotifications();
+    }
 }
 
+function listenForNotifications(streamUrl) {
+    // The server pushes each new notification and the unread count; the
+    // browser reconnects by itself and is replayed what it missed
+    const stream = new EventSource(streamUrl);
+    
+    stream.addEventListener('notification', event => {
+        announceNotification(JSON.parse(event.data));
+    });
+    stream.addEventListener('count', event => {
+        updateNotificationBadge(JSON.parse(event.data).count);
+    });
+}
+
+function announceNotification(notification) {
+    if (notification.notification_type === 'booking_ending') {
+        showBrowserNotification(
+            'Booking Ending Soon', 
+            notification.message, 
+            '/notifications/' + notification.id + '/'
+        );
+    }
+}
+
+// Id of the newest notification already seen; null until the first poll
+let notificationCursor = null;
+
 function checkNewNotifications() {
-    // Poll server for new notifications every 30 seconds
+    // Poll server for new notifications every 30 seconds. Only notifications
+    // newer than the cursor are sent, and an unchanged list answers 304,
+    // which the browser turns back into its cached response.
     setInterval(() => {
-        fetch('/notifications/unread/json/')
+        const url = notificationCursor === null
+            ? '/notifications/unread/json/'
+            : '/notifications/unread/json/?since=' + notificationCursor;
+        const isFirstPoll = notificationCursor === null;
+        
+        fetch(url, {credentials: 'same-origin'})
             .then(response => response.json())
             .then(data => {
-                if (data.count > 0) {
-                    // We have new notifications
-                    data.notifications.forEach(notification => {
-                        if (notification.notification_type === 'booking_ending') {
-                            showBrowserNotification(
-                                'Booking Ending Soon', 
-                                notification.message, 
-                                '/notifications/' + notification.id + '/'
-                            );
-                        }
-                    });
-                    
-                    // Update notification count in the UI
-                    updateNotificationBadge(data.count);
+                // Notifications already unread when the page loaded are not announced
+                if (!isFirstPoll) {
+                    data.notifications.forEach(announceNotification);
                 }
+                notificationCursor = data.cursor;
+                
+                // Update notification count in the UI
+                updateNotificationBadge(data.count);
             });
     }, 30000);
 }